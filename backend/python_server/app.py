@@ -1,29 +1,187 @@
 # app.py
-from fastapi import FastAPI, File, UploadFile, Body, HTTPException, Form
+from fastapi import FastAPI, File, UploadFile, Body, HTTPException, Form, Query, Header, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel
 from pathlib import Path
 from io import BytesIO
 from PIL import Image
-import base64
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import List, Literal, Optional
+import asyncio
+import math
+import shutil
 import tempfile
-import cv2
+import uuid
+import zipfile
 import numpy as np
 import os
 from starlette.concurrency import run_in_threadpool
 
 # Import your existing analysis/generation functions
 # (Make sure these modules are on PYTHONPATH or in same package)
-from math_analysis import symmetry, fractal_dimension_boxcount
-from image_analysis import generate_kolam, img_to_img
+from math_analysis import (
+    ANALYSIS_MAX_SIDE, DEFAULT_METRICS, MAX_IMAGE_PIXELS, ImageTooLarge, KolamImage, METRICS, check_image_size,
+    image_size,
+)
+from image_analysis import NotConfigured, agenerate_kolam, aimg_to_img, get_client, is_api_error
+from kolam_classifier import classifier, template_for
+from templates import registry as template_registry
+from workers import AnalysisPool, PoolBusy, WorkerCrashed, run_metric, render_figure, analyze_image, warm_worker
+from encoding import (
+    RESPONSE_FORMATS, MultipartWriter, encode_image, reencode, to_base64, media_type, negotiate_format,
+)
+from similarity import KolamIndex
+from procedural import STROKES, kolam_for_prompt
+from diffusion_service import (
+    DIFFUSION_NEGATIVE_PROMPT, DIFFUSION_PRELOAD, diffusion_available, get_service as get_diffusion_service,
+)
+from cache import ResultCache, cache_key
+from jobs import JobQueue, QueueFull, check_callback_url
+from metrics import MetricsMiddleware, Gauge, render_metrics, stage
+from batch import (
+    BATCH_CONCURRENCY, BatchStore, file_source, zip_sources, resolve_directory, directory_sources,
+)
+
+# CPU-bound analysis runs in worker processes (see workers.py for the knobs)
+analysis_pool = AnalysisPool()
+kolam_index = KolamIndex()
+generation_cache = ResultCache()
+# Queued generation jobs for /jobs/* (see jobs.py)
+job_queue = JobQueue()
+batches = BatchStore()
+# Prompt -> kolam type; the model path shares the similarity index's encoder when it is the same model
+if classifier.model_name == kolam_index.model_name:
+    classifier.model_loader = kolam_index.model
+# Local diffusion backend; the pipeline loads on first use (or at startup with KOLAM_DIFFUSION_PRELOAD=1)
+diffusion = get_diffusion_service(negative_prompt=DIFFUSION_NEGATIVE_PROMPT)
+
+
+# ---------- startup warm-up ----------
+# component -> "pending", "ready", "unavailable: <why>" or "failed: <why>"
+readiness: "OrderedDict[str, str]" = OrderedDict()
+# /ready waits for these; the others only report (their endpoints answer 503 meanwhile)
+REQUIRED_COMPONENTS = ("analysis",)
+
+
+def warm_analysis():
+    """Spawn the analysis workers; in threadpool mode import the heavy modules here instead."""
+    analysis_pool.start()
+    if analysis_pool.workers <= 0:
+        warm_worker()
+
+
+def warm_diffusion():
+    if not DIFFUSION_PRELOAD:
+        raise LookupError("loads on first use (KOLAM_DIFFUSION_PRELOAD=0)")
+    if not diffusion_available():
+        raise ImportError("torch/diffusers are not installed")
+    diffusion.load()
+
+
+def warm_classifier():
+    """Load the prompt classifier's encoder and prototypes; without them prompts match keywords only."""
+    if classifier.load() is None:
+        raise LookupError(f"keywords only: {classifier.model_error}")
+
+
+WARMUP_STEPS = [
+    ("analysis", warm_analysis),
+    ("similarity_index", kolam_index.load),
+    ("classifier", warm_classifier),
+    ("gemini_client", get_client),
+    ("diffusion", warm_diffusion),
+]
+
+
+async def warm_up():
+    """
+    Load the slow parts one by one in the threadpool after startup, so the
+    server accepts connections at once and /ready reports when they are done.
+    """
+    for name, _ in WARMUP_STEPS:
+        readiness[name] = "pending"
+    for name, load in WARMUP_STEPS:
+        try:
+            with stage(f"warmup.{name}"):
+                await run_in_threadpool(load)
+            readiness[name] = "ready"
+        except (ImportError, OSError, LookupError, NotConfigured) as e:
+            readiness[name] = f"unavailable: {e}"
+        except Exception as e:
+            readiness[name] = f"failed: {e}"
+            print(f"Warm-up of {name} failed: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await run_in_threadpool(template_registry.load)
+    await job_queue.start(run_generation_job)
+    warmup = asyncio.ensure_future(warm_up())
+    yield
+    warmup.cancel()
+    await asyncio.gather(warmup, return_exceptions=True)
+    await job_queue.stop()
+    await run_in_threadpool(analysis_pool.shutdown)
+    generation_cache.close()
+
+
+# ---------- upload limits ----------
+# Largest single image upload (also per zip member), and largest batch upload request
+MAX_UPLOAD_BYTES = int(float(os.getenv("KOLAM_MAX_UPLOAD_MB", "25")) * 1024 * 1024)
+MAX_BATCH_UPLOAD_BYTES = int(float(os.getenv("KOLAM_MAX_BATCH_UPLOAD_MB", "1024")) * 1024 * 1024)
+UPLOAD_CHUNK = 1024 * 1024
+
+
+class BodyLimitMiddleware:
+    """
+    Refuse (413) request bodies over their route's limit while they arrive,
+    before Starlette spools a multipart upload: up front from Content-Length,
+    otherwise as soon as the received bytes pass it. `slack` allows for the
+    multipart framing and form fields around the file.
+    """
+
+    def __init__(self, app, limit: int, limits: Optional[dict] = None, slack: int = UPLOAD_CHUNK):
+        self.app = app
+        self.limit = limit
+        self.limits = limits or {}
+        self.slack = slack
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        limit = self.limits.get(scope["path"], self.limit)
+        length = dict(scope.get("headers") or []).get(b"content-length", b"")
+        if length.isdigit() and int(length) > limit + self.slack:
+            response = JSONResponse(status_code=413, content={"detail": upload_too_large(limit).detail})
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit + self.slack:
+                    raise upload_too_large(limit)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
 
 app = FastAPI(
     title="Kolam API",
     description="API to create and analyse Kolams",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
 )
 
+app.add_middleware(BodyLimitMiddleware, limit=MAX_UPLOAD_BYTES,
+                   limits={"/math_analysis/batch": MAX_BATCH_UPLOAD_BYTES})
+app.add_middleware(MetricsMiddleware, router=app.router)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # For dev; tighten in production
@@ -32,222 +190,892 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.exception_handler(PoolBusy)
+async def pool_busy_handler(request, exc: PoolBusy):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+@app.exception_handler(WorkerCrashed)
+async def worker_crashed_handler(request, exc: WorkerCrashed):
+    return JSONResponse(status_code=503, content={"detail": str(exc)})
+
+
+@app.exception_handler(QueueFull)
+async def queue_full_handler(request, exc: QueueFull):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
 UPLOAD_DIR = Path("uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
 
+# How many JSON-mode analyses to keep around for lazy figure rendering
+ANALYSIS_CACHE_SIZE = int(os.getenv("KOLAM_ANALYSIS_CACHE_SIZE", "128"))
+# ...and their images plus rendered figures may hold at most this much memory
+ANALYSIS_CACHE_BYTES = int(float(os.getenv("KOLAM_ANALYSIS_CACHE_MB", "64")) * 1024 * 1024)
+
 # ---------- utilities ----------
+def image_to_png(img) -> memoryview:
+    """
+    Encode a PIL.Image or OpenCV numpy array (BGR) as PNG; returns a zero-copy buffer view.
+    """
+    return encode_image(img, "png")
+
+
 def image_to_base64(img) -> str:
     """
-    Convert a PIL.Image or OpenCV numpy array (BGR) to a base64 PNG string (no prefix).
+    Convert a PIL.Image, OpenCV numpy array (BGR) or already-encoded PNG bytes/buffer
+    to a base64 PNG string (no prefix).
+    """
+    png = img if isinstance(img, (bytes, memoryview)) else image_to_png(img)
+    return to_base64(png)
+
+
+ResponseFormat = Literal[RESPONSE_FORMATS]
+
+
+class EncodeOptions:
+    """Query parameters selecting the encoder for binary responses."""
+
+    def __init__(
+        self,
+        format: Optional[ResponseFormat] = Query(
+            None, description="json (default), png, webp, jpeg, multipart or svg (procedural kolams)"),
+        quality: Optional[int] = Query(None, ge=1, le=100, description="JPEG/WebP quality"),
+        compress_level: Optional[int] = Query(None, ge=0, le=9, description="PNG compression level"),
+        accept: Optional[str] = Header(None),
+    ):
+        self.requested = format
+        self.accept = accept
+        self.quality = quality
+        self.compress_level = compress_level
+
+    def negotiate(self, multi: bool = False, vector: bool = False) -> str:
+        fmt = negotiate_format(self.requested, self.accept, multi=multi, vector=vector)
+        if fmt == "multipart" and not multi:
+            raise HTTPException(status_code=406, detail="multipart is only available for multi-image responses")
+        if fmt == "svg" and not vector:
+            raise HTTPException(status_code=406, detail="svg is only available for procedural kolams")
+        return fmt
+
+    def encoder(self, fmt: str) -> dict:
+        return {"fmt": fmt, "quality": self.quality, "compress_level": self.compress_level}
+
+
+def image_response(png, fmt: str, encode: EncodeOptions, headers: Optional[dict] = None) -> Response:
+    """Return an encoded PNG (re-encoded to `fmt` if needed) as a raw image response."""
+    data = reencode(png, fmt, encode.quality, encode.compress_level)
+    return Response(content=data, media_type=media_type(fmt), headers=headers)
+
+
+def to_jsonable(value):
+    """
+    Recursively convert numpy arrays/scalars inside dicts and lists to plain Python types.
+    NaN/inf (e.g. lacunarity of a blank image) become None, which JSON can carry.
+    """
+    if isinstance(value, dict):
+        return {k: to_jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_jsonable(v) for v in value]
+    if isinstance(value, np.ndarray):
+        return to_jsonable(value.tolist())
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+# ---------- analysis store (for lazily rendered figures) ----------
+_analyses: "OrderedDict[str, dict]" = OrderedDict()
+_analyses_bytes = 0
+
+
+def _entry_bytes(entry: dict) -> int:
+    return entry["kolam"].nbytes + sum(len(figure) for figure in entry["figures"].values())
+
+
+def _evict_analyses():
+    """Drop least recently used entries beyond ANALYSIS_CACHE_SIZE or ANALYSIS_CACHE_BYTES (keeping the newest)."""
+    global _analyses_bytes
+    while len(_analyses) > 1 and (len(_analyses) > ANALYSIS_CACHE_SIZE or _analyses_bytes > ANALYSIS_CACHE_BYTES):
+        _, entry = _analyses.popitem(last=False)
+        _analyses_bytes -= _entry_bytes(entry)
+
+
+def remember_analysis(kolam: KolamImage, results: dict) -> str:
+    """
+    Keep an analysis (a reduced figure view of the image + numbers) so its
+    figures can be rendered later.
     """
-    if img is None:
-        raise ValueError("image_to_base64: img is None")
+    global _analyses_bytes
+    analysis_id = uuid.uuid4().hex
+    entry = {"kolam": kolam.figure_view(), "results": results, "figures": {}}
+    _analyses[analysis_id] = entry
+    _analyses_bytes += _entry_bytes(entry)
+    _evict_analyses()
+    return analysis_id
+
+
+def remember_figure(analysis_id: str, key: tuple, figure: bytes):
+    """Cache a rendered figure with its analysis, counted against ANALYSIS_CACHE_BYTES."""
+    global _analyses_bytes
+    entry = _analyses.get(analysis_id)
+    if entry is None or key in entry["figures"]:
+        return
+    entry["figures"][key] = figure
+    _analyses_bytes += len(figure)
+    _evict_analyses()
+
 
-    if isinstance(img, np.ndarray):
-        # assume OpenCV BGR -> convert to RGB
-        if img.ndim == 3 and img.shape[2] == 3:
-            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        img = Image.fromarray(img)
+def recall_analysis(analysis_id: str) -> dict:
+    entry = _analyses.get(analysis_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired analysis_id")
+    _analyses.move_to_end(analysis_id)
+    return entry
 
-    if not isinstance(img, Image.Image):
-        raise TypeError("image_to_base64 expects a PIL.Image or numpy.ndarray")
 
-    buf = BytesIO()
-    img.save(buf, format="PNG")
-    return base64.b64encode(buf.getvalue()).decode("utf-8")
+def upload_too_large(limit: int) -> HTTPException:
+    return HTTPException(status_code=413, detail=f"Upload exceeds {limit // (1024 * 1024)} MB")
 
 
-async def save_upload(file: UploadFile, dest: Path) -> Path:
+async def read_upload(file: UploadFile, limit: int = MAX_UPLOAD_BYTES) -> bytes:
     """
-    Save FastAPI UploadFile to disk asynchronously.
+    Read an upload in chunks, refusing it (413) as soon as it passes `limit`
+    instead of after buffering all of it.
     """
-    with dest.open("wb") as f:
+    if file.size is not None and file.size > limit:
+        raise upload_too_large(limit)
+    buf = bytearray()
+    with stage("upload.read"):
         while True:
-            chunk = await file.read(1024 * 1024)
+            chunk = await file.read(UPLOAD_CHUNK)
             if not chunk:
                 break
+            buf += chunk
+            if len(buf) > limit:
+                raise upload_too_large(limit)
+    return bytes(buf)
+
+
+def check_upload_image(contents: bytes):
+    """Refuse (413) images whose header reports more than MAX_IMAGE_PIXELS, before decoding."""
+    try:
+        check_image_size(image_size(contents))
+    except ImageTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+
+async def save_upload(file: UploadFile, dest: Path, limit: int = MAX_UPLOAD_BYTES) -> Path:
+    """
+    Save FastAPI UploadFile to disk asynchronously, refusing (413) files over `limit`.
+    """
+    if file.size is not None and file.size > limit:
+        raise upload_too_large(limit)
+    written = 0
+    with stage("upload.write"), dest.open("wb") as f:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK)
+            if not chunk:
+                break
+            written += len(chunk)
+            if written > limit:
+                f.close()
+                dest.unlink(missing_ok=True)
+                raise upload_too_large(limit)
             f.write(chunk)
     await file.close()
     return dest
 
 
-# ---------- Kolam mapping ----------
-def get_kolam_type(user_input: str) -> str:
-    """
-    Map user input string to a canonical kolam keyword.
-    Returns one of:
-      pulli_kolam, sikku_kolam, kambi_kolam, chikku_kolam, rangoli_kolam, isai_kolam
-    or "unknown" if none matched.
-    """
-    if user_input is None:
-        return "unknown"
-    text = user_input.lower()
-
-    # synonyms / English hints
-    mapping_checks = [
-        (["pulli", "dot"], "pulli_kolam"),
-        (["sikku", "twist", "twisted"], "sikku_kolam"),
-        (["kambi", "line"], "kambi_kolam"),
-        (["chikku", "loop"], "chikku_kolam"),
-        (["rangoli", "color", "colour", "colourful"], "rangoli_kolam"),
-        (["isai", "music", "musical"], "isai_kolam"),
-    ]
-
-    for keywords, keyword_out in mapping_checks:
-        for kw in keywords:
-            if kw in text:
-                return keyword_out
-
-    # fallback: try to find close match using substrings
-    short = text.replace(" ", "")
-    if "pulli" in short or "dot" in short:
-        return "pulli_kolam"
-    if "sikku" in short or "twist" in short:
-        return "sikku_kolam"
-    if "kambi" in short or "line" in short:
-        return "kambi_kolam"
-    if "chikku" in short or "loop" in short:
-        return "chikku_kolam"
-    if "rangoli" in short or "color" in short or "colour" in short:
-        return "rangoli_kolam"
-    if "isai" in short or "music" in short:
-        return "isai_kolam"
-
-    return "unknown"
-
-
 # ---------- Request models ----------
 class GenerateRequest(BaseModel):
     user_input: str
 
 # ---------- Routes ----------
+ANALYSIS_PENDING = Gauge("kolam_analysis_pending", "Analysis tasks queued or running in the pool.")
+ANALYSIS_RESTARTS = Gauge("kolam_analysis_pool_restarts", "Times the analysis pool was replaced after a worker died.")
+JOBS_QUEUED = Gauge("kolam_jobs_queued", "Generation jobs waiting for a worker.")
+JOBS_RUNNING = Gauge("kolam_jobs_running", "Generation jobs being processed.")
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Prometheus text exposition of request, stage, upstream and queue metrics."""
+    ANALYSIS_PENDING.set(analysis_pool.pending)
+    ANALYSIS_RESTARTS.set(analysis_pool.restarts)
+    JOBS_QUEUED.set(len(job_queue.queued_tasks))
+    JOBS_RUNNING.set(len(job_queue.running_tasks))
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/")
 def read_root():
     return {"message": "Welcome to Kolam API"}
 
 
+@app.get("/ready")
+def ready():
+    """
+    Readiness probe: 200 once the analysis workers are warm, 503 before.
+    Lists every warm-up component's state either way.
+    """
+    is_ready = all(readiness.get(name) == "ready" for name in REQUIRED_COMPONENTS)
+    return JSONResponse(status_code=200 if is_ready else 503,
+                        content={"ready": is_ready, "components": readiness})
+
+
+def decode_kolam(contents: bytes) -> KolamImage:
+    with stage("decode"):
+        return KolamImage.from_bytes(contents, ANALYSIS_MAX_SIDE, MAX_IMAGE_PIXELS)
+
+
+async def decode_upload(file: UploadFile) -> KolamImage:
+    """
+    Read an upload into memory (size-capped) and decode it once for all metric
+    stages, reduced to ANALYSIS_MAX_SIDE at decode time.
+    """
+    contents = await read_upload(file)
+    try:
+        return await run_in_threadpool(decode_kolam, contents)
+    except ImageTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def select_metrics(metrics: Optional[List[str]]) -> List[str]:
+    """The requested metric names (DEFAULT_METRICS when none), 400 on unknown ones."""
+    names = list(metrics or DEFAULT_METRICS)
+    unknown = [name for name in names if name not in METRICS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown metrics: {unknown}; choose from {sorted(METRICS)}")
+    return names
+
+
 @app.post("/math_analysis")
-async def math_analysis(file: UploadFile = File(...)):
+async def math_analysis(
+    file: UploadFile = File(...),
+    mode: Literal["figures", "json"] = Query("figures"),
+    metrics: Optional[List[str]] = Query(None, description="Default: symmetry and fractal_dimension"),
+    encode: EncodeOptions = Depends(),
+):
     """
     Accepts an uploaded image and returns:
       - `symmetry`: PNG data URI for symmetry visualization
       - `fractal_dimension`: PNG data URI for fractal-dimension visualization
+      - `rotation`: PNG data URI for rotational (C_n) symmetry visualization,
+        only when asked for with `metrics=rotation` (repeat `metrics` for several)
+
+    With `mode=json` no figures are rendered; instead it returns the raw numbers
+    (angles/scores, detected axes, box sizes/counts, fit coefficients and D,
+    lacunarity and generalized dimensions D(q), rotation order and centre), an
+    `analysis_id`, and `figures` URLs that render each plot on demand.
+
+    Asking for `format=multipart` (or `Accept: multipart/mixed`) streams one
+    image part per figure as soon as it is rendered, followed by a JSON part with
+    the numbers. `format=png|webp|jpeg` does the same with that image encoding.
     """
-    # Save uploaded file temporarily
-    contents = await file.read()
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp:
-        tmp.write(contents)
-        tmp_path = tmp.name
+    names = select_metrics(metrics)
+    kolam = await decode_upload(file)
+
+    if mode == "json":
+        outputs = await analysis_pool.run_all([(run_metric, (name, kolam), {}) for name in names])
+        results = {name: result for name, (result, _) in zip(names, outputs)}
+        analysis_id = remember_analysis(kolam, results)
+        content = {name: to_jsonable(result) for name, result in results.items()}
+        content["analysis_id"] = analysis_id
+        content["figures"] = {
+            name: f"/math_analysis/{analysis_id}/figures/{name}" for name in results
+        }
+        return JSONResponse(content=content)
+
+    fmt = encode.negotiate(multi=True)
+    image_fmt = "png" if fmt in ("json", "multipart") else fmt
+
+    # Each metric runs in its own worker process, in parallel. The worker renders
+    # and encodes too, so only the encoded figure crosses the process boundary.
+    calls = [(run_metric, (name, kolam), {"render": True, "encode": encode.encoder(image_fmt)}) for name in names]
+
+    if fmt == "json":
+        outputs = await analysis_pool.run_all(calls)
+        content = {}
+        for name, (_, png) in zip(names, outputs):
+            content[name] = f"data:image/png;base64,{to_base64(png)}"
+        return JSONResponse(content=content)
+
+    tasks = analysis_pool.submit_all(calls)
+    writer = MultipartWriter()
+
+    async def named(name, task):
+        return name, await task
+
+    async def parts():
+        results = {}
+        for next_done in asyncio.as_completed([named(name, task) for name, task in zip(names, tasks)]):
+            name, (result, figure) = await next_done
+            results[name] = to_jsonable(result)
+            yield writer.part(name, figure, media_type(image_fmt), filename=f"{name}.{image_fmt}")
+        yield writer.json_part("results", results)
+        yield writer.close()
+
+    return StreamingResponse(parts(), media_type=writer.content_type)
+
+
+@app.get("/math_analysis/{analysis_id}/figures/{name}")
+async def math_analysis_figure(analysis_id: str, name: str, encode: EncodeOptions = Depends()):
+    """
+    Render (once per encoding) and return a figure for an analysis made with
+    `mode=json`. PNG unless `format=webp|jpeg` or the Accept header asks otherwise.
+    """
+    entry = recall_analysis(analysis_id)
+    if name not in entry["results"]:
+        raise HTTPException(status_code=404, detail=f"Unknown figure {name!r}")
+
+    fmt = encode.negotiate()
+    fmt = "png" if fmt == "json" else fmt
+    options = encode.encoder(fmt)
+    key = (name, *options.values())
+    figure = entry["figures"].get(key)
+    if figure is None:
+        figure = await analysis_pool.run(render_figure, name, entry["kolam"], entry["results"][name], **options)
+        remember_figure(analysis_id, key, figure)
+    return Response(content=figure, media_type=media_type(fmt))
 
+
+# ---------- batch analysis ----------
+async def stage_batch_uploads(files: List[UploadFile], workdir: Path, archives: list):
+    """
+    Copy uploads to `workdir` (they outlive the request) and expand zips into
+    sources; opened zips go to `archives` for the batch to close.
+    """
+    sources = []
+    for i, file in enumerate(files):
+        name = Path(file.filename or f"upload-{i}").name
+        dest = await save_upload(file, workdir / f"{i}-{name}", MAX_BATCH_UPLOAD_BYTES)
+        if name.lower().endswith(".zip") or file.content_type in ("application/zip", "application/x-zip-compressed"):
+            prefix = f"{name}/" if len(files) > 1 else ""
+            archive = await run_in_threadpool(zipfile.ZipFile, dest)
+            archives.append(archive)
+            sources.extend(zip_sources(archive, MAX_UPLOAD_BYTES, prefix))
+        else:
+            sources.append(file_source(dest, name))
+    return sources
+
+
+def batch_analyzer(names):
+    """One pool task per image (decode + metrics); waits out PoolBusy instead of failing."""
+    async def analyze(data):
+        while True:
+            try:
+                return to_jsonable(await analysis_pool.run(analyze_image, data, names))
+            except PoolBusy as e:
+                await asyncio.sleep(e.retry_after)
+    return analyze
+
+
+def batch_stream(batch, cursor: int = 0) -> StreamingResponse:
+    return StreamingResponse(
+        batch.follow(cursor),
+        media_type="application/x-ndjson",
+        headers={"X-Kolam-Batch-Id": batch.id, "Location": f"/math_analysis/batch/{batch.id}"},
+    )
+
+
+def get_batch(batch_id: str):
     try:
-        # Call your processing functions (they may be CPU-bound -> optionally run_in_threadpool)
-        # Use run_in_threadpool to avoid blocking the event loop if functions are heavy.
-        sym = await run_in_threadpool(symmetry, tmp_path)
-        frac_img = await run_in_threadpool(fractal_dimension_boxcount, tmp_path, 128)
-
-        # Convert results to base64 PNGs
-        if isinstance(sym, np.ndarray):
-            # Assume BGR -> convert
-            sym = cv2.cvtColor(sym, cv2.COLOR_BGR2RGB)
-            sym = Image.fromarray(sym)
-
-        if isinstance(frac_img, np.ndarray):
-            frac_img = cv2.cvtColor(frac_img, cv2.COLOR_BGR2RGB)
-            frac_img = Image.fromarray(frac_img)
-
-        sym_b64 = image_to_base64(sym)
-        frac_b64 = image_to_base64(frac_img)
-
-        return JSONResponse(content={
-            "symmetry": f"data:image/png;base64,{sym_b64}",
-            "fractal_dimension": f"data:image/png;base64,{frac_b64}"
-        })
-    finally:
+        return batches.get(batch_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown batch id {batch_id}")
+
+
+@app.post("/math_analysis/batch")
+async def math_analysis_batch(
+    files: List[UploadFile] = File(None),
+    directory: Optional[str] = Form(None),
+    metrics: Optional[List[str]] = Query(None),
+):
+    """
+    Analyse many images in one request: upload `files` (images and/or zip
+    archives), or name a `directory` below the server's KOLAM_BATCH_ROOT.
+
+    Returns NDJSON: a `batch` header line, then one line per image as it
+    completes (`name`, `results` or `error`, and a `cursor`), then a `done`
+    line. The batch keeps running if the connection drops; resume it with
+    GET /math_analysis/batch/{batch_id}?cursor=<last cursor seen>.
+    """
+    names = select_metrics(metrics)
+    if bool(files) == bool(directory):
+        raise HTTPException(status_code=400, detail="Send either files or a directory")
+
+    workdir = None if directory else Path(tempfile.mkdtemp(prefix="kolam-batch-"))
+    archives = []
+    try:
+        if directory:
+            sources = await run_in_threadpool(directory_sources, resolve_directory(directory))
+        else:
+            sources = await stage_batch_uploads(files, workdir, archives)
+        if not sources:
+            raise HTTPException(status_code=400, detail="No images found")
+    except Exception as e:
+        for archive in archives:
+            archive.close()
+        if workdir is not None:
+            shutil.rmtree(workdir, ignore_errors=True)
+        if isinstance(e, PermissionError):
+            raise HTTPException(status_code=403, detail=str(e))
+        if isinstance(e, FileNotFoundError):
+            raise HTTPException(status_code=404, detail=str(e))
+        if isinstance(e, zipfile.BadZipFile):
+            raise HTTPException(status_code=400, detail=f"Bad zip archive: {e}")
+        raise
+
+    # Leave half the pool's pending slots to interactive requests by default
+    concurrency = BATCH_CONCURRENCY or max(analysis_pool.max_pending // 2, 1)
+    batch = batches.start(sources, batch_analyzer(names), concurrency, workdir=workdir, archives=archives)
+    return batch_stream(batch)
+
+
+@app.get("/math_analysis/batch/{batch_id}")
+async def math_analysis_batch_follow(batch_id: str, cursor: int = Query(0, ge=0)):
+    """Stream a batch's NDJSON records from `cursor` on (0 replays everything)."""
+    batch = get_batch(batch_id)
+    if cursor > len(batch.lines):
+        raise HTTPException(status_code=400, detail=f"cursor is past the {len(batch.lines)} records so far")
+    return batch_stream(batch, cursor)
+
+
+@app.delete("/math_analysis/batch/{batch_id}")
+async def math_analysis_batch_cancel(batch_id: str):
+    """Stop a running batch; records produced so far stay readable."""
+    return batches.cancel(batch_id).info()
+
+
+async def upstream_call(awaitable):
+    """
+    Await an upstream generation call, mapping timeouts to 504, API errors
+    (after the client's retries) to 502 and missing credentials to 503.
+    """
+    try:
+        return await awaitable
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Upstream model timed out")
+    except NotConfigured as e:
+        raise HTTPException(status_code=503, detail=f"Upstream model is not configured: {e}")
+    except Exception as e:
+        if is_api_error(e):
+            raise HTTPException(status_code=502, detail=f"Upstream model error: {e}")
+        raise
+
+
+# CLIP looks at 224 px; JPEG uploads for similarity are decoded at this size or just above
+EMBED_DECODE_SIDE = 512
+
+
+def open_upload_image(contents: bytes, draft_side: Optional[int] = None) -> Image.Image:
+    try:
+        img = Image.open(BytesIO(contents))
+        if draft_side:
+            # JPEG only: let the decoder scale down by 1/2..1/8 instead of decoding every pixel
+            img.draft("RGB", (draft_side, draft_side))
+        img.load()
+        return img
+    except Exception:
+        raise HTTPException(status_code=400, detail="Could not decode image data")
+
+
+async def require_index():
+    """503 unless the index is loaded and its embedding model can be loaded (first call loads it)."""
+    if not kolam_index.loaded:
+        raise HTTPException(status_code=503, detail="Similarity index is not available")
+    try:
+        await run_in_threadpool(kolam_index.model)
+    except (ImportError, OSError) as e:
+        raise HTTPException(status_code=503, detail=f"Similarity embedding model is not available: {e}")
+
+
+@app.post("/similar")
+async def similar(
+    file: UploadFile = File(...),
+    k: int = Query(5, ge=1, le=100),
+    nprobe: Optional[int] = Query(None, ge=1),
+):
+    """
+    Find the kolams in the index most similar to the uploaded image.
+    Returns the top-`k` matches (best first) with their metadata. `nprobe` tunes
+    recall/speed for IVF indexes and is ignored by flat ones.
+    """
+    await require_index()
+    contents = await read_upload(file)
+    check_upload_image(contents)
+    image = open_upload_image(contents, EMBED_DECODE_SIDE)
+    matches = await kolam_index.query(image, k=k, nprobe=nprobe)
+    return JSONResponse(content={"k": k, "matches": to_jsonable(matches)})
+
+
+@app.post("/similar/add")
+async def similar_add(
+    file: UploadFile = File(...),
+    caption: str = Form(""),
+):
+    """
+    Save an uploaded kolam and make it searchable immediately (no index rebuild).
+    """
+    await require_index()
+    suffix = Path(file.filename or "").suffix or ".png"
+    dest = await save_upload(file, UPLOAD_DIR / f"{uuid.uuid4().hex}{suffix}")
+    contents = dest.read_bytes()
+    try:
+        check_upload_image(contents)
+        image = open_upload_image(contents, EMBED_DECODE_SIDE)
+    except HTTPException:
+        # Nothing will reference an upload that cannot be decoded
+        dest.unlink(missing_ok=True)
+        raise
+    new_id = await run_in_threadpool(
+        kolam_index.add, image, {"file": str(dest), "caption": caption, "source": "upload"}
+    )
+    return JSONResponse(content={"id": new_id, "total": kolam_index.ntotal})
+
+
+def generation_response(png, kolam_keyword: str, user_input: str, cache_status: str,
+                        encode: EncodeOptions, backend: str = "gemini", svg: Optional[str] = None,
+                        headers: Optional[dict] = None) -> Response:
+    """
+    JSON with a data URI by default; raw image bytes when a binary format was
+    negotiated, or the SVG document when the drawing has one.
+    """
+    headers = {"X-Kolam-Cache": cache_status, "X-Kolam-Backend": backend, **(headers or {})}
+    fmt = encode.negotiate(vector=svg is not None)
+    if fmt != "json":
+        headers["X-Kolam-Keyword"] = kolam_keyword
+        if fmt == "svg":
+            return Response(content=svg, media_type=media_type("svg"), headers=headers)
+        return image_response(png, fmt, encode, headers=headers)
+
+    img_b64 = image_to_base64(png)
+    return JSONResponse(content={
+        "result": f"data:image/png;base64,{img_b64}",
+        "keyword": kolam_keyword,
+        "input": user_input,
+        "backend": backend,
+    }, headers=headers)
+
+
+async def generate_from_text(user_input: str, kolam_keyword: str):
+    """Text-to-kolam through the result cache. Returns (png, cache_status)."""
+    # The reference image is the resolved template; its digest keeps edited templates from hitting stale entries
+    template_type = template_for(kolam_keyword)
+    key = cache_key(user_input, template_type, reference_digest=template_registry.get(template_type).digest)
+
+    async def generate():
+        img = await agenerate_kolam(user_input, template_type)
+        return None if img is None else image_to_png(img)
+
+    png, cache_status = await upstream_call(generation_cache.get_or_compute(key, generate))
+
+    # Validate result
+    if png is None:
+        raise HTTPException(status_code=500, detail="generate_kolam returned None")
+    return png, cache_status
+
+
+async def generate_from_image(user_input: str, kolam_keyword: str, contents: bytes, content_type: str):
+    """Image+text-to-kolam through the result cache. Returns (png, cache_status)."""
+    key = cache_key(user_input, template_for(kolam_keyword), contents)
+
+    async def generate():
+        img = await aimg_to_img(user_input, contents, content_type)
+        return None if img is None else image_to_png(img)
+
+    try:
+        png, cache_status = await upstream_call(generation_cache.get_or_compute(key, generate))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
+
+    # Validate result
+    if png is None:
+        raise HTTPException(status_code=500, detail="img_to_img returned None")
+    return png, cache_status
+
+
+# ---------- procedural backend ----------
+# Backend used when a request does not pick one: gemini, procedural or auto
+GENERATION_BACKEND = os.getenv("KOLAM_GENERATION_BACKEND", "gemini")
+# auto: how long to wait for the model before answering with a procedural kolam
+AUTO_FALLBACK_SECONDS = float(os.getenv("KOLAM_AUTO_FALLBACK_SECONDS", "15"))
+
+GenerationBackend = Literal["gemini", "procedural", "diffusion", "auto"]
+
+
+class ProceduralOptions:
+    """Query parameters for the procedural backend; unset ones follow the prompt."""
+
+    def __init__(
+        self,
+        rows: Optional[int] = Query(None, ge=1, le=25, description="Dot rows (default: from the prompt, e.g. 7x7, else 5)"),
+        cols: Optional[int] = Query(None, ge=1, le=25, description="Dot columns (default: rows)"),
+        symmetry: int = Query(4, description="Rotational symmetry order: 1, 2 or 4 (square grids only)"),
+        reflect: bool = Query(True, description="Also mirror-symmetric"),
+        stroke: Optional[Literal[STROKES]] = Query(None, description="smooth or straight (default: by kolam type)"),
+        stroke_width: int = Query(3, ge=1, le=32),
+        size: int = Query(512, ge=64, le=4096),
+        seed: Optional[int] = Query(None, ge=0, description="Default: derived from the prompt"),
+    ):
+        self.rows = rows
+        self.cols = cols
+        self.symmetry = symmetry
+        self.reflect = reflect
+        self.stroke = stroke
+        self.stroke_width = stroke_width
+        self.size = size
+        self.seed = seed
+
+    def render(self, user_input: str, kolam_keyword: str):
+        """Blocking: (png, svg) of the procedural kolam for this prompt."""
         try:
-            os.remove(tmp_path)
-        except Exception:
-            pass
+            kolam = kolam_for_prompt(user_input, kolam_keyword, self.rows, self.cols, self.symmetry,
+                                     self.reflect, self.stroke, self.seed)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        with stage("procedural.render"):
+            img = kolam.raster(self.size, self.stroke_width)
+            svg = kolam.svg(self.size, self.stroke_width)
+        return image_to_png(img), svg
+
+
+async def generate_with_fallback(user_input: str, kolam_keyword: str):
+    """
+    generate_from_text within AUTO_FALLBACK_SECONDS. Returns ((png, cache_status), None),
+    or (None, reason) when the model timed out or failed. A call that misses the
+    deadline keeps running, so its result still lands in the cache.
+    """
+    task = asyncio.ensure_future(generate_from_text(user_input, kolam_keyword))
+    try:
+        return await asyncio.wait_for(asyncio.shield(task), AUTO_FALLBACK_SECONDS), None
+    except asyncio.TimeoutError:
+        # Retrieve the late outcome so a failure is not logged as "never retrieved"
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return None, "timeout"
+    except HTTPException as e:
+        if e.status_code in (502, 503, 504):
+            return None, "upstream_error"
+        raise
+
+
+async def generate_with_diffusion(user_input: str):
+    """Text-to-kolam on the local diffusion pipeline, through the result cache."""
+    if not diffusion_available():
+        raise HTTPException(status_code=503, detail="Local diffusion backend is not installed (torch, diffusers)")
+    # The fingerprint (model, dtype, steps, size, guidance) keeps different settings apart
+    key = cache_key(user_input, "diffusion", reference_digest=diffusion.fingerprint)
+
+    async def generate():
+        img, _ = await diffusion.generate(user_input)
+        return image_to_png(img)
+
+    try:
+        return await generation_cache.get_or_compute(key, generate)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Local diffusion failed: {e}")
+
+
+def validate_generation_input(user_input, file: Optional[UploadFile] = None):
+    if not isinstance(user_input, str) or user_input.strip() == "":
+        raise HTTPException(status_code=400, detail="user_input must be a non-empty string")
+    # Validate file type
+    if file is not None and (not file.content_type or not file.content_type.startswith('image/')):
+        raise HTTPException(status_code=400, detail="File must be an image")
+
 
 @app.post("/generate_image")
-async def image_generation(req: GenerateRequest = Body(...)):
+async def image_generation(
+    req: GenerateRequest = Body(...),
+    encode: EncodeOptions = Depends(),
+    backend: GenerationBackend = Query(GENERATION_BACKEND, description="gemini, procedural, diffusion or auto"),
+    drawing: ProceduralOptions = Depends(),
+):
     """
     Generate a Kolam image from `user_input` (text) and return:
       - result: data URI of generated PNG,
       - keyword: canonical kolam keyword deduced from user_input
+      - backend: which backend drew it
+
+    `format=png|webp|jpeg` (or a matching Accept header) returns the image bytes
+    instead, with the keyword in the `X-Kolam-Keyword` header.
+
+    `backend=procedural` draws the kolam locally on a dot grid in milliseconds
+    (also available as `format=svg`); `backend=auto` asks the model and falls
+    back to the procedural kolam when it is slow (KOLAM_AUTO_FALLBACK_SECONDS)
+    or unavailable, naming the reason in `X-Kolam-Fallback`. An SVG request in
+    auto mode goes straight to the procedural backend. `backend=diffusion` runs
+    the resident local diffusion pipeline (see diffusion_service.py).
     """
     user_input = req.user_input
-    if not isinstance(user_input, str) or user_input.strip() == "":
-        raise HTTPException(status_code=400, detail="user_input must be a non-empty string")
+    validate_generation_input(user_input)
 
     # Determine kolam keyword
-    kolam_keyword = get_kolam_type(user_input)
-
-    # Call the image generation (run in threadpool if blocking)
-    img = await run_in_threadpool(generate_kolam, user_input)
-
-    # Validate result
-    if img is None:
-        raise HTTPException(status_code=500, detail="generate_kolam returned None")
+    kolam_keyword = await classifier.classify(user_input)
+    headers = {}
+    if backend == "gemini":
+        png, cache_status = await generate_from_text(user_input, kolam_keyword)
+        return generation_response(png, kolam_keyword, user_input, cache_status, encode)
+    if backend == "diffusion":
+        png, cache_status = await generate_with_diffusion(user_input)
+        return generation_response(png, kolam_keyword, user_input, cache_status, encode, backend="diffusion")
+    if backend == "auto" and encode.negotiate(vector=True) != "svg":
+        result, fallback = await generate_with_fallback(user_input, kolam_keyword)
+        if result is not None:
+            png, cache_status = result
+            return generation_response(png, kolam_keyword, user_input, cache_status, encode)
+        headers["X-Kolam-Fallback"] = fallback
 
-    img_b64 = image_to_base64(img)
-    return JSONResponse(content={
-        "result": f"data:image/png;base64,{img_b64}",
-        "keyword": kolam_keyword,
-        "input": user_input
-    })
+    png, svg = await run_in_threadpool(drawing.render, user_input, kolam_keyword)
+    return generation_response(png, kolam_keyword, user_input, "bypass", encode,
+                               backend="procedural", svg=svg, headers=headers)
 
 @app.post("/img_img_gen")
 async def img_img_gen(
     file: UploadFile = File(...),
-    user_input: str = Form(...)
+    user_input: str = Form(...),
+    encode: EncodeOptions = Depends(),
 ):
     """
     Generate a Kolam image from uploaded image + text prompt and return:
       - result: data URI of generated PNG,
       - keyword: canonical kolam keyword deduced from user_input
       - input: the user input text
+
+    Supports the same binary `format` options as /generate_image.
     """
-    # Validate inputs
-    if not isinstance(user_input, str) or user_input.strip() == "":
-        raise HTTPException(status_code=400, detail="user_input must be a non-empty string")
-    
-    # Validate file type
-    if not file.content_type or not file.content_type.startswith('image/'):
-        raise HTTPException(status_code=400, detail="File must be an image")
+    validate_generation_input(user_input, file)
+    contents = await read_upload(file)
+    check_upload_image(contents)
 
-    # Save uploaded file temporarily
-    contents = await file.read()
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp:
-        tmp.write(contents)
-        tmp_path = tmp.name
+    # Determine kolam keyword
+    kolam_keyword = await classifier.classify(user_input)
+    png, cache_status = await generate_from_image(user_input, kolam_keyword, contents, file.content_type)
+    return generation_response(png, kolam_keyword, user_input, cache_status, encode)
 
-    try:
-        # Determine kolam keyword
-        kolam_keyword = get_kolam_type(user_input)
-
-        # Call the image-to-image generation (run in threadpool if blocking)
-        img = await run_in_threadpool(img_to_img, user_input, tmp_path)
-
-        # Validate result
-        if img is None:
-            raise HTTPException(status_code=500, detail="img_to_img returned None")
-
-        img_b64 = image_to_base64(img)
-        return JSONResponse(content={
-            "result": f"data:image/png;base64,{img_b64}",
-            "keyword": kolam_keyword,
-            "input": user_input
-        })
-    
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
-    
-    finally:
-        # Clean up temporary file
+
+@app.get("/diffusion/metrics")
+async def diffusion_metrics():
+    """Local diffusion backend: load state, batch occupancy and per-step timing."""
+    return JSONResponse(content=to_jsonable(diffusion.metrics()))
+
+
+# ---------- queued generation jobs ----------
+class GenerateJobRequest(GenerateRequest):
+    callback_url: Optional[str] = None
+
+
+async def run_generation_job(job):
+    """JobQueue handler: the same generation path as the blocking endpoints."""
+    user_input = job.params["user_input"]
+    kolam_keyword = await classifier.classify(user_input)
+    if job.kind == "img_img_gen":
+        png, cache_status = await generate_from_image(user_input, kolam_keyword, job.payload, job.params["content_type"])
+    else:
+        png, cache_status = await generate_from_text(user_input, kolam_keyword)
+    return png, {"keyword": kolam_keyword, "cache": cache_status}
+
+
+def job_accepted(job) -> JSONResponse:
+    status_url = app.url_path_for("job_status", job_id=job.id)
+    return JSONResponse(status_code=202, content={
+        "id": job.id,
+        "status": job.status,
+        "position": job_queue.position(job),
+        "status_url": status_url,
+        "result_url": app.url_path_for("job_result", job_id=job.id),
+    }, headers={"Location": status_url})
+
+
+def validate_callback_url(callback_url: Optional[str]):
+    if callback_url is not None:
         try:
-            os.remove(tmp_path)
-        except Exception:
-            pass
+            check_callback_url(callback_url)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+
+def get_job(job_id: str):
+    try:
+        return job_queue.get(job_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown job id {job_id}")
+
+
+@app.post("/jobs/generate_image", status_code=202)
+async def submit_generate_image(req: GenerateJobRequest = Body(...)):
+    """
+    Queue a /generate_image call and return its job id immediately.
+    Poll `status_url`, or pass `callback_url` to get the job status POSTed
+    there when it finishes (https, to a host in KOLAM_JOB_CALLBACK_HOSTS; else 400).
+    """
+    validate_generation_input(req.user_input)
+    validate_callback_url(req.callback_url)
+    job = await job_queue.add_task_to_queue(
+        "generate_image", {"user_input": req.user_input}, callback_url=req.callback_url,
+    )
+    return job_accepted(job)
+
+
+@app.post("/jobs/img_img_gen", status_code=202)
+async def submit_img_img_gen(
+    file: UploadFile = File(...),
+    user_input: str = Form(...),
+    callback_url: Optional[str] = Form(None),
+):
+    """Queue an /img_img_gen call; same polling and callback options as /jobs/generate_image."""
+    validate_generation_input(user_input, file)
+    validate_callback_url(callback_url)
+    contents = await read_upload(file)
+    check_upload_image(contents)
+    job = await job_queue.add_task_to_queue(
+        "img_img_gen", {"user_input": user_input, "content_type": file.content_type},
+        payload=contents, callback_url=callback_url,
+    )
+    return job_accepted(job)
+
+
+@app.get("/jobs/metrics")
+def job_metrics():
+    """Queue depth, running jobs and wait/service times."""
+    return job_queue.metrics()
+
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    job = get_job(job_id)
+    return {**job.info(), "position": job_queue.position(job)}
+
+
+@app.get("/jobs/{job_id}/result")
+def job_result(job_id: str, encode: EncodeOptions = Depends()):
+    """
+    The finished job's response, exactly as the blocking endpoint would have
+    returned it. 409 while the job is queued or running.
+    """
+    job = get_job(job_id)
+    if job.status == "failed":
+        raise HTTPException(status_code=job.error_status or 500, detail=job.error)
+    if job.status != "done":
+        raise HTTPException(status_code=409, detail=f"Job {job_id} is {job.status}")
+    return generation_response(job.result, job.meta["keyword"], job.params["user_input"],
+                               job.meta["cache"], encode)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,217 @@
+# batch.py
+"""
+Batch analysis runs.
+
+A batch is a list of image sources (files of a multipart upload, members of a
+zip, or images under a server directory). It runs as a background task that
+fans the images out over the analysis pool with bounded concurrency and appends
+one JSON record per image, in completion order. Clients read the records as
+NDJSON from any cursor, so a dropped connection resumes where it stopped
+instead of restarting the batch.
+"""
+import asyncio
+import json
+import os
+import shutil
+import time
+import uuid
+import zipfile
+from collections import OrderedDict
+from functools import partial
+from pathlib import Path
+from typing import Optional
+
+from starlette.concurrency import run_in_threadpool
+
+IMAGE_SUFFIXES = {".png", ".jpg", ".jpeg", ".webp", ".bmp", ".tif", ".tiff"}
+# Server-side directories may only be read below this root; unset disables them
+BATCH_ROOT = os.getenv("KOLAM_BATCH_ROOT")
+# Images analysed at once per batch (0: half the analysis pool's pending limit)
+BATCH_CONCURRENCY = int(os.getenv("KOLAM_BATCH_CONCURRENCY", "0"))
+# Finished batches kept for resuming
+BATCH_KEEP = int(os.getenv("KOLAM_BATCH_KEEP", "16"))
+# Zip members inflating more than this many times their compressed size are refused
+ZIP_MAX_RATIO = float(os.getenv("KOLAM_ZIP_MAX_RATIO", "200"))
+
+
+def is_image_name(name: str) -> bool:
+    return Path(name).suffix.lower() in IMAGE_SUFFIXES
+
+
+def file_source(path: Path, name: Optional[str] = None):
+    return name or path.name, path.read_bytes
+
+
+def read_member(zf: zipfile.ZipFile, info: zipfile.ZipInfo, max_bytes: int) -> bytes:
+    """
+    Read one member, refusing it before decompressing when its header reports
+    more than `max_bytes` or a ratio above ZIP_MAX_RATIO, and stopping at
+    `max_bytes` whatever the header says.
+    """
+    if info.file_size > max_bytes:
+        raise ValueError(f"Member inflates to {info.file_size} bytes (limit {max_bytes})")
+    if info.file_size > ZIP_MAX_RATIO * max(info.compress_size, 1):
+        raise ValueError(f"Member compression ratio exceeds {ZIP_MAX_RATIO:g}")
+    with zf.open(info) as f:
+        data = f.read(max_bytes + 1)
+    if len(data) > max_bytes:
+        raise ValueError(f"Member inflates past {max_bytes} bytes")
+    return data
+
+
+def zip_sources(zf: zipfile.ZipFile, max_bytes: int, prefix: str = ""):
+    """
+    One source per image member, named `prefix + member`. Members are read on
+    demand through the caller's ZipFile, so the central directory is parsed
+    once; the caller closes it when the batch is done (see Batch.archives).
+    Oversized members fail as their own records instead of being inflated.
+    """
+    return [
+        (prefix + info.filename, partial(read_member, zf, info, max_bytes))
+        for info in zf.infolist()
+        if not info.is_dir() and is_image_name(info.filename)
+    ]
+
+
+def resolve_directory(relative: str, root=BATCH_ROOT) -> Path:
+    """
+    Map a client-supplied directory onto the configured root. Raises
+    PermissionError when directories are disabled or the path escapes the root.
+    """
+    if not root:
+        raise PermissionError("Server-side directories are disabled (set KOLAM_BATCH_ROOT)")
+    root = Path(root).resolve()
+    directory = (root / relative).resolve()
+    if directory != root and root not in directory.parents:
+        raise PermissionError(f"{relative!r} is outside the batch root")
+    if not directory.is_dir():
+        raise FileNotFoundError(f"No directory {relative!r} under the batch root")
+    return directory
+
+
+def directory_sources(directory: Path):
+    """Every image below `directory`, named relative to it, in sorted order."""
+    return [
+        file_source(path, str(path.relative_to(directory)))
+        for path in sorted(directory.rglob("*"))
+        if path.is_file() and is_image_name(path.name)
+    ]
+
+
+class Batch:
+    def __init__(self, total: int, workdir: Optional[Path] = None, archives=()):
+        self.id = uuid.uuid4().hex
+        self.total = total
+        self.workdir = workdir          # temporary copies of the uploads, removed when done
+        self.archives = list(archives)  # ZipFiles the sources read from, closed when done
+        self.created = time.time()
+        self.finished = None
+        self.failed = 0
+        self.lines: "list[str]" = []
+        self.task = None
+        self._changed = asyncio.Condition()
+
+    @property
+    def done(self) -> bool:
+        return self.finished is not None
+
+    def info(self) -> dict:
+        return {
+            "batch_id": self.id,
+            "total": self.total,
+            "completed": len(self.lines),
+            "failed": self.failed,
+            "done": self.done,
+        }
+
+    async def _append(self, record: dict):
+        async with self._changed:
+            if "error" in record:
+                self.failed += 1
+            # `cursor` is what to pass to resume right after this record
+            record["cursor"] = len(self.lines) + 1
+            self.lines.append(json.dumps(record))
+            self._changed.notify_all()
+
+    async def _finish(self):
+        async with self._changed:
+            self.finished = time.time()
+            self._changed.notify_all()
+        for archive in self.archives:
+            archive.close()
+        if self.workdir is not None:
+            await run_in_threadpool(shutil.rmtree, self.workdir, True)
+
+    async def run(self, sources, analyze, concurrency: int):
+        """
+        Analyse [(name, read), ...] with at most `concurrency` images in flight.
+        `analyze(data)` is an async callable returning the JSON-ready results.
+        """
+        limit = asyncio.Semaphore(max(concurrency, 1))
+
+        async def one(index, name, read):
+            async with limit:
+                try:
+                    data = await run_in_threadpool(read)
+                    record = {"index": index, "name": name, "results": await analyze(data)}
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    record = {"index": index, "name": name, "error": str(e) or type(e).__name__}
+                await self._append(record)
+
+        try:
+            await asyncio.gather(*(one(i, name, read) for i, (name, read) in enumerate(sources)))
+        finally:
+            await self._finish()
+
+    async def follow(self, cursor: int = 0):
+        """
+        Yield NDJSON lines from `cursor` on, waiting for new records until the
+        batch is done; a header line comes first and a summary line last.
+        """
+        yield json.dumps({**self.info(), "cursor": cursor, "event": "batch"}) + "\n"
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: cursor < len(self.lines) or self.done)
+                lines = self.lines[cursor:]
+                done = self.done and cursor + len(lines) == len(self.lines)
+            for line in lines:
+                yield line + "\n"
+            cursor += len(lines)
+            if done:
+                break
+        yield json.dumps({**self.info(), "cursor": cursor, "event": "done"}) + "\n"
+
+
+class BatchStore:
+    """Running and recently finished batches, by id."""
+
+    def __init__(self, keep=BATCH_KEEP):
+        self.keep = keep
+        self._batches: "OrderedDict[str, Batch]" = OrderedDict()
+
+    def start(self, sources, analyze, concurrency: int, workdir: Optional[Path] = None, archives=()) -> Batch:
+        batch = Batch(len(sources), workdir, archives)
+        batch.task = asyncio.ensure_future(batch.run(sources, analyze, concurrency))
+        self._batches[batch.id] = batch
+        self._prune()
+        return batch
+
+    def get(self, batch_id: str) -> Batch:
+        try:
+            return self._batches[batch_id]
+        except KeyError:
+            raise KeyError(f"Unknown batch {batch_id!r}") from None
+
+    def cancel(self, batch_id: str) -> Batch:
+        batch = self.get(batch_id)
+        if batch.task is not None and not batch.task.done():
+            batch.task.cancel()
+        return batch
+
+    def _prune(self):
+        """Forget the oldest finished batches beyond `keep`."""
+        finished = [b.id for b in self._batches.values() if b.done]
+        for batch_id in finished[:max(len(finished) - self.keep, 0)]:
+            del self._batches[batch_id]
@@ -0,0 +1,73 @@
+# batching.py
+"""
+Coalesce concurrent async calls into batched calls.
+
+Requests arriving within `max_wait` seconds of each other (up to `max_batch`)
+are handed to one synchronous batch function, which runs in the threadpool so
+the event loop stays free.
+
+Stages a batch records (`with stage(...)`) go to the trace of every request
+in that batch, not to the request that happened to start the worker.
+"""
+import asyncio
+import contextvars
+
+from starlette.concurrency import run_in_threadpool
+
+from metrics import collect_stages, trace_stages
+
+
+class MicroBatcher:
+    def __init__(self, batch_fn, max_batch: int = 32, max_wait: float = 0.005):
+        """
+        batch_fn: callable(list_of_items) -> list_of_results (same length and order).
+        """
+        self.batch_fn = batch_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = None
+        self._worker = None
+
+    def _ensure_worker(self):
+        # Queue and worker are bound to the running loop; recreate them if it changed
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done() or self._worker.get_loop() is not loop:
+            self._queue = asyncio.Queue()
+            # A fresh context, or the worker would keep the first submitter's request trace
+            self._worker = loop.create_task(self._run(), context=contextvars.Context())
+
+    async def submit(self, item):
+        """Queue one item and wait for its result."""
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        result, stages = await future
+        trace_stages(stages)
+        return result
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            items = [item for item, _ in batch]
+            try:
+                with collect_stages() as stages:
+                    results = await run_in_threadpool(self.batch_fn, items)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result((result, stages))
@@ -0,0 +1,498 @@
+#!/usr/bin/env python3
+# benchmarks.py
+"""
+Reproducible benchmarks for the Kolam server.
+
+    python benchmarks.py                 # everything, appended to the history file
+    python benchmarks.py --group micro   # analysis kernels only
+    python benchmarks.py --only symmetry --repeat 10
+    python benchmarks.py --list
+
+Micro-benchmarks time the analysis kernels on synthetic kolams (dot grids and
+loops at several resolutions). End-to-end benchmarks run the FastAPI app
+in-process, with its lifespan, against gemini_stub served on a local port, so
+no credentials or network are needed. Every run is appended to a JSON history
+file and compared with the previous run of the same benchmark.
+
+Register more with @register_benchmark(name, group).
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+HISTORY_FILE = Path(os.getenv("KOLAM_BENCH_HISTORY", Path(__file__).resolve().parent / "benchmark_history.json"))
+# A median slower than the previous run by more than this fraction is flagged
+REGRESSION_THRESHOLD = 0.2
+# Cold `import app` must stay under this (startup.import_app)
+IMPORT_BUDGET_MS = float(os.getenv("KOLAM_IMPORT_BUDGET_MS", "1500"))
+# Modules that should only load on first use, not when the server starts
+LAZY_MODULES = ("matplotlib.pyplot", "scipy.signal", "scipy.special", "google.genai",
+                "torch", "diffusers", "faiss", "sentence_transformers")
+
+
+# ---------- synthetic kolams ----------
+def synthetic_kolam(size=512, grid=5, style="loops"):
+    """
+    A grayscale kolam-like image: a `grid` x `grid` pulli (dot) grid, dark on white.
+    style "dots" draws only the dots; "loops" also draws a loop around every dot
+    and diagonal strands between neighbours, giving the 4-fold symmetric
+    line-and-loop structure of a pulli kolam.
+    """
+    img = np.full((size, size), 255, np.uint8)
+    step = size / (grid + 1)
+    thickness = max(1, size // 256)
+    dot = max(2, size // 128)
+    centers = [(int(round((i + 1) * step)), int(round((j + 1) * step))) for i in range(grid) for j in range(grid)]
+    for x, y in centers:
+        cv2.circle(img, (x, y), dot, 0, -1, cv2.LINE_AA)
+        if style == "loops":
+            cv2.circle(img, (x, y), int(step * 0.3), 0, thickness, cv2.LINE_AA)
+    if style == "loops":
+        half = int(step / 2)
+        for x, y in centers:
+            for dx, dy in ((half, half), (half, -half)):
+                cv2.line(img, (x, y), (x + dx, y + dy), 0, thickness, cv2.LINE_AA)
+                cv2.line(img, (x, y), (x - dx, y - dy), 0, thickness, cv2.LINE_AA)
+    return img
+
+
+def synthetic_png(size=512, grid=5, style="loops") -> bytes:
+    return cv2.imencode(".png", synthetic_kolam(size, grid, style))[1].tobytes()
+
+
+def synthetic_binary(size=512, grid=5, style="loops"):
+    """Binarized like KolamImage.binary(): strokes = 1."""
+    from math_analysis import KolamImage
+    return KolamImage(synthetic_kolam(size, grid, style)).binary()
+
+
+# ---------- timing ----------
+def summarize(samples):
+    """Latency statistics in milliseconds."""
+    ms = np.asarray(samples, dtype=np.float64) * 1000
+    return {
+        "n": int(len(ms)),
+        "min_ms": float(ms.min()),
+        "median_ms": float(np.median(ms)),
+        "mean_ms": float(ms.mean()),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "max_ms": float(ms.max()),
+    }
+
+
+def time_call(call, repeat=5, warmup=1):
+    """Run `call()` warmup + repeat times and summarize the timed runs."""
+    for _ in range(warmup):
+        call()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        call()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+async def load_test(send, requests, concurrency):
+    """
+    Fire `requests` calls of the async `send(i)` (returning an HTTP response)
+    with at most `concurrency` in flight; report latency, throughput and statuses.
+    """
+    limit = asyncio.Semaphore(concurrency)
+    samples, statuses = [], {}
+
+    async def one(i):
+        async with limit:
+            start = time.perf_counter()
+            response = await send(i)
+            samples.append(time.perf_counter() - start)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - start
+    return {
+        **summarize(samples),
+        "concurrency": concurrency,
+        "throughput_rps": requests / elapsed,
+        "errors": sum(n for status, n in statuses.items() if status >= 400),
+        "statuses": {str(status): n for status, n in sorted(statuses.items())},
+    }
+
+
+# ---------- registry ----------
+# name -> {"fn": fn, "group": "micro" | "e2e"}
+# micro: fn(args) -> dict; e2e: async fn(client, args) -> dict
+BENCHMARKS = {}
+
+def register_benchmark(name, group="micro"):
+    def decorator(fn):
+        BENCHMARKS[name] = {"fn": fn, "group": group}
+        return fn
+    return decorator
+
+
+# ---------- micro-benchmarks ----------
+@register_benchmark("symmetry_scores.loop.256")
+def bench_symmetry_loop(args):
+    from math_analysis import symmetry_scores
+    img = synthetic_binary(256)
+    return time_call(lambda: symmetry_scores(img, backend="loop"), args.repeat)
+
+
+def symmetry_parity():
+    """How far "fft" is from "loop" on the reference templates: worst score gap, templates with unmatched axes."""
+    from math_analysis import SYMMETRY_FFT_AXIS_TOLERANCE, SYMMETRY_SIZE, KolamImage, symmetry_analysis
+    gap, mismatched = 0.0, []
+    for path in sorted((Path(__file__).resolve().parent / "kolams").glob("*.png")):
+        th_img = KolamImage.from_path(str(path)).binary(size=SYMMETRY_SIZE)
+        loop = symmetry_analysis(th_img, backend="loop")
+        fft = symmetry_analysis(th_img, backend="fft")
+        gap = max(gap, float(np.abs(loop["scores"] - fft["scores"]).max()))
+        distance = np.abs(np.subtract.outer(loop["axes"], fft["axes"]))
+        distance = np.minimum(distance, 180 - distance)
+        if distance.size == 0 or (distance.min(axis=1) > SYMMETRY_FFT_AXIS_TOLERANCE).any() \
+                or (distance.min(axis=0) > SYMMETRY_FFT_AXIS_TOLERANCE).any():
+            mismatched.append(path.stem)
+    return {"max_score_gap": gap, "axis_mismatches": mismatched}
+
+
+@register_benchmark("symmetry_scores.fft.256")
+def bench_symmetry_fft(args):
+    """Also reports parity with the loop engine (see symmetry_scores for the tolerances)."""
+    from math_analysis import symmetry_scores
+    img = synthetic_binary(256)
+    result = time_call(lambda: symmetry_scores(img, backend="fft"), args.repeat)
+    result["parity"] = symmetry_parity()
+    return result
+
+
+@register_benchmark("symmetry_scores.fft.1024")
+def bench_symmetry_fft_large(args):
+    from math_analysis import symmetry_scores
+    img = synthetic_binary(1024)
+    return time_call(lambda: symmetry_scores(img, backend="fft"), args.repeat)
+
+
+@register_benchmark("reflect_points.256")
+def bench_reflect_points(args):
+    from math_analysis import reflect_points
+    img = synthetic_binary(256)
+    return time_call(lambda: reflect_points(img, 30), args.repeat * 20)
+
+
+@register_benchmark("reflect_points.1024")
+def bench_reflect_points_large(args):
+    from math_analysis import reflect_points
+    img = synthetic_binary(1024)
+    return time_call(lambda: reflect_points(img, 30), args.repeat * 5)
+
+
+@register_benchmark("rotation_analysis.256")
+def bench_rotation(args):
+    from math_analysis import rotation_analysis
+    img = synthetic_binary(256)
+    return time_call(lambda: rotation_analysis(img), args.repeat)
+
+
+@register_benchmark("fractal_analysis.1024")
+def bench_fractal(args):
+    from math_analysis import fractal_analysis
+    img = synthetic_binary(1024, grid=9)
+    return time_call(lambda: fractal_analysis(img), args.repeat)
+
+
+@register_benchmark("fractal_analysis.4096")
+def bench_fractal_4k(args):
+    from math_analysis import fractal_analysis
+    img = synthetic_binary(4096, grid=15)
+    return time_call(lambda: fractal_analysis(img), max(1, args.repeat // 2))
+
+
+@register_benchmark("fractal_dimension_boxcount.1024")
+def bench_fractal_boxcount(args):
+    """The file-based entry point: read, binarize, analyse and render the figure."""
+    from math_analysis import fractal_dimension_boxcount
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "kolam.png")
+        cv2.imwrite(path, synthetic_kolam(1024, grid=9))
+        return time_call(lambda: fractal_dimension_boxcount(path), args.repeat)
+
+
+@register_benchmark("procedural.sikku.7x7")
+def bench_procedural(args):
+    """Procedural kolam: mirror layout search, tracing, raster and SVG."""
+    from procedural import generate
+
+    def draw():
+        kolam = generate(7, kind="sikku", seed=1)
+        return kolam.raster(512), kolam.svg(512)
+
+    return time_call(draw, args.repeat * 5)
+
+
+_IMPORT_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import app
+print(json.dumps({"seconds": time.perf_counter() - start,
+                  "loaded": [m for m in %r if m in sys.modules]}))
+"""
+
+
+@register_benchmark("startup.import_app")
+def bench_import_app(args):
+    """Cold `import app` in a fresh interpreter, without credentials, against the import budget."""
+    env = {k: v for k, v in os.environ.items() if k != "GEMINI_API_KEY"}
+    samples, loaded = [], set()
+    for _ in range(args.repeat):
+        out = subprocess.run([sys.executable, "-c", _IMPORT_PROBE % (LAZY_MODULES,)], capture_output=True,
+                             text=True, check=True, env=env, cwd=Path(__file__).resolve().parent)
+        probe = json.loads(out.stdout.strip().splitlines()[-1])
+        samples.append(probe["seconds"])
+        loaded.update(probe["loaded"])
+    result = summarize(samples)
+    result.update(budget_ms=IMPORT_BUDGET_MS, over_budget=result["median_ms"] > IMPORT_BUDGET_MS,
+                  eager_heavy_modules=sorted(loaded))
+    return result
+
+
+# ---------- end-to-end ----------
+def _free_socket():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("127.0.0.1", 0))
+    return sock
+
+
+@asynccontextmanager
+async def e2e_client(stub_latency):
+    """
+    Serve gemini_stub on a free local port in a background thread, point the
+    generation client at it and yield an httpx client bound to the app (lifespan
+    included), with the result cache in a throwaway directory.
+    """
+    import httpx
+    import uvicorn
+
+    os.environ["STUB_LATENCY"] = str(stub_latency)
+    import gemini_stub
+    gemini_stub.STUB_LATENCY = stub_latency
+
+    sock = _free_socket()
+    server = uvicorn.Server(uvicorn.Config(gemini_stub.app, log_level="warning", lifespan="off"))
+    thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True)
+    thread.start()
+    while not server.started:
+        await asyncio.sleep(0.01)
+
+    host, port = sock.getsockname()
+    cache_dir = tempfile.TemporaryDirectory()
+    os.environ["GEMINI_BASE_URL"] = f"http://{host}:{port}"
+    os.environ.setdefault("GEMINI_API_KEY", "stub")
+    os.environ["KOLAM_CACHE_DIR"] = cache_dir.name
+    import app as kolam_app
+
+    try:
+        async with kolam_app.app.router.lifespan_context(kolam_app.app):
+            transport = httpx.ASGITransport(app=kolam_app.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://kolam", timeout=120) as client:
+                # Startup warms the analysis workers in the background; measure warm
+                while (await client.get("/ready")).status_code != 200:
+                    await asyncio.sleep(0.05)
+                yield client
+    finally:
+        server.should_exit = True
+        thread.join(timeout=5)
+        cache_dir.cleanup()
+
+
+@register_benchmark("e2e.generate_image.miss", group="e2e")
+async def bench_generate_miss(client, args):
+    """Unique prompts: every request goes through the upstream (stub) call."""
+    run = f"{time.time_ns()}"
+    return await load_test(
+        lambda i: client.post("/generate_image", json={"user_input": f"pulli kolam {run} {i}"}),
+        args.requests, args.concurrency,
+    )
+
+
+@register_benchmark("e2e.generate_image.hit", group="e2e")
+async def bench_generate_hit(client, args):
+    """One prompt: after the first request everything is served from the cache."""
+    prompt = {"user_input": "sikku kolam with loops"}
+    await client.post("/generate_image", json=prompt)
+    return await load_test(lambda i: client.post("/generate_image", json=prompt), args.requests, args.concurrency)
+
+
+@register_benchmark("e2e.generate_image.procedural", group="e2e")
+async def bench_generate_procedural(client, args):
+    """Unique prompts drawn by the local procedural backend (no upstream call)."""
+    run = f"{time.time_ns()}"
+    return await load_test(
+        lambda i: client.post("/generate_image?backend=procedural", json={"user_input": f"sikku kolam {run} {i}"}),
+        args.requests, args.concurrency,
+    )
+
+
+@register_benchmark("e2e.math_analysis.json", group="e2e")
+async def bench_math_analysis(client, args):
+    """Analysis requests kept within the pool's pending limit, so none are rejected with 429."""
+    from app import analysis_pool
+    from math_analysis import DEFAULT_METRICS
+    data = synthetic_png(512)
+    concurrency = max(1, min(args.concurrency, analysis_pool.max_pending // len(DEFAULT_METRICS)))
+    return await load_test(
+        lambda i: client.post("/math_analysis?mode=json", files={"file": ("kolam.png", data, "image/png")}),
+        max(args.requests // 4, 1), concurrency,
+    )
+
+
+@register_benchmark("e2e.jobs.generate_image", group="e2e")
+async def bench_jobs(client, args):
+    """Submit jobs, then poll until all are done; latency is submit-to-done."""
+    run = f"{time.time_ns()}"
+    limit = asyncio.Semaphore(args.concurrency)
+
+    async def submit_and_wait(i):
+        async with limit:
+            r = await client.post("/jobs/generate_image", json={"user_input": f"kambi kolam {run} {i}"})
+        status_url = r.json()["status_url"]
+        while True:
+            status = (await client.get(status_url)).json()
+            if status["status"] in ("done", "failed"):
+                return r
+            await asyncio.sleep(0.01)
+
+    return await load_test(submit_and_wait, args.requests, args.requests)
+
+
+async def run_e2e(names, args):
+    results = {}
+    async with e2e_client(args.stub_latency) as client:
+        for name in names:
+            print(f"  {name} ...", flush=True)
+            results[name] = await BENCHMARKS[name]["fn"](client, args)
+    return results
+
+
+# ---------- history ----------
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=Path(__file__).resolve().parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_history(path=HISTORY_FILE):
+    try:
+        return json.loads(Path(path).read_text())
+    except FileNotFoundError:
+        return []
+
+
+def previous_result(history, name, result):
+    """The last recorded result of `name` measured the same way (sample count, concurrency)."""
+    same = ("n", "concurrency")
+    for run in reversed(history):
+        before = run["results"].get(name)
+        if before is not None and all(before.get(k) == result.get(k) for k in same):
+            return before
+    return None
+
+
+def report(results, history, threshold=REGRESSION_THRESHOLD):
+    """Print one line per benchmark with the change against the last recorded run; return regressions."""
+    regressions = []
+    for name, result in results.items():
+        line = f"{name:36s} median {result['median_ms']:9.2f} ms  p95 {result['p95_ms']:9.2f} ms"
+        if "throughput_rps" in result:
+            line += f"  {result['throughput_rps']:7.1f} req/s  errors {result['errors']}"
+        before = previous_result(history, name, result)
+        if before is not None and before.get("median_ms"):
+            change = result["median_ms"] / before["median_ms"] - 1
+            line += f"  ({change:+.0%} vs last)"
+            if change > threshold:
+                line += "  REGRESSION"
+                regressions.append(name)
+        if result.get("over_budget"):
+            line += f"  OVER BUDGET ({result['budget_ms']:.0f} ms)"
+            if name not in regressions:
+                regressions.append(name)
+        if "parity" in result:
+            parity = result["parity"]
+            line += f"  vs loop: score gap {parity['max_score_gap']:.2f}, axes differ on {len(parity['axis_mismatches'])}"
+        if result.get("eager_heavy_modules"):
+            line += f"  eager: {', '.join(result['eager_heavy_modules'])}"
+        print(line)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", action="append", default=[], help="run benchmarks whose name contains this (repeatable)")
+    parser.add_argument("--group", choices=["micro", "e2e"], help="run one group only")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per micro-benchmark")
+    parser.add_argument("--requests", type=int, default=40, help="requests per end-to-end benchmark")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent end-to-end requests")
+    parser.add_argument("--stub-latency", type=float, default=0.05, help="seconds the Gemini stub waits per call")
+    parser.add_argument("--history", type=Path, default=HISTORY_FILE, help="JSON history file")
+    parser.add_argument("--no-save", action="store_true", help="do not append this run to the history")
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit 1 if any median regressed")
+    parser.add_argument("--list", action="store_true", help="list benchmarks and exit")
+    args = parser.parse_args(argv)
+
+    names = [
+        name for name, bench in BENCHMARKS.items()
+        if (args.group is None or bench["group"] == args.group)
+        and (not args.only or any(pattern in name for pattern in args.only))
+    ]
+    if args.list:
+        for name in names:
+            print(f"{BENCHMARKS[name]['group']:6s} {name}")
+        return 0
+
+    results = {}
+    for name in [n for n in names if BENCHMARKS[n]["group"] == "micro"]:
+        print(f"  {name} ...", flush=True)
+        results[name] = BENCHMARKS[name]["fn"](args)
+    e2e = [n for n in names if BENCHMARKS[n]["group"] == "e2e"]
+    if e2e:
+        results.update(asyncio.run(run_e2e(e2e, args)))
+
+    history = load_history(args.history)
+    print()
+    regressions = report(results, history)
+
+    if not args.no_save:
+        history.append({
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": {k: str(v) for k, v in vars(args).items() if k not in ("list", "no_save")},
+            "results": results,
+        })
+        args.history.write_text(json.dumps(history, indent=2))
+        print(f"\nAppended to {args.history}")
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+# cache.py
+"""
+Content-addressed cache for generated kolam images.
+
+Entries are PNG bytes keyed by a hash of the normalized prompt, the resolved
+kolam type and the reference image bytes. Lookups go through an in-memory LRU
+tier, then an on-disk diskcache tier (TTL per entry, least recently stored
+entries culled above a size budget). Concurrent misses for the same key are
+coalesced so only one upstream call is made.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+import diskcache
+from starlette.concurrency import run_in_threadpool
+
+CACHE_DIR = Path(os.getenv("KOLAM_CACHE_DIR", "cache/generated"))
+CACHE_MEMORY_ITEMS = int(os.getenv("KOLAM_CACHE_MEMORY_ITEMS", "64"))
+CACHE_DISK_BYTES = int(float(os.getenv("KOLAM_CACHE_DISK_MB", "512")) * 1024 * 1024)
+CACHE_TTL = float(os.getenv("KOLAM_CACHE_TTL", str(24 * 3600)))
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Lower-case and collapse whitespace so trivially different prompts share a key."""
+    return " ".join(prompt.lower().split())
+
+
+def cache_key(prompt: str, kolam_type: str, reference: Optional[bytes] = None,
+              reference_digest: Optional[str] = None) -> str:
+    """
+    sha256 over the normalized prompt, kolam type and reference image hash.
+    Pass `reference_digest` instead of `reference` when the sha256 is already known.
+    """
+    if reference is not None:
+        reference_digest = hashlib.sha256(reference).hexdigest()
+    payload = {
+        "prompt": normalize_prompt(prompt),
+        "type": kolam_type,
+        "reference": reference_digest,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, directory=CACHE_DIR, memory_items=CACHE_MEMORY_ITEMS,
+                 disk_bytes=CACHE_DISK_BYTES, ttl=CACHE_TTL):
+        self.directory = Path(directory)
+        self.memory_items = memory_items
+        self.disk_bytes = disk_bytes
+        self.ttl = ttl
+        self._memory: "OrderedDict[str, tuple[float, bytes]]" = OrderedDict()
+        self._disk = None
+        self._disk_lock = threading.Lock()
+        self._inflight: "dict[str, asyncio.Future]" = {}
+
+    # ---------- memory tier ----------
+    def _memory_get(self, key):
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.time():
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        return value
+
+    def _memory_put(self, key, value, expires):
+        self._memory[key] = (expires, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    # ---------- disk tier ----------
+    def disk(self) -> diskcache.Cache:
+        """Open the disk tier on first use; diskcache enforces the TTL and the size budget."""
+        with self._disk_lock:
+            if self._disk is None:
+                self._disk = diskcache.Cache(
+                    str(self.directory),
+                    size_limit=self.disk_bytes,
+                    eviction_policy="least-recently-stored",
+                )
+            return self._disk
+
+    def _disk_get(self, key):
+        return self.disk().get(key)
+
+    def _disk_put(self, key, value):
+        self.disk().set(key, value, expire=self.ttl)
+
+    def close(self):
+        with self._disk_lock:
+            if self._disk is not None:
+                self._disk.close()
+                self._disk = None
+
+    # ---------- public API ----------
+    async def get(self, key):
+        value = self._memory_get(key)
+        if value is not None:
+            return value
+        value = await run_in_threadpool(self._disk_get, key)
+        if value is not None:
+            self._memory_put(key, value, time.time() + self.ttl)
+        return value
+
+    async def put(self, key, value: bytes):
+        self._memory_put(key, value, time.time() + self.ttl)
+        await run_in_threadpool(self._disk_put, key, value)
+
+    async def get_or_compute(self, key, compute):
+        """
+        Return (value, status) where status is "hit", "coalesced" or "miss".
+        `compute` is an async callable returning PNG bytes (or None, which is not cached).
+        """
+        value = await self.get(key)
+        if value is not None:
+            return value, "hit"
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            return await asyncio.shield(inflight), "coalesced"
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await compute()
+            if value is not None:
+                await self.put(key, value)
+            future.set_result(value)
+            return value, "miss"
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark retrieved so an unawaited failure is not logged as "never retrieved"
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
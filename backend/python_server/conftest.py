@@ -0,0 +1,2 @@
+# test.py is a manual client for a deployed server, not a pytest module
+collect_ignore = ["test.py"]
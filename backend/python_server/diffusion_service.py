@@ -0,0 +1,224 @@
+# diffusion_service.py
+"""
+Resident local text-to-image pipeline, the offline alternative to Gemini.
+
+The diffusers pipeline and its scheduler are built once and kept warm, instead
+of on every call as test_img_gen used to. Concurrent prompts are coalesced by a
+MicroBatcher into one pipeline call (one forward pass per denoising step for
+the whole batch), each prompt keeping its own seeded generator. The server
+runs it on CPU in float32 or bfloat16 (float16 on CUDA); every denoising step
+is timed.
+
+torch and diffusers are imported on first load, so the server starts (and the
+other backends work) without them.
+"""
+import hashlib
+import importlib.util
+import os
+import threading
+import time
+from typing import Optional
+
+from batching import MicroBatcher
+from metrics import STAGE_SECONDS, record_stage
+
+DIFFUSION_MODEL = os.getenv("KOLAM_DIFFUSION_MODEL", "runwayml/stable-diffusion-v1-5")
+DIFFUSION_DEVICE = os.getenv("KOLAM_DIFFUSION_DEVICE", "cpu")
+DIFFUSION_DTYPE = os.getenv("KOLAM_DIFFUSION_DTYPE", "float32")  # float32 or bfloat16; float16 on cuda only
+DIFFUSION_STEPS = int(os.getenv("KOLAM_DIFFUSION_STEPS", "25"))
+DIFFUSION_SIZE = int(os.getenv("KOLAM_DIFFUSION_SIZE", "512"))
+DIFFUSION_GUIDANCE = float(os.getenv("KOLAM_DIFFUSION_GUIDANCE", "7.5"))
+# Prompts per pipeline call, and how long the first one waits for company
+DIFFUSION_MAX_BATCH = int(os.getenv("KOLAM_DIFFUSION_MAX_BATCH", "4"))
+DIFFUSION_MAX_WAIT = float(os.getenv("KOLAM_DIFFUSION_MAX_WAIT", "0.05"))
+# torch intra-op threads; 0 keeps torch's default
+DIFFUSION_THREADS = int(os.getenv("KOLAM_DIFFUSION_THREADS", "0"))
+# Load the pipeline at startup instead of on the first request
+DIFFUSION_PRELOAD = os.getenv("KOLAM_DIFFUSION_PRELOAD", "0") == "1"
+
+DTYPES = ("float32", "bfloat16", "float16")
+
+PROMPT_TEMPLATE = (
+    "{user_input}, traditional South Indian kolam, white rice flour lines on a dark floor, "
+    "symmetric dot grid pattern, top-down view"
+)
+NEGATIVE_PROMPT = "blurry, text, watermark, people, perspective, photo frame"
+# Negative prompt of the server's kolam service; empty disables it
+DIFFUSION_NEGATIVE_PROMPT = os.getenv("KOLAM_DIFFUSION_NEGATIVE_PROMPT", NEGATIVE_PROMPT)
+
+
+def diffusion_available() -> bool:
+    """True when torch and diffusers are importable (without importing them)."""
+    return all(importlib.util.find_spec(name) is not None for name in ("torch", "diffusers"))
+
+
+def default_device():
+    """(device, dtype): cuda in float16 when available, else cpu in float32 (imports torch)."""
+    import torch
+
+    if torch.cuda.is_available():
+        return "cuda", "float16"
+    return "cpu", "float32"
+
+
+def resolve_dtype(device: str, dtype: str) -> str:
+    """float16 only on CUDA: CPU kernels for it are missing or slow, so CPU falls back to float32."""
+    if dtype == "float16" and not device.startswith("cuda"):
+        return "float32"
+    return dtype
+
+
+class DiffusionService:
+    def __init__(self, model_id=DIFFUSION_MODEL, device=DIFFUSION_DEVICE, dtype=DIFFUSION_DTYPE,
+                 steps=DIFFUSION_STEPS, height=DIFFUSION_SIZE, width=DIFFUSION_SIZE, guidance=DIFFUSION_GUIDANCE,
+                 negative_prompt=None, max_batch=DIFFUSION_MAX_BATCH, max_wait=DIFFUSION_MAX_WAIT):
+        if dtype not in DTYPES:
+            raise ValueError(f"dtype must be one of {DTYPES}")
+        self.model_id = model_id
+        self.device = device
+        self.dtype = resolve_dtype(device, dtype)
+        self.steps = steps
+        self.height = height
+        self.width = width
+        self.guidance = guidance
+        self.negative_prompt = negative_prompt or None
+        self._pipe = None
+        self._load_lock = threading.Lock()
+        # One pipeline call at a time; torch already uses every core for a batch
+        self._run_lock = threading.Lock()
+        self.batcher = MicroBatcher(self._generate_items, max_batch=max_batch, max_wait=max_wait)
+        self.stats = {"batches": 0, "images": 0, "steps": 0, "step_seconds_total": 0.0,
+                      "load_seconds": None, "last_step_seconds": []}
+
+    @property
+    def loaded(self) -> bool:
+        return self._pipe is not None
+
+    @property
+    def fingerprint(self) -> str:
+        """Identifies the settings that change the output, for cache keys."""
+        settings = f"{self.model_id}|{self.dtype}|{self.steps}|{self.height}x{self.width}|{self.guidance}|{self.negative_prompt}"
+        return hashlib.sha256(settings.encode("utf-8")).hexdigest()
+
+    # ---------- pipeline ----------
+    def load(self):
+        """Build the pipeline and scheduler once and keep them resident."""
+        with self._load_lock:
+            if self._pipe is not None:
+                return self._pipe
+            import torch
+            from diffusers import DiffusionPipeline, DPMSolverMultistepScheduler
+
+            start = time.perf_counter()
+            if DIFFUSION_THREADS:
+                torch.set_num_threads(DIFFUSION_THREADS)
+            pipe = DiffusionPipeline.from_pretrained(
+                self.model_id,
+                torch_dtype=getattr(torch, self.dtype),
+                # Half-precision weights: half the download and load time on CUDA
+                revision="fp16" if self.dtype == "float16" else None,
+                use_safetensors=True,
+                safety_checker=None,
+            )
+            pipe.scheduler = DPMSolverMultistepScheduler.from_config(pipe.scheduler.config)
+            pipe = pipe.to(self.device)
+            pipe.set_progress_bar_config(disable=True)
+            self._pipe = pipe
+            self.stats["load_seconds"] = time.perf_counter() - start
+            return pipe
+
+    def generate_batch(self, prompts, seeds):
+        """
+        Blocking: one pipeline call for all prompts. Returns (images, timing)
+        with the per-step seconds of the shared denoising loop.
+        """
+        import torch
+
+        pipe = self.load()
+        step_seconds = []
+        last = [time.perf_counter()]
+
+        def on_step_end(pipeline, step, timestep, callback_kwargs):
+            now = time.perf_counter()
+            step_seconds.append(now - last[0])
+            # Batched steps serve several requests: histogram only, no request trace
+            STAGE_SECONDS.observe(now - last[0], stage="diffusion.step")
+            last[0] = now
+            return callback_kwargs
+
+        generators = [torch.Generator(self.device).manual_seed(seed) for seed in seeds]
+        with self._run_lock, torch.inference_mode():
+            start = time.perf_counter()
+            last[0] = start
+            out = pipe(
+                prompt=list(prompts),
+                negative_prompt=[self.negative_prompt] * len(prompts) if self.negative_prompt else None,
+                height=self.height,
+                width=self.width,
+                num_inference_steps=self.steps,
+                guidance_scale=self.guidance,
+                generator=generators,
+                callback_on_step_end=on_step_end,
+            )
+            total = time.perf_counter() - start
+
+        self.stats["batches"] += 1
+        self.stats["images"] += len(prompts)
+        self.stats["steps"] += len(step_seconds)
+        self.stats["step_seconds_total"] += sum(step_seconds)
+        self.stats["last_step_seconds"] = step_seconds
+        timing = {"batch_size": len(prompts), "seconds": total, "step_seconds": step_seconds}
+        return out.images, timing
+
+    def _generate_items(self, items):
+        """MicroBatcher batch function over (prompt, seed) items."""
+        images, timing = self.generate_batch([p for p, _ in items], [s for _, s in items])
+        return [(image, timing) for image in images]
+
+    # ---------- public API ----------
+    async def generate(self, user_input: str, seed: Optional[int] = None):
+        """
+        Generate one kolam, batched with concurrent calls. Returns (PIL image, timing);
+        the queue wait and the pipeline run are recorded as request stages.
+        """
+        prompt = PROMPT_TEMPLATE.format(user_input=user_input)
+        if seed is None:
+            seed = int.from_bytes(hashlib.sha256(prompt.encode("utf-8")).digest()[:4], "big")
+        submitted = time.perf_counter()
+        image, timing = await self.batcher.submit((prompt, seed))
+        record_stage("diffusion.queue", max(time.perf_counter() - submitted - timing["seconds"], 0.0))
+        record_stage("diffusion.pipeline", timing["seconds"])
+        return image, timing
+
+    def metrics(self) -> dict:
+        steps = self.stats["steps"]
+        return {
+            "available": diffusion_available(),
+            "loaded": self.loaded,
+            "model": self.model_id,
+            "device": self.device,
+            "dtype": self.dtype,
+            "steps": self.steps,
+            "height": self.height,
+            "width": self.width,
+            "negative_prompt": self.negative_prompt,
+            "max_batch": self.batcher.max_batch,
+            "avg_batch_size": self.stats["images"] / self.stats["batches"] if self.stats["batches"] else None,
+            "avg_step_seconds": self.stats["step_seconds_total"] / steps if steps else None,
+            **self.stats,
+        }
+
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+def get_service(model_id: str = DIFFUSION_MODEL, **settings) -> DiffusionService:
+    """Shared service per model and settings, so repeated callers reuse the warm pipeline."""
+    if "dtype" in settings:
+        settings["dtype"] = resolve_dtype(settings.get("device", DIFFUSION_DEVICE), settings["dtype"])
+    key = (model_id, tuple(sorted(settings.items())))
+    with _services_lock:
+        if key not in _services:
+            _services[key] = DiffusionService(model_id, **settings)
+        return _services[key]
@@ -0,0 +1,135 @@
+# encoding.py
+"""
+Image encoders and response-format negotiation.
+
+Endpoints default to the original JSON + base64 data URI responses. Clients
+that ask for it (`?format=` or the Accept header) get raw image bytes, or a
+multipart/mixed body when a response carries several images.
+"""
+import base64
+import json
+import uuid
+from io import BytesIO
+from typing import Optional
+
+import numpy as np
+from PIL import Image
+
+from metrics import stage
+
+# format name -> (PIL format, media type)
+FORMATS = {
+    "png": ("PNG", "image/png"),
+    "webp": ("WEBP", "image/webp"),
+    "jpeg": ("JPEG", "image/jpeg"),
+}
+# Only drawings that exist as vectors (procedural kolams) can be returned as SVG
+SVG_MEDIA_TYPE = "image/svg+xml"
+RESPONSE_FORMATS = ("json", "multipart", *FORMATS, "svg")
+
+
+def to_pil(img) -> Image.Image:
+    """Accept a PIL.Image or an OpenCV numpy array (BGR)."""
+    if img is None:
+        raise ValueError("to_pil: img is None")
+    if isinstance(img, np.ndarray):
+        # assume OpenCV BGR -> convert to RGB
+        if img.ndim == 3 and img.shape[2] == 3:
+            img = img[:, :, ::-1]
+        img = Image.fromarray(np.ascontiguousarray(img))
+    if not isinstance(img, Image.Image):
+        raise TypeError("expected a PIL.Image or numpy.ndarray")
+    return img
+
+
+def encode_image(img, fmt: str = "png", quality: Optional[int] = None,
+                 compress_level: Optional[int] = None) -> memoryview:
+    """
+    Encode an image and return a zero-copy view of the encoder's buffer.
+
+    quality: JPEG/WebP quality (1-100). compress_level: PNG zlib level (0-9);
+    lower is faster and larger.
+    """
+    pil_format, _ = FORMATS[fmt]
+    with stage(f"encode.{fmt}"):
+        img = to_pil(img)
+        options = {}
+        if fmt == "png" and compress_level is not None:
+            options["compress_level"] = compress_level
+        if fmt in ("jpeg", "webp") and quality is not None:
+            options["quality"] = quality
+        if fmt == "jpeg" and img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        buf = BytesIO()
+        img.save(buf, format=pil_format, **options)
+        return buf.getbuffer()
+
+
+def reencode(data, fmt: str = "png", quality: Optional[int] = None,
+             compress_level: Optional[int] = None):
+    """
+    Convert encoded PNG bytes to another format; PNG at default settings is
+    returned as-is.
+    """
+    if fmt == "png" and compress_level is None:
+        return data
+    return encode_image(Image.open(BytesIO(data)), fmt, quality, compress_level)
+
+
+def to_base64(data) -> str:
+    """base64 straight from bytes or a buffer view, without an intermediate copy."""
+    with stage("base64"):
+        return base64.b64encode(data).decode("ascii")
+
+
+def media_type(fmt: str) -> str:
+    return SVG_MEDIA_TYPE if fmt == "svg" else FORMATS[fmt][1]
+
+
+def negotiate_format(requested: Optional[str], accept: Optional[str], multi: bool = False,
+                     vector: bool = False) -> str:
+    """
+    Pick the response format: an explicit `format` wins, then the Accept header,
+    then the JSON default. multipart is only offered when `multi` is set, SVG
+    when `vector` is.
+    """
+    if requested:
+        return requested
+    accept = (accept or "").lower()
+    if multi and "multipart/mixed" in accept:
+        return "multipart"
+    if vector and SVG_MEDIA_TYPE in accept:
+        return "svg"
+    for fmt, (_, mime) in FORMATS.items():
+        if mime in accept:
+            return fmt
+    return "json"
+
+
+class MultipartWriter:
+    """Builds multipart/mixed parts one at a time, so they can be streamed."""
+
+    def __init__(self):
+        self.boundary = uuid.uuid4().hex
+
+    @property
+    def content_type(self) -> str:
+        return f'multipart/mixed; boundary="{self.boundary}"'
+
+    def part(self, name: str, data, content_type: str, filename: Optional[str] = None) -> bytes:
+        disposition = f'inline; name="{name}"'
+        if filename:
+            disposition += f'; filename="{filename}"'
+        head = (
+            f"--{self.boundary}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Disposition: {disposition}\r\n"
+            f"Content-Length: {len(data)}\r\n\r\n"
+        ).encode("ascii")
+        return head + bytes(data) + b"\r\n"
+
+    def json_part(self, name: str, value) -> bytes:
+        return self.part(name, json.dumps(value).encode("utf-8"), "application/json")
+
+    def close(self) -> bytes:
+        return f"--{self.boundary}--\r\n".encode("ascii")
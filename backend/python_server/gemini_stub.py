@@ -0,0 +1,72 @@
+# gemini_stub.py
+"""
+Local stand-in for the Gemini generateContent REST API.
+
+Run it and point the Kolam server at it to exercise the generation path without
+credentials or network access:
+
+    uvicorn gemini_stub:app --port 8089
+    GEMINI_BASE_URL=http://127.0.0.1:8089 GEMINI_API_KEY=stub uvicorn app:app
+
+It answers every generateContent call with a small PNG after `STUB_LATENCY`
+seconds, and fails with 503 for a `STUB_FAILURE_RATE` fraction of calls so the
+client's retry path can be exercised too.
+"""
+import asyncio
+import base64
+import os
+import random
+from io import BytesIO
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from PIL import Image, ImageDraw
+
+STUB_LATENCY = float(os.getenv("STUB_LATENCY", "0.05"))
+STUB_FAILURE_RATE = float(os.getenv("STUB_FAILURE_RATE", "0"))
+
+app = FastAPI(title="Gemini stub")
+app.state.calls = 0
+
+
+def stub_png(size: int = 256) -> bytes:
+    """A plain dot-grid 'kolam' so responses decode like real images."""
+    img = Image.new("RGB", (size, size), "white")
+    draw = ImageDraw.Draw(img)
+    step = size // 8
+    for y in range(step, size, step):
+        for x in range(step, size, step):
+            draw.ellipse((x - 3, y - 3, x + 3, y + 3), fill="black")
+    buf = BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+_PNG_B64 = base64.b64encode(stub_png()).decode("ascii")
+
+
+@app.post("/{api_version}/models/{model}:generateContent")
+async def generate_content(api_version: str, model: str, request: Request):
+    await request.body()
+    app.state.calls += 1
+    await asyncio.sleep(STUB_LATENCY)
+    if random.random() < STUB_FAILURE_RATE:
+        return JSONResponse(
+            status_code=503,
+            content={"error": {"code": 503, "message": "stub overloaded", "status": "UNAVAILABLE"}},
+        )
+    return {
+        "candidates": [{
+            "content": {
+                "role": "model",
+                "parts": [{"inlineData": {"mimeType": "image/png", "data": _PNG_B64}}],
+            },
+            "finishReason": "STOP",
+        }],
+        "modelVersion": model,
+    }
+
+
+@app.get("/stats")
+async def stats():
+    return {"calls": app.state.calls}
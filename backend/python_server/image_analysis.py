@@ -1,14 +1,61 @@
 from dotenv import load_dotenv
 load_dotenv()
 
-from google import genai
-from google.genai import types
+import asyncio
+import os
+import random
+import sys
+import threading
+from typing import Optional
+
+import httpx
 from PIL import Image
 from io import BytesIO
 
+from templates import registry as template_registry
+from kolam_classifier import get_kolam_type as classify_kolam, template_for
+from metrics import UPSTREAM_ERRORS, stage
 
-# Initialize client (needs GEMINI_API_KEY in .env or environment)
-client = genai.Client()
+GEMINI_MODEL = os.getenv("KOLAM_GEMINI_MODEL", "gemini-2.5-flash-image-preview")
+# Point at a local stand-in for the API (see gemini_stub.py); unset = Google's endpoint
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL")
+GEMINI_TIMEOUT = float(os.getenv("KOLAM_GEMINI_TIMEOUT", "90"))  # seconds per attempt
+GEMINI_MAX_CONCURRENCY = int(os.getenv("KOLAM_GEMINI_MAX_CONCURRENCY", "8"))
+GEMINI_RETRIES = int(os.getenv("KOLAM_GEMINI_RETRIES", "2"))
+GEMINI_BACKOFF = float(os.getenv("KOLAM_GEMINI_BACKOFF", "0.5"))  # base seconds
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+# The client (needs GEMINI_API_KEY in .env or environment) is created on first use:
+# google.genai is slow to import and the server must start without credentials.
+# One client is shared by every request, so its HTTP connection pools are reused.
+_client = None
+_client_lock = threading.Lock()
+
+
+class NotConfigured(RuntimeError):
+    """No Gemini credentials are configured."""
+
+
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            from google import genai
+            from google.genai import types
+            try:
+                _client = genai.Client(http_options=types.HttpOptions(base_url=GEMINI_BASE_URL))
+            except ValueError as e:  # no API key
+                raise NotConfigured(str(e)) from None
+        return _client
+
+
+def is_api_error(exc: Exception) -> bool:
+    """True for google.genai API errors, without importing the library if it is not loaded yet."""
+    errors = sys.modules.get("google.genai.errors")
+    return errors is not None and isinstance(exc, errors.APIError)
+
+# Bounds in-flight upstream calls; created lazily inside the running event loop
+_upstream_slots = None
 
 # Prompt template
 PROMPT_TEMPLATE = """
@@ -24,39 +71,16 @@ The generated image should be vibrant, culturally resonant, and visually appeali
 
 """
 def get_kolam_type(user_input: str) -> str:
-    # normalize input
-    text = user_input.lower().strip()
-
-    if "pulli" in text or "dot" in text:
-        return "pulli"
-    elif "sikku" in text or "twisted" in text:
-        return "sikku"
-    elif "kambi" in text or "line" in text:
-        return "kambi"
-    elif "chikku" in text or "loop" in text:
-        return "chikku"
-    elif "rangoli" in text or "color" in text or "colour" in text:
-        return "rangoli"
-    # elif "isai" in text or "music" in text or "musical" in text:
-    #     return "isai_kolam"
-    else:
-        return "rangoli"  # fallback if nothing matched
-    
-def generate_kolam(user_input: str, reference_image_path: str = "kolam.jpg"):
-    # Fill the template with user input
-    prompt = PROMPT_TEMPLATE.format(user_input=user_input)
-    image_type = get_kolam_type(user_input)
+    # Reference template name for the prompt, via the shared classifier
+    return template_for(classify_kolam(user_input))
 
-    # Load the reference image
-    reference_image_path = f"kolams/{image_type}.png"
-    image = Image.open(reference_image_path)
-
-    # Send request to Gemini
-    response = client.models.generate_content(
-        model="gemini-2.5-flash-image-preview",
-        contents=[prompt, image]
-    )
+def _template_part(image_type: str):
+    # Reference template: already loaded and encoded, no per-request file I/O
+    from google.genai import types
+    template = template_registry.get(image_type)
+    return types.Part.from_bytes(data=template.data, mime_type=template.mime_type)
 
+def _extract_image(response):
     # Handle response parts
     for part in response.candidates[0].content.parts:
         if part.text is not None:
@@ -67,6 +91,19 @@ def generate_kolam(user_input: str, reference_image_path: str = "kolam.jpg"):
 
     return None   # ✅ explicit fallback if nothing is returned
 
+def generate_kolam(user_input: str, reference_image_path: str = "kolam.jpg"):
+    # Fill the template with user input
+    prompt = PROMPT_TEMPLATE.format(user_input=user_input)
+    image_type = get_kolam_type(user_input)
+    image = _template_part(image_type)
+
+    # Send request to Gemini
+    response = get_client().models.generate_content(
+        model=GEMINI_MODEL,
+        contents=[prompt, image]
+    )
+    return _extract_image(response)
+
 def img_to_img(user_input: str, reference_image_path: str = "kolam.jpg"):
     # Fill the template with user input
     prompt = PROMPT_TEMPLATE.format(user_input=user_input)
@@ -76,20 +113,67 @@ def img_to_img(user_input: str, reference_image_path: str = "kolam.jpg"):
     image = Image.open(reference_image_path)
 
     # Send request to Gemini
-    response = client.models.generate_content(
-        model="gemini-2.5-flash-image-preview",
+    response = get_client().models.generate_content(
+        model=GEMINI_MODEL,
         contents=[prompt, image]
     )
+    return _extract_image(response)
+
+
+# ---------- async path ----------
+def _is_retryable(exc: Exception) -> bool:
+    if isinstance(exc, (asyncio.TimeoutError, httpx.TransportError)):
+        return True
+    return is_api_error(exc) and exc.code in RETRYABLE_STATUS
+
+def _error_reason(exc: Exception) -> str:
+    """Low-cardinality label for the upstream error counter."""
+    if isinstance(exc, asyncio.TimeoutError):
+        return "timeout"
+    if isinstance(exc, httpx.TransportError):
+        return "transport"
+    if is_api_error(exc):
+        return f"http_{exc.code}"
+    return type(exc).__name__
+
+async def _agenerate(contents):
+    """
+    One upstream call with a concurrency slot, a per-attempt timeout and
+    retries with full-jitter exponential backoff on transient failures.
+    """
+    global _upstream_slots
+    if _upstream_slots is None:
+        _upstream_slots = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+
+    for attempt in range(GEMINI_RETRIES + 1):
+        try:
+            async with _upstream_slots:
+                with stage("upstream.gemini"):
+                    response = await asyncio.wait_for(
+                        get_client().aio.models.generate_content(model=GEMINI_MODEL, contents=contents),
+                        timeout=GEMINI_TIMEOUT,
+                    )
+            return _extract_image(response)
+        except Exception as e:
+            UPSTREAM_ERRORS.inc(reason=_error_reason(e))
+            if attempt == GEMINI_RETRIES or not _is_retryable(e):
+                raise
+            await asyncio.sleep(random.uniform(0, GEMINI_BACKOFF * 2 ** attempt))
+
+async def agenerate_kolam(user_input: str, image_type: Optional[str] = None):
+    """
+    Async generate_kolam: does not hold a worker thread during the remote call.
+    Pass `image_type` when the template is already resolved.
+    """
+    prompt = PROMPT_TEMPLATE.format(user_input=user_input)
+    return await _agenerate([prompt, _template_part(image_type or get_kolam_type(user_input))])
 
-    # Handle response parts
-    for part in response.candidates[0].content.parts:
-        if part.text is not None:
-            print("Text output:\n", part.text)
-        elif part.inline_data is not None:
-            gen_img = Image.open(BytesIO(part.inline_data.data))
-            return gen_img   # ✅ return instead of saving
-
-    return None   # ✅ explicit fallback if nothing is returned
+async def aimg_to_img(user_input: str, image_bytes: bytes, mime_type: str = "image/png"):
+    """Async img_to_img taking the reference image as encoded bytes."""
+    from google.genai import types
+    prompt = PROMPT_TEMPLATE.format(user_input=user_input)
+    image = types.Part.from_bytes(data=image_bytes, mime_type=mime_type)
+    return await _agenerate([prompt, image])
 
 
 if __name__ == "__main__":
@@ -0,0 +1,354 @@
+# jobs.py
+"""
+Asynchronous generation jobs.
+
+Submitting a job returns its id straight away; a few asyncio workers take jobs
+off a FIFO queue and run the same generation path as the blocking endpoints.
+Clients poll the job or pass a `callback_url` that is POSTed the job status
+when it finishes; callbacks only go to hosts listed in KOLAM_JOB_CALLBACK_HOSTS
+(none by default), so a client cannot make the server call internal addresses.
+Tasks move through add_task_to_queue -> start_task -> finish_task, the task
+model of temo/modules/progress.py; that module is mirrored rather than imported
+because it depends on gradio and the webui's process-wide shared state.
+
+Jobs live in memory. Set KOLAM_JOB_DB to a SQLite file to keep jobs and their
+results across restarts; unfinished jobs are then re-queued at startup.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional
+from urllib.parse import urlsplit
+
+import httpx
+from starlette.concurrency import run_in_threadpool
+
+from metrics import record_stage
+
+JOB_DB = os.getenv("KOLAM_JOB_DB", "")
+JOB_WORKERS = int(os.getenv("KOLAM_JOB_WORKERS", "4"))
+# Maximum queued (not yet started) jobs before submissions are rejected
+JOB_MAX_QUEUED = int(os.getenv("KOLAM_JOB_MAX_QUEUED", "256"))
+# Finished jobs are forgotten after this many seconds
+JOB_TTL = float(os.getenv("KOLAM_JOB_TTL", "3600"))
+CALLBACK_TIMEOUT = float(os.getenv("KOLAM_JOB_CALLBACK_TIMEOUT", "10"))
+CALLBACK_RETRIES = int(os.getenv("KOLAM_JOB_CALLBACK_RETRIES", "3"))
+# Hosts callbacks may go to, comma-separated; ".example.com" also allows its subdomains
+CALLBACK_HOSTS = tuple(h.strip().lower() for h in os.getenv("KOLAM_JOB_CALLBACK_HOSTS", "").split(",") if h.strip())
+CALLBACK_SCHEMES = tuple(s.strip().lower() for s in os.getenv("KOLAM_JOB_CALLBACK_SCHEMES", "https").split(",") if s.strip())
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+class QueueFull(Exception):
+    """Raised when the job queue already holds `max_queued` jobs."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Job queue is full; retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+def check_callback_url(url: str, hosts=CALLBACK_HOSTS, schemes=CALLBACK_SCHEMES) -> str:
+    """Return `url` if its scheme and host are allowed, else raise ValueError."""
+    try:
+        parts = urlsplit(url)
+        host = (parts.hostname or "").lower()
+        parts.port  # raises ValueError on a malformed port
+    except ValueError:
+        raise ValueError("callback_url is not a valid URL") from None
+    if parts.scheme.lower() not in schemes:
+        raise ValueError(f"callback_url scheme must be one of {list(schemes)}")
+    if parts.username or parts.password:
+        raise ValueError("callback_url must not contain credentials")
+    if not any(host == allowed or (allowed.startswith(".") and host.endswith(allowed)) for allowed in hosts):
+        raise ValueError("callback_url host is not allowed (KOLAM_JOB_CALLBACK_HOSTS)"
+                         if hosts else "Job callbacks are disabled (KOLAM_JOB_CALLBACK_HOSTS is empty)")
+    return url
+
+
+class Job:
+    def __init__(self, kind: str, params: dict, payload: Optional[bytes] = None,
+                 callback_url: Optional[str] = None, id: Optional[str] = None,
+                 status: str = QUEUED, created: Optional[float] = None,
+                 started: Optional[float] = None, finished: Optional[float] = None,
+                 result: Optional[bytes] = None, meta: Optional[dict] = None,
+                 error: Optional[str] = None, error_status: Optional[int] = None):
+        self.id = id or uuid.uuid4().hex
+        self.kind = kind
+        self.params = params
+        self.payload = payload          # request body bytes (e.g. the uploaded image)
+        self.callback_url = callback_url
+        self.status = status
+        self.created = created or time.time()
+        self.started = started
+        self.finished = finished
+        self.result = result            # PNG bytes once done
+        self.meta = meta or {}
+        self.error = error
+        self.error_status = error_status
+
+    @property
+    def wait_seconds(self) -> Optional[float]:
+        return None if self.started is None else self.started - self.created
+
+    @property
+    def service_seconds(self) -> Optional[float]:
+        if self.started is None or self.finished is None:
+            return None
+        return self.finished - self.started
+
+    def info(self) -> dict:
+        """JSON-safe status (without payload or result bytes)."""
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "wait_seconds": self.wait_seconds,
+            "service_seconds": self.service_seconds,
+            "meta": self.meta,
+            "error": self.error,
+        }
+
+
+class JobStore:
+    """SQLite persistence for jobs; every call is a short blocking statement."""
+
+    COLUMNS = ("id", "kind", "params", "payload", "callback_url", "status", "created",
+               "started", "finished", "result", "meta", "error", "error_status")
+
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, kind TEXT, params TEXT, payload BLOB, callback_url TEXT,"
+                " status TEXT, created REAL, started REAL, finished REAL, result BLOB,"
+                " meta TEXT, error TEXT, error_status INTEGER)"
+            )
+
+    def save(self, job: Job):
+        row = (job.id, job.kind, json.dumps(job.params), job.payload, job.callback_url,
+               job.status, job.created, job.started, job.finished, job.result,
+               json.dumps(job.meta), job.error, job.error_status)
+        placeholders = ", ".join("?" * len(self.COLUMNS))
+        with self._lock, self._conn:
+            self._conn.execute(f"INSERT OR REPLACE INTO jobs VALUES ({placeholders})", row)
+
+    def delete(self, ids):
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM jobs WHERE id = ?", [(i,) for i in ids])
+
+    def load_all(self):
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(self.COLUMNS)} FROM jobs ORDER BY created"
+            ).fetchall()
+        jobs = []
+        for row in rows:
+            fields = dict(zip(self.COLUMNS, row))
+            fields["params"] = json.loads(fields["params"])
+            fields["meta"] = json.loads(fields["meta"] or "{}")
+            jobs.append(Job(**fields))
+        return jobs
+
+    def close(self):
+        self._conn.close()
+
+
+class JobQueue:
+    """
+    In-process job queue. `handler(job)` is an async callable returning
+    (png_bytes, meta_dict); exceptions mark the job failed, keeping their
+    `status_code`/`detail` when they have them (HTTPException).
+    """
+
+    def __init__(self, workers=JOB_WORKERS, max_queued=JOB_MAX_QUEUED, ttl=JOB_TTL, db_path=JOB_DB):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.ttl = ttl
+        self.db_path = db_path
+        self.store = None
+        self.jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self.queued_tasks: "OrderedDict[str, Job]" = OrderedDict()
+        self.running_tasks: "dict[str, Job]" = {}
+        self.stats = {
+            "completed": 0,
+            "failed": 0,
+            "wait_seconds_total": 0.0,
+            "service_seconds_total": 0.0,
+        }
+        # Moving averages, used for Retry-After and the metrics endpoint
+        self._avg_wait = 0.0
+        self._avg_service = 1.0
+        self._handler = None
+        self._queue = None
+        self._tasks = []
+        self._http = None
+        # In-flight callback deliveries
+        self._notifications = set()
+
+    # ---------- lifecycle ----------
+    async def start(self, handler):
+        self._handler = handler
+        self._queue = asyncio.Queue()
+        self._http = httpx.AsyncClient(timeout=CALLBACK_TIMEOUT)
+        if not CALLBACK_HOSTS:
+            print("Job callbacks are disabled: set KOLAM_JOB_CALLBACK_HOSTS to the hosts "
+                  "callback_url may point at (clients can still poll /jobs/{id})")
+        if self.db_path:
+            self.store = await run_in_threadpool(JobStore, self.db_path)
+            for job in await run_in_threadpool(self.store.load_all):
+                self.jobs[job.id] = job
+        self.queued_tasks.clear()
+        self.running_tasks.clear()
+        for job in self.jobs.values():
+            if job.status in (QUEUED, RUNNING):
+                # Interrupted by a restart: run it again from the start
+                job.status, job.started = QUEUED, None
+                self.queued_tasks[job.id] = job
+                self._queue.put_nowait(job.id)
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in [*self._tasks, *self._notifications]:
+            task.cancel()
+        await asyncio.gather(*self._tasks, *self._notifications, return_exceptions=True)
+        self._tasks = []
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+
+    # ---------- task model ----------
+    async def add_task_to_queue(self, kind: str, params: dict, payload: Optional[bytes] = None,
+                                callback_url: Optional[str] = None, meta: Optional[dict] = None) -> Job:
+        if len(self.queued_tasks) >= self.max_queued:
+            raise QueueFull(self.retry_after())
+        await self._purge()
+        job = Job(kind, params, payload=payload, callback_url=callback_url, meta=meta)
+        self.jobs[job.id] = job
+        self.queued_tasks[job.id] = job
+        await self._save(job)
+        self._queue.put_nowait(job.id)
+        return job
+
+    async def start_task(self, job: Job):
+        self.queued_tasks.pop(job.id, None)
+        self.running_tasks[job.id] = job
+        job.status = RUNNING
+        job.started = time.time()
+        self._avg_wait = 0.8 * self._avg_wait + 0.2 * job.wait_seconds
+        self.stats["wait_seconds_total"] += job.wait_seconds
+        record_stage("job.wait", job.wait_seconds)
+        await self._save(job)
+
+    async def finish_task(self, job: Job, result: Optional[bytes] = None, meta: Optional[dict] = None,
+                          error: Optional[str] = None, error_status: Optional[int] = None):
+        self.running_tasks.pop(job.id, None)
+        job.finished = time.time()
+        job.payload = None
+        if error is None:
+            job.status, job.result = DONE, result
+            job.meta.update(meta or {})
+            self.stats["completed"] += 1
+        else:
+            job.status, job.error, job.error_status = FAILED, error, error_status or 500
+            self.stats["failed"] += 1
+        self._avg_service = 0.8 * self._avg_service + 0.2 * job.service_seconds
+        self.stats["service_seconds_total"] += job.service_seconds
+        record_stage("job.service", job.service_seconds)
+        await self._save(job)
+        if job.callback_url:
+            # Keep a reference: the loop only holds tasks weakly
+            task = asyncio.ensure_future(self._notify(job))
+            self._notifications.add(task)
+            task.add_done_callback(self._notifications.discard)
+
+    # ---------- queries ----------
+    def get(self, job_id: str) -> Job:
+        try:
+            return self.jobs[job_id]
+        except KeyError:
+            raise KeyError(f"Unknown job {job_id!r}") from None
+
+    def position(self, job: Job) -> Optional[int]:
+        """0-based place in the queue, or None once the job has started."""
+        if job.id not in self.queued_tasks:
+            return None
+        return list(self.queued_tasks).index(job.id)
+
+    def retry_after(self) -> int:
+        per_worker = len(self.queued_tasks) / max(self.workers, 1)
+        return max(1, int(round(per_worker * self._avg_service)))
+
+    def metrics(self) -> dict:
+        return {
+            "queue_depth": len(self.queued_tasks),
+            "running": len(self.running_tasks),
+            "workers": self.workers,
+            "max_queued": self.max_queued,
+            "avg_wait_seconds": self._avg_wait,
+            "avg_service_seconds": self._avg_service,
+            **self.stats,
+        }
+
+    # ---------- internals ----------
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            job = self.jobs.get(job_id)
+            if job is None or job.status != QUEUED:
+                continue
+            await self.start_task(job)
+            try:
+                result, meta = await self._handler(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                detail = getattr(e, "detail", None) or str(e) or type(e).__name__
+                await self.finish_task(job, error=str(detail), error_status=getattr(e, "status_code", 500))
+            else:
+                await self.finish_task(job, result=bytes(result), meta=meta)
+
+    async def _notify(self, job: Job):
+        """POST the job status to its callback URL, retrying with backoff."""
+        try:
+            # Jobs restored from KOLAM_JOB_DB were accepted under an older allowlist
+            check_callback_url(job.callback_url)
+        except ValueError as e:
+            print(f"Job {job.id} callback skipped: {e}")
+            return
+        for attempt in range(CALLBACK_RETRIES):
+            try:
+                r = await self._http.post(job.callback_url, json=job.info())
+                if r.status_code < 500:
+                    return
+            except httpx.HTTPError as e:
+                print(f"Job {job.id} callback failed: {e}")
+            await asyncio.sleep(2 ** attempt)
+        print(f"Job {job.id} callback to {job.callback_url} gave up after {CALLBACK_RETRIES} attempts")
+
+    async def _save(self, job: Job):
+        if self.store is not None:
+            await run_in_threadpool(self.store.save, job)
+
+    async def _purge(self):
+        """Forget finished jobs older than the TTL."""
+        cutoff = time.time() - self.ttl
+        expired = [j.id for j in self.jobs.values() if j.finished is not None and j.finished < cutoff]
+        for job_id in expired:
+            del self.jobs[job_id]
+        if expired and self.store is not None:
+            await run_in_threadpool(self.store.delete, expired)
@@ -0,0 +1,239 @@
+# kolam_classifier.py
+"""
+Maps a free-text prompt to a canonical kolam type.
+
+Two stages. Whole-word keyword matching ("dots", "twisted", "lines", ...)
+answers most prompts with no model at all; "outline" no longer reads as
+"line". Prompts without a keyword are embedded with the sentence-transformers
+model (the one the similarity index already uses) and compared with prototype
+embeddings of each type, computed once when the model loads (at server
+startup). CLIP text similarities are high for almost any pair of prompts, so
+a prompt is only given a type when its best prototype beats the runner-up by
+a margin; otherwise it is "unknown". Prompt embeddings are kept in an LRU
+cache and concurrent lookups share one encoder batch.
+
+Canonical keywords are `pulli_kolam`, `sikku_kolam`, ... or "unknown";
+`template_for` maps them to the reference templates in `kolams/`.
+"""
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from batching import MicroBatcher
+from metrics import stage
+
+CLASSIFIER_MODEL = os.getenv("KOLAM_CLASSIFIER_MODEL", os.getenv("KOLAM_EMBED_MODEL", "clip-ViT-B-32"))
+# Prompt embeddings kept in memory
+CLASSIFIER_CACHE_SIZE = int(os.getenv("KOLAM_CLASSIFIER_CACHE_SIZE", "1024"))
+# How far the best prototype's cosine similarity must beat the second best, else "unknown"
+CLASSIFIER_MIN_MARGIN = float(os.getenv("KOLAM_CLASSIFIER_MIN_MARGIN", "0.02"))
+# Optional floor on the best similarity itself; off by default, CLIP text scores rarely drop below 0.6
+CLASSIFIER_MIN_SCORE = float(os.getenv("KOLAM_CLASSIFIER_MIN_SCORE", "0"))
+
+UNKNOWN = "unknown"
+# Template used for types without one of their own
+DEFAULT_TEMPLATE = "rangoli"
+
+# keyword -> (whole-word patterns, prototype descriptions), in matching priority order.
+# Tamil names also match as a prefix ("pullikolam"); English words only whole.
+KOLAM_TYPES = OrderedDict([
+    ("pulli_kolam", (
+        [r"pulli\w*", r"dots?", r"dotted"],
+        ["a pulli kolam drawn around a grid of dots",
+         "a dotted kolam pattern with dots joined by lines"],
+    )),
+    ("sikku_kolam", (
+        [r"sikku\w*", r"twist(?:s|ed|ing)?"],
+        ["a sikku kolam of twisted lines weaving around dots",
+         "a single continuous knotted line kolam"],
+    )),
+    ("kambi_kolam", (
+        [r"kambi\w*", r"lines?"],
+        ["a kambi kolam made of straight lines",
+         "a geometric line drawing kolam"],
+    )),
+    ("chikku_kolam", (
+        [r"chikku\w*", r"loops?", r"looped", r"looping"],
+        ["a chikku kolam of curved interlocking loops",
+         "a looping curvy kolam"],
+    )),
+    ("rangoli_kolam", (
+        [r"rangoli\w*", r"colou?r(?:s|ed|ful|full)?"],
+        ["a colourful rangoli filled with vibrant colours",
+         "festive coloured powder floor art with flowers"],
+    )),
+    ("isai_kolam", (
+        [r"isai\w*", r"music", r"musical"],
+        ["a musical kolam inspired by music and instruments"],
+    )),
+])
+
+_KEYWORD_PATTERNS = [
+    (keyword, re.compile(r"\b(?:" + "|".join(patterns) + r")\b"))
+    for keyword, (patterns, _) in KOLAM_TYPES.items()
+]
+
+
+def keyword_match(text: str):
+    """The zero-latency path: the first type with a whole-word keyword in `text`, else None."""
+    text = (text or "").lower()
+    for keyword, pattern in _KEYWORD_PATTERNS:
+        if pattern.search(text):
+            return keyword
+    return None
+
+
+def template_for(keyword: str) -> str:
+    """Reference template name for a canonical keyword (pulli_kolam -> pulli)."""
+    name = keyword[:-len("_kolam")] if keyword.endswith("_kolam") else keyword
+    return name if name in ("pulli", "sikku", "kambi", "chikku", "rangoli") else DEFAULT_TEMPLATE
+
+
+def _normalize(text: str) -> str:
+    return " ".join((text or "").lower().split())
+
+
+class KolamClassifier:
+    def __init__(self, model_name=CLASSIFIER_MODEL, cache_size=CLASSIFIER_CACHE_SIZE,
+                 min_margin=CLASSIFIER_MIN_MARGIN, min_score=CLASSIFIER_MIN_SCORE, model_loader=None):
+        """
+        model_loader: optional callable returning a loaded SentenceTransformer,
+        to share one resident model with another component.
+        """
+        self.model_name = model_name
+        self.cache_size = cache_size
+        self.min_margin = min_margin
+        self.min_score = min_score
+        self.model_loader = model_loader
+        self.stats = {"keyword": 0, "cached": 0, "embedded": 0, "no_model": 0, "unknown": 0}
+        self._model = None
+        self._model_error = None
+        self._labels = list(KOLAM_TYPES)
+        self._prototypes = None
+        self._cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.batcher = MicroBatcher(self._encode_batch, max_batch=32, max_wait=0.005)
+
+    # ---------- model ----------
+    def load(self):
+        """Load the encoder and embed the prototypes once; failures disable the model path."""
+        with self._lock:
+            if self._model is not None or self._model_error is not None:
+                return self._model
+            try:
+                if self.model_loader is not None:
+                    model = self.model_loader()
+                else:
+                    from sentence_transformers import SentenceTransformer
+                    model = SentenceTransformer(self.model_name)
+                prototypes = []
+                for _, descriptions in KOLAM_TYPES.values():
+                    vectors = self._encode(model, descriptions)
+                    mean = vectors.mean(axis=0)
+                    prototypes.append(mean / np.linalg.norm(mean))
+                self._prototypes = np.stack(prototypes)
+                self._model = model
+            except Exception as e:
+                # Whatever went wrong (missing package, download, bad weights), keywords still work
+                self._model_error = e
+                print(f"Kolam classifier model not loaded, using keywords only: {e}")
+            return self._model
+
+    @property
+    def model_error(self):
+        """Why the model failed to load (the exception), or None."""
+        return self._model_error
+
+    @property
+    def model_available(self) -> bool:
+        return self.load() is not None
+
+    @staticmethod
+    def _encode(model, texts):
+        vectors = model.encode(list(texts), batch_size=len(texts), convert_to_numpy=True,
+                               normalize_embeddings=True)
+        return np.asarray(vectors, dtype=np.float32)
+
+    def _encode_batch(self, texts):
+        """MicroBatcher batch function: one encoder pass, results cached."""
+        with stage("classifier.embed"):
+            vectors = self._encode(self._model, texts)
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                self._cache[text] = vector
+                self._cache.move_to_end(text)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return list(vectors)
+
+    def _cached(self, text: str):
+        with self._lock:
+            vector = self._cache.get(text)
+            if vector is not None:
+                self._cache.move_to_end(text)
+            return vector
+
+    def _nearest(self, vector) -> str:
+        scores = self._prototypes @ vector
+        second, best = np.argsort(scores)[-2:]
+        if scores[best] - scores[second] < self.min_margin or scores[best] < self.min_score:
+            return UNKNOWN
+        return self._labels[best]
+
+    def _count(self, path: str, keyword: str) -> str:
+        self.stats[path] += 1
+        if keyword == UNKNOWN:
+            self.stats["unknown"] += 1
+        return keyword
+
+    # ---------- public API ----------
+    def classify_sync(self, text: str) -> str:
+        """Blocking classification, for synchronous callers."""
+        keyword = keyword_match(text)
+        if keyword is not None:
+            return self._count("keyword", keyword)
+        normalized = _normalize(text)
+        if not normalized or not self.model_available:
+            return UNKNOWN
+        vector = self._cached(normalized)
+        if vector is not None:
+            return self._count("cached", self._nearest(vector))
+        return self._count("embedded", self._nearest(self._encode_batch([normalized])[0]))
+
+    async def classify(self, text: str) -> str:
+        """
+        Keyword match, else the cached or batched embedding; never blocks the loop.
+        The model is loaded at startup (see load()); until then only keywords match.
+        """
+        keyword = keyword_match(text)
+        if keyword is not None:
+            return self._count("keyword", keyword)
+        normalized = _normalize(text)
+        if not normalized:
+            return UNKNOWN
+        vector = self._cached(normalized)
+        if vector is not None:
+            return self._count("cached", self._nearest(vector))
+        if self._model is None:
+            # Still warming up at startup, or failed to load: never load inside a request
+            return self._count("no_model", UNKNOWN)
+        return self._count("embedded", self._nearest(await self.batcher.submit(normalized)))
+
+    def metrics(self) -> dict:
+        return {
+            "model": self.model_name,
+            "loaded": self._model is not None,
+            "cached_prompts": len(self._cache),
+            **self.stats,
+        }
+
+
+classifier = KolamClassifier()
+
+
+def get_kolam_type(user_input: str) -> str:
+    """Canonical kolam keyword for `user_input` (blocking; see KolamClassifier.classify)."""
+    return classifier.classify_sync(user_input)
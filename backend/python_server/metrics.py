@@ -0,0 +1,256 @@
+# metrics.py
+"""
+Request and stage instrumentation in the Prometheus text format.
+
+MetricsMiddleware records per-endpoint latency, in-flight requests and
+request/response sizes. Code marks the interesting parts of a request with
+
+    with stage("decode"):
+        ...
+
+which feeds the per-stage latency histogram and, for the current request, a
+trace (a ContextVar) that is returned as a `Server-Timing` header when the
+client sends `X-Kolam-Trace: 1`. Work done in the analysis worker processes is
+traced there and merged back by workers.AnalysisPool.
+"""
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from starlette.routing import Match
+
+TRACE_HEADER = os.getenv("KOLAM_TRACE_HEADER", "x-kolam-trace").lower()
+# Trace every request's stages into Server-Timing, not only those asking for it
+TRACE_ALL = os.getenv("KOLAM_TRACE_ALL", "0") == "1"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = tuple(2 ** p for p in range(8, 27, 2))  # 256 B .. 64 MB
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (extra or [])
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY[name] = self
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_one(key, value))
+        return lines
+
+    def _render_one(self, key, value):
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0, 0.0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                entry[0][index] += 1
+            entry[1] += 1
+            entry[2] += value
+
+    def _render_one(self, key, value):
+        counts, total, sum_ = value
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            labels = _format_labels(self.label_names, key, [("le", _format_value(float(bound)))])
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.label_names, key, [("le", "+Inf")])
+        lines.append(f"{self.name}_bucket{labels} {total}")
+        base = _format_labels(self.label_names, key)
+        lines.append(f"{self.name}_sum{base} {_format_value(sum_)}")
+        lines.append(f"{self.name}_count{base} {total}")
+        return lines
+
+
+# name -> metric, in registration order
+REGISTRY = {}
+
+def render_metrics() -> str:
+    return "\n".join(line for metric in REGISTRY.values() for line in metric.render()) + "\n"
+
+
+REQUEST_SECONDS = Histogram("kolam_request_seconds", "HTTP request latency by endpoint.",
+                            ("method", "endpoint", "status"))
+REQUESTS_IN_FLIGHT = Gauge("kolam_requests_in_flight", "HTTP requests being served.", ("endpoint",))
+REQUEST_BYTES = Histogram("kolam_request_bytes", "HTTP request body size.", ("endpoint",), SIZE_BUCKETS)
+RESPONSE_BYTES = Histogram("kolam_response_bytes", "HTTP response body size.", ("endpoint",), SIZE_BUCKETS)
+STAGE_SECONDS = Histogram("kolam_stage_seconds", "Time spent in each processing stage.", ("stage",))
+UPSTREAM_ERRORS = Counter("kolam_upstream_errors_total", "Failed upstream model calls (each attempt).",
+                          ("reason",))
+
+
+# ---------- stage timing ----------
+_trace: ContextVar[Optional[list]] = ContextVar("kolam_trace", default=None)
+
+
+def record_stage(name: str, seconds: float):
+    """Count a finished stage in the histogram and the current request's trace."""
+    STAGE_SECONDS.observe(seconds, stage=name)
+    trace = _trace.get()
+    if trace is not None:
+        trace.append((name, seconds))
+
+
+@contextmanager
+def stage(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+def trace_stages(stages):
+    """Add stages measured elsewhere (and already counted in the histogram) to the current request's trace."""
+    trace = _trace.get()
+    if trace is not None:
+        trace.extend(stages)
+
+
+@contextmanager
+def collect_stages():
+    """Start a fresh trace for the enclosed code and yield the list it fills."""
+    trace = []
+    token = _trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _trace.reset(token)
+
+
+def server_timing(trace) -> str:
+    """Stages as a Server-Timing header value; repeated stages are summed."""
+    totals = {}
+    for name, seconds in trace:
+        totals[name] = totals.get(name, 0.0) + seconds
+    return ", ".join(f"{name.replace(' ', '_')};dur={seconds * 1000:.2f}" for name, seconds in totals.items())
+
+
+# ---------- middleware ----------
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware, so streamed responses are measured to their last byte.
+    Requests are labelled with their route template (bounded cardinality);
+    paths matching no route share the "unmatched" label.
+    """
+
+    def __init__(self, app, router):
+        self.app = app
+        self.router = router
+
+    def _endpoint(self, scope) -> str:
+        partial = None
+        for route in self.router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return getattr(route, "path", "unmatched")
+            if match == Match.PARTIAL and partial is None:
+                partial = getattr(route, "path", None)
+        return partial or "unmatched"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope.get("headers") or [])
+        tracing = TRACE_ALL or headers.get(TRACE_HEADER.encode(), b"").lower() in (b"1", b"true", b"yes")
+        endpoint = self._endpoint(scope)
+        start = time.perf_counter()
+        state = {"status": 500, "sent": 0, "received": 0}
+
+        async def counting_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                state["received"] += len(message.get("body", b""))
+            return message
+
+        async def timed_send(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+                if tracing:
+                    # Stages still running after the headers (streamed bodies) are not included
+                    message = {**message, "headers": list(message.get("headers", [])) + [
+                        (b"server-timing", server_timing(trace).encode("latin-1")),
+                    ]}
+            elif message["type"] == "http.response.body":
+                state["sent"] += len(message.get("body", b""))
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc(endpoint=endpoint)
+        with collect_stages() as trace:
+            try:
+                await self.app(scope, counting_receive, timed_send)
+            finally:
+                REQUESTS_IN_FLIGHT.dec(endpoint=endpoint)
+                REQUEST_SECONDS.observe(time.perf_counter() - start, method=scope["method"],
+                                        endpoint=endpoint, status=state["status"])
+                REQUEST_BYTES.observe(state["received"], endpoint=endpoint)
+                RESPONSE_BYTES.observe(state["sent"], endpoint=endpoint)
@@ -0,0 +1,297 @@
+# procedural.py
+"""
+Procedural kolams on a dot (pulli) grid, drawn locally in milliseconds.
+
+The line is a mirror curve: it runs diagonally from one cell-edge midpoint to
+the next, passing around the dots, and bounces off the border and off
+"mirrors" placed on some interior edges. With no mirrors it is the classic
+interlaced lattice; every mirror splits or joins loops around the dots.
+Mirrors are chosen per orbit of the symmetry group, so the drawing keeps the
+requested rotational (and optionally reflection) symmetry.
+
+Coordinates are doubled grid units: dot (i, j) sits at (2i+1, 2j+1), edge
+midpoints have one even and one odd coordinate. A smooth stroke is the
+quadratic B-spline through the traced points, the same curve in the raster
+and in the SVG; a straight stroke keeps the corners (kambi line drawings).
+"""
+import hashlib
+import re
+from typing import Optional
+
+import cv2
+import numpy as np
+
+KINDS = ("pulli", "sikku", "kambi")
+STROKES = ("smooth", "straight")
+SYMMETRY_ORDERS = (1, 2, 4)
+
+# canonical kolam keyword -> procedural kind
+KIND_FOR_KEYWORD = {
+    "pulli_kolam": "pulli",
+    "sikku_kolam": "sikku",
+    "chikku_kolam": "sikku",
+    "kambi_kolam": "kambi",
+}
+
+# kind -> (mirror density, stroke, prefer a single continuous loop)
+KIND_DEFAULTS = {
+    "pulli": (0.15, "smooth", False),
+    "sikku": (0.4, "smooth", True),
+    "kambi": (0.35, "straight", False),
+}
+
+# Random mirror layouts tried when a single loop is preferred
+LOOP_ATTEMPTS = 24
+
+BACKGROUND = (32, 42, 59)       # BGR
+STROKE_COLOR = (255, 255, 255)
+DOT_COLOR = (200, 220, 240)
+
+_GRID_RE = re.compile(r"\b(\d{1,2})\s*[x×*]\s*(\d{1,2})\b")
+
+
+def grid_from_text(text: str):
+    """A "5x5"-style dot grid mentioned in the prompt, as (rows, cols), else None."""
+    match = _GRID_RE.search(text or "")
+    if match is None:
+        return None
+    return int(match.group(1)), int(match.group(2))
+
+
+def seed_from_text(text: str) -> int:
+    """Stable seed, so the same prompt always draws the same kolam."""
+    normalized = " ".join((text or "").lower().split())
+    return int.from_bytes(hashlib.sha256(normalized.encode("utf-8")).digest()[:8], "big")
+
+
+# ---------- mirror layout ----------
+def interior_edges(rows: int, cols: int):
+    """Midpoints of the edges between neighbouring cells (mirror candidates)."""
+    vertical = [(x, y) for x in range(2, 2 * cols, 2) for y in range(1, 2 * rows, 2)]
+    horizontal = [(x, y) for x in range(1, 2 * cols, 2) for y in range(2, 2 * rows, 2)]
+    return vertical + horizontal
+
+
+def symmetry_orbits(rows: int, cols: int, order: int = 4, reflect: bool = True):
+    """Interior edges grouped into orbits of the C_order (or D_order) group."""
+    if order not in SYMMETRY_ORDERS:
+        raise ValueError(f"symmetry order must be one of {SYMMETRY_ORDERS}")
+    if order == 4 and rows != cols:
+        raise ValueError("4-fold symmetry needs a square grid")
+    w, h = 2 * cols, 2 * rows
+
+    def images(p):
+        x, y = p
+        points = [(x, y)]
+        if order >= 2:
+            points.append((w - x, h - y))
+        if order == 4:
+            points += [(w - y, x), (y, h - x)]
+        if reflect:
+            points += [(w - px, py) for px, py in points]
+        return points
+
+    seen, orbits = set(), []
+    for edge in interior_edges(rows, cols):
+        if edge in seen:
+            continue
+        orbit = sorted(set(images(edge)))
+        seen.update(orbit)
+        orbits.append(orbit)
+    return orbits
+
+
+def random_mirrors(orbits, density: float, rng) -> set:
+    mirrors = set()
+    for orbit, draw in zip(orbits, rng.random(len(orbits))):
+        if draw < density:
+            mirrors.update(orbit)
+    return mirrors
+
+
+# ---------- tracing ----------
+def trace_loops(rows: int, cols: int, mirrors: set):
+    """Closed loops of the mirror curve, each a list of edge midpoints."""
+    w, h = 2 * cols, 2 * rows
+
+    def bounce(x, y, dx, dy):
+        # Vertical edges (even x) flip dx, horizontal edges (even y) flip dy
+        if x % 2 == 0 and (x in (0, w) or (x, y) in mirrors):
+            dx = -dx
+        if y % 2 == 0 and (y in (0, h) or (x, y) in mirrors):
+            dy = -dy
+        return dx, dy
+
+    visited, loops = set(), []
+    midpoints = [(x, y) for x in range(w + 1) for y in range(h + 1) if (x + y) % 2 == 1]
+    for x0, y0 in midpoints:
+        for dx0, dy0 in ((1, 1), (1, -1), (-1, 1), (-1, -1)):
+            x1, y1 = x0 + dx0, y0 + dy0
+            if not (0 <= x1 <= w and 0 <= y1 <= h):
+                continue
+            if frozenset(((x0, y0), (x1, y1))) in visited:
+                continue
+            # Every segment belongs to exactly one strand: follow it until it closes
+            loop, x, y, dx, dy = [], x0, y0, dx0, dy0
+            while True:
+                loop.append((x, y))
+                visited.add(frozenset(((x, y), (x + dx, y + dy))))
+                x, y = x + dx, y + dy
+                dx, dy = bounce(x, y, dx, dy)
+                if (x, y, dx, dy) == (x0, y0, dx0, dy0):
+                    break
+            loops.append(loop)
+    return loops
+
+
+def smooth_loop(loop, samples: int = 6) -> np.ndarray:
+    """Sample the closed quadratic B-spline with the loop's points as controls."""
+    points = np.asarray(loop, dtype=np.float64)
+    prev_mid = (np.roll(points, 1, axis=0) + points) / 2
+    next_mid = (points + np.roll(points, -1, axis=0)) / 2
+    t = np.linspace(0, 1, samples, endpoint=False)[:, None, None]
+    curve = (1 - t) ** 2 * prev_mid + 2 * (1 - t) * t * points + t ** 2 * next_mid
+    return curve.transpose(1, 0, 2).reshape(-1, 2)
+
+
+# ---------- kolam ----------
+class Kolam:
+    """One procedural kolam: the dot grid and its traced loops."""
+
+    def __init__(self, rows: int, cols: int, loops, kind: str = "sikku", stroke: str = "smooth",
+                 symmetry: int = 4, reflect: bool = True, seed: Optional[int] = None):
+        self.rows = rows
+        self.cols = cols
+        self.loops = loops
+        self.kind = kind
+        self.stroke = stroke
+        self.symmetry = symmetry
+        self.reflect = reflect
+        self.seed = seed
+
+    @property
+    def dots(self):
+        return [(2 * i + 1, 2 * j + 1) for j in range(self.rows) for i in range(self.cols)]
+
+    def info(self) -> dict:
+        return {
+            "kind": self.kind,
+            "rows": self.rows,
+            "cols": self.cols,
+            "loops": len(self.loops),
+            "stroke": self.stroke,
+            "symmetry": self.symmetry,
+            "reflect": self.reflect,
+            "seed": self.seed,
+        }
+
+    def _polylines(self):
+        if self.stroke == "smooth":
+            return [smooth_loop(loop) for loop in self.loops]
+        return [np.asarray(loop, dtype=np.float64) for loop in self.loops]
+
+    def _layout(self, size: int, margin: float = 0.06):
+        """Pixel scale and offset for doubled grid units, centred in a square canvas."""
+        span = 2 * max(self.rows, self.cols)
+        scale = size * (1 - 2 * margin) / span
+        offset = (size - scale * np.array([2 * self.cols, 2 * self.rows])) / 2
+        return scale, offset
+
+    def raster(self, size: int = 512, stroke_width: int = 3, dots: bool = True,
+               background=BACKGROUND, color=STROKE_COLOR, dot_color=DOT_COLOR) -> np.ndarray:
+        """BGR uint8 image; coordinates are drawn with 4 fractional bits."""
+        canvas = np.empty((size, size, 3), np.uint8)
+        canvas[:] = background
+        scale, offset = self._layout(size)
+        fixed = [np.round((line * scale + offset) * 16).astype(np.int32) for line in self._polylines()]
+        cv2.polylines(canvas, fixed, True, color, stroke_width, cv2.LINE_AA, shift=4)
+        if dots:
+            radius = max(int(round(scale * 0.14 * 16)), 16)
+            for x, y in np.round((np.array(self.dots) * scale + offset) * 16).astype(np.int32):
+                cv2.circle(canvas, (int(x), int(y)), radius, dot_color, -1, cv2.LINE_AA, shift=4)
+        return canvas
+
+    def svg(self, size: int = 512, stroke_width: int = 3, dots: bool = True,
+            background=BACKGROUND, color=STROKE_COLOR, dot_color=DOT_COLOR) -> str:
+        """The same drawing as an SVG document, in doubled grid units."""
+        scale, offset = self._layout(size)
+        x0, y0 = -offset / scale
+        span = size / scale
+
+        def hex_color(bgr):
+            b, g, r = bgr
+            return f"#{r:02x}{g:02x}{b:02x}"
+
+        paths = []
+        for loop in self.loops:
+            if self.stroke == "smooth":
+                # Quadratic B-spline: curve between edge midpoints with the loop points as controls
+                mids = [((ax + bx) / 2, (ay + by) / 2)
+                        for (ax, ay), (bx, by) in zip(loop, loop[1:] + loop[:1])]
+                d = [f"M{mids[-1][0]:g} {mids[-1][1]:g}"]
+                d += [f"Q{px} {py} {mx:g} {my:g}" for (px, py), (mx, my) in zip(loop, mids)]
+            else:
+                d = [f"M{loop[0][0]} {loop[0][1]}"] + [f"L{x} {y}" for x, y in loop[1:]]
+            paths.append(f'<path d="{" ".join(d)}Z"/>')
+        circles = []
+        if dots:
+            r = max(0.14, 1 / scale)
+            circles = [f'<circle cx="{x}" cy="{y}" r="{r:g}"/>' for x, y in self.dots]
+
+        return (
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{size}" height="{size}" '
+            f'viewBox="{x0:g} {y0:g} {span:g} {span:g}">'
+            f'<rect x="{x0:g}" y="{y0:g}" width="{span:g}" height="{span:g}" fill="{hex_color(background)}"/>'
+            f'<g fill="none" stroke="{hex_color(color)}" stroke-width="{stroke_width / scale:g}" '
+            f'stroke-linejoin="round" stroke-linecap="round">{"".join(paths)}</g>'
+            f'<g fill="{hex_color(dot_color)}">{"".join(circles)}</g>'
+            "</svg>"
+        )
+
+
+def generate(rows: int = 5, cols: Optional[int] = None, kind: str = "sikku", symmetry: int = 4,
+             reflect: bool = True, stroke: Optional[str] = None, density: Optional[float] = None,
+             seed: Optional[int] = None) -> Kolam:
+    """
+    Build a kolam on a rows x cols dot grid. `density` is the share of mirror
+    orbits set (default per kind); sikku kolams keep the layout with the fewest
+    loops out of LOOP_ATTEMPTS, aiming for one continuous line.
+    """
+    cols = rows if cols is None else cols
+    if kind not in KINDS:
+        raise ValueError(f"kind must be one of {KINDS}")
+    if not (1 <= rows <= 25 and 1 <= cols <= 25):
+        raise ValueError("grid must be between 1x1 and 25x25 dots")
+    default_density, default_stroke, single_loop = KIND_DEFAULTS[kind]
+    density = default_density if density is None else density
+    stroke = stroke or default_stroke
+    if stroke not in STROKES:
+        raise ValueError(f"stroke must be one of {STROKES}")
+
+    orbits = symmetry_orbits(rows, cols, symmetry, reflect)
+    rng = np.random.default_rng(seed)
+    best = None
+    for _ in range(LOOP_ATTEMPTS if single_loop else 1):
+        loops = trace_loops(rows, cols, random_mirrors(orbits, density, rng))
+        if best is None or len(loops) < len(best):
+            best = loops
+        if len(best) == 1:
+            break
+    return Kolam(rows, cols, best, kind, stroke, symmetry, reflect, seed)
+
+
+def kolam_for_prompt(user_input: str, keyword: str, rows: Optional[int] = None, cols: Optional[int] = None,
+                     symmetry: int = 4, reflect: bool = True, stroke: Optional[str] = None,
+                     seed: Optional[int] = None) -> Kolam:
+    """
+    The procedural stand-in for a text prompt: the kind comes from the kolam
+    keyword, the grid from the arguments, then the prompt ("7x7"), then 5x5.
+    Unset seeds are derived from the prompt.
+    """
+    if rows is None:
+        rows, cols = grid_from_text(user_input) or (5, cols)
+    cols = rows if cols is None else cols
+    if symmetry == 4 and rows != cols:
+        symmetry = 2
+    seed = seed_from_text(user_input) if seed is None else seed
+    return generate(rows, cols, KIND_FOR_KEYWORD.get(keyword, "sikku"), symmetry, reflect, stroke, seed=seed)
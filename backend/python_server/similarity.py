@@ -0,0 +1,184 @@
+# similarity.py
+"""
+Similarity search over the shipped kolam image index.
+
+`kolam_images_index.faiss` holds CLIP (ViT-B/32, 512-d) image embeddings and
+`kolam_images_meta.pkl` one metadata dict per vector. The base index is
+memory-mapped read-only once at startup; uploads added at runtime go into a
+small in-memory "delta" index that is searched alongside it and persisted next
+to the base files, so new kolams are searchable without rebuilding the index.
+"""
+import os
+import pickle
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from batching import MicroBatcher
+from metrics import stage
+
+INDEX_PATH = Path(os.getenv("KOLAM_INDEX_PATH", "kolam_images_index.faiss"))
+META_PATH = Path(os.getenv("KOLAM_INDEX_META_PATH", "kolam_images_meta.pkl"))
+DELTA_INDEX_PATH = INDEX_PATH.with_name(INDEX_PATH.stem + "_delta.faiss")
+DELTA_META_PATH = META_PATH.with_name(META_PATH.stem + "_delta.pkl")
+# Must match the model the index was built with
+EMBED_MODEL = os.getenv("KOLAM_EMBED_MODEL", "clip-ViT-B-32")
+
+
+class KolamIndex:
+    def __init__(self, index_path=INDEX_PATH, meta_path=META_PATH,
+                 delta_index_path=DELTA_INDEX_PATH, delta_meta_path=DELTA_META_PATH,
+                 model_name=EMBED_MODEL):
+        self.index_path = Path(index_path)
+        self.meta_path = Path(meta_path)
+        self.delta_index_path = Path(delta_index_path)
+        self.delta_meta_path = Path(delta_meta_path)
+        self.model_name = model_name
+        self.base = None
+        self.meta = []
+        self.delta = None
+        self.delta_meta = []
+        self._model = None
+        self._model_lock = threading.Lock()
+        # faiss indexes are not safe to add to while searching
+        self._lock = threading.Lock()
+        self.batcher = MicroBatcher(self._query_batch, max_batch=32, max_wait=0.01)
+
+    @property
+    def loaded(self) -> bool:
+        return self.base is not None
+
+    @property
+    def ntotal(self) -> int:
+        return self.base.ntotal + self.delta.ntotal
+
+    def load(self):
+        """Memory-map the base index and load metadata plus any persisted delta."""
+        import faiss
+
+        self.base = faiss.read_index(str(self.index_path), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        with self.meta_path.open("rb") as f:
+            self.meta = pickle.load(f)
+
+        if self.delta_index_path.exists() and self.delta_meta_path.exists():
+            self.delta = faiss.read_index(str(self.delta_index_path))
+            with self.delta_meta_path.open("rb") as f:
+                self.delta_meta = pickle.load(f)
+        else:
+            self.delta = faiss.IndexFlat(self.base.d, self.base.metric_type)
+            self.delta_meta = []
+
+    @property
+    def higher_is_better(self) -> bool:
+        import faiss
+        return self.base.metric_type == faiss.METRIC_INNER_PRODUCT
+
+    # ---------- embedding ----------
+    def model(self):
+        """Load the embedding model on first use and keep it resident."""
+        with self._model_lock:
+            if self._model is None:
+                from sentence_transformers import SentenceTransformer
+                self._model = SentenceTransformer(self.model_name)
+            return self._model
+
+    def embed(self, images):
+        """Embed a list of PIL images as float32 (n, d), L2-normalized like the index."""
+        vectors = self.model().encode(
+            [img.convert("RGB") for img in images],
+            batch_size=len(images),
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+        )
+        return np.ascontiguousarray(vectors, dtype=np.float32)
+
+    # ---------- search ----------
+    def _search_params(self, nprobe):
+        """
+        Per-call search parameters for `nprobe`, or None. The index itself is never
+        modified, so concurrent searches with different nprobe cannot see each other's.
+        """
+        import faiss
+        if nprobe is None or faiss.try_extract_index_ivf(self.base) is None:
+            return None  # flat index: every vector is scanned anyway
+        params = faiss.SearchParametersIVF(nprobe=nprobe)
+        if isinstance(self.base, faiss.IndexPreTransform):
+            params = faiss.SearchParametersPreTransform(index_params=params)
+        return params
+
+    def search(self, vectors, k, nprobe=None):
+        """
+        Search base + delta; returns (scores, ids) of shape (n, k), best first.
+        Delta ids continue after the base ids. Missing results have id -1.
+        """
+        params = self._search_params(nprobe)
+        with self._lock:
+            results = [self.base.search(vectors, min(k, self.base.ntotal), params=params)]
+            if self.delta.ntotal:
+                d_scores, d_ids = self.delta.search(vectors, min(k, self.delta.ntotal))
+                results.append((d_scores, np.where(d_ids >= 0, d_ids + self.base.ntotal, -1)))
+
+        scores = np.concatenate([s for s, _ in results], axis=1)
+        ids = np.concatenate([i for _, i in results], axis=1)
+        order = np.argsort(-scores if self.higher_is_better else scores, axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(scores, order, axis=1), np.take_along_axis(ids, order, axis=1)
+
+    def metadata(self, idx):
+        if idx < self.base.ntotal:
+            return self.meta[idx]
+        return self.delta_meta[idx - self.base.ntotal]
+
+    def _query_batch(self, items):
+        """
+        Batch function for concurrent /similar requests: one embedding pass for all
+        images, then one index search per distinct nprobe with the largest k asked for.
+        """
+        with stage("similarity.embed"):
+            vectors = self.embed([img for img, _, _ in items])
+        out = [None] * len(items)
+        groups = {}
+        for pos, (_, k, nprobe) in enumerate(items):
+            groups.setdefault(nprobe, []).append(pos)
+        for nprobe, positions in groups.items():
+            k_max = max(items[pos][1] for pos in positions)
+            with stage("similarity.search"):
+                scores, ids = self.search(vectors[positions], k_max, nprobe)
+            for row, pos in enumerate(positions):
+                k = items[pos][1]
+                out[pos] = [
+                    {"rank": rank + 1, "id": int(idx), "score": float(score), "metadata": self.metadata(int(idx))}
+                    for rank, (score, idx) in enumerate(zip(scores[row, :k], ids[row, :k]))
+                    if idx >= 0
+                ]
+        return out
+
+    async def query(self, image, k=5, nprobe=None):
+        """Top-k matches for one image; concurrent calls are batched together."""
+        return await self.batcher.submit((image, k, nprobe))
+
+    # ---------- incremental add ----------
+    def _persist_delta(self):
+        """Write the delta index and metadata via temp files, so a crash never leaves half a file."""
+        import faiss
+
+        index_tmp = self.delta_index_path.with_name(self.delta_index_path.name + ".tmp")
+        meta_tmp = self.delta_meta_path.with_name(self.delta_meta_path.name + ".tmp")
+        faiss.write_index(self.delta, str(index_tmp))
+        with meta_tmp.open("wb") as f:
+            pickle.dump(self.delta_meta, f)
+        # Metadata first: an extra trailing entry is harmless, a vector without one is not
+        os.replace(meta_tmp, self.delta_meta_path)
+        os.replace(index_tmp, self.delta_index_path)
+
+    def add(self, image, metadata: dict) -> int:
+        """
+        Embed and add one image to the delta index, persist it, and return its id.
+        """
+        vector = self.embed([image])
+        with self._lock:
+            self.delta.add(vector)
+            self.delta_meta.append(metadata)
+            new_id = self.base.ntotal + self.delta.ntotal - 1
+            self._persist_delta()
+        return new_id
@@ -0,0 +1,78 @@
+# templates.py
+"""
+Registry of the reference kolam templates in `kolams/`.
+
+Each PNG is read and decoded once and its encoded bytes are kept, so the
+generation path can hand them to the Gemini client without touching the disk
+or re-encoding the image. Files are re-checked at most every
+`check_interval` seconds and reloaded only when their mtime or size changes.
+"""
+import hashlib
+import os
+import threading
+import time
+from io import BytesIO
+from pathlib import Path
+
+from PIL import Image
+
+TEMPLATE_DIR = Path(os.getenv("KOLAM_TEMPLATE_DIR", Path(__file__).resolve().parent / "kolams"))
+TEMPLATE_CHECK_INTERVAL = float(os.getenv("KOLAM_TEMPLATE_CHECK_INTERVAL", "2.0"))
+
+
+class Template:
+    """One decoded template plus its upload-ready encoding."""
+
+    mime_type = "image/png"
+
+    def __init__(self, name: str, path: Path):
+        self.name = name
+        self.path = path
+        st = path.stat()
+        self.mtime = st.st_mtime_ns
+        self.size = st.st_size
+        self.data = path.read_bytes()
+        self.digest = hashlib.sha256(self.data).hexdigest()
+        self.image = Image.open(BytesIO(self.data))
+        self.image.load()
+
+
+class TemplateRegistry:
+    def __init__(self, directory=TEMPLATE_DIR, check_interval=TEMPLATE_CHECK_INTERVAL):
+        self.directory = Path(directory)
+        self.check_interval = check_interval
+        self._templates: "dict[str, Template]" = {}
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """(Re)scan the directory; only new or modified files are read again."""
+        with self._lock:
+            templates = {}
+            for path in sorted(self.directory.glob("*.png")):
+                current = self._templates.get(path.stem)
+                st = path.stat()
+                if current is not None and (current.mtime, current.size) == (st.st_mtime_ns, st.st_size):
+                    templates[path.stem] = current
+                else:
+                    templates[path.stem] = Template(path.stem, path)
+            self._templates = templates
+            self._checked_at = time.monotonic()
+
+    def _maybe_reload(self):
+        if self._checked_at is None or time.monotonic() - self._checked_at >= self.check_interval:
+            self.load()
+
+    def names(self):
+        self._maybe_reload()
+        return sorted(self._templates)
+
+    def get(self, name: str) -> Template:
+        self._maybe_reload()
+        try:
+            return self._templates[name]
+        except KeyError:
+            raise KeyError(f"No kolam template {name!r} in {self.directory}") from None
+
+
+registry = TemplateRegistry()
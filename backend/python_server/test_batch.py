@@ -0,0 +1,62 @@
+"""Zip batch sources: members that would inflate too far are refused before or while decompressing."""
+import asyncio
+import io
+import zipfile
+
+import pytest
+
+import batch
+from batch import Batch, read_member, zip_sources
+
+
+def _zip(members, compression=zipfile.ZIP_DEFLATED):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression) as zf:
+        for name, data in members.items():
+            zf.writestr(name, data)
+    buffer.seek(0)
+    return zipfile.ZipFile(buffer)
+
+
+def test_reads_a_member_within_limits():
+    zf = _zip({"a.png": b"x" * 100}, zipfile.ZIP_STORED)
+    assert read_member(zf, zf.getinfo("a.png"), max_bytes=100) == b"x" * 100
+
+
+def test_refuses_a_member_whose_header_is_too_large():
+    zf = _zip({"a.png": b"x" * 101}, zipfile.ZIP_STORED)
+    with pytest.raises(ValueError, match="inflates to 101 bytes"):
+        read_member(zf, zf.getinfo("a.png"), max_bytes=100)
+
+
+def test_refuses_a_high_compression_ratio(monkeypatch):
+    monkeypatch.setattr(batch, "ZIP_MAX_RATIO", 50)
+    zf = _zip({"bomb.png": b"\0" * 100_000})
+    info = zf.getinfo("bomb.png")
+    assert info.file_size > 50 * info.compress_size
+    with pytest.raises(ValueError, match="compression ratio"):
+        read_member(zf, info, max_bytes=1_000_000)
+
+
+def test_a_header_that_understates_the_size_is_refused():
+    zf = _zip({"a.png": b"x" * 10_000})
+    info = zf.getinfo("a.png")
+    info.file_size = 10
+    # zipfile stops at the declared size and fails the CRC; read_member never returns more
+    with pytest.raises((ValueError, zipfile.BadZipFile)):
+        read_member(zf, info, max_bytes=100)
+
+
+def test_oversized_member_fails_alone_and_the_archive_is_closed():
+    zf = _zip({"ok.png": b"small", "big.png": b"x" * 500, "notes.txt": b"skip", "dir/": b""})
+    sources = zip_sources(zf, max_bytes=100, prefix="upload.zip/")
+    assert [name for name, _ in sources] == ["upload.zip/ok.png", "upload.zip/big.png"]
+
+    async def analyze(data):
+        return {"bytes": len(data)}
+
+    run = Batch(len(sources), archives=[zf])
+    asyncio.run(run.run(sources, analyze, concurrency=2))
+
+    assert run.info()["failed"] == 1
+    assert zf.fp is None
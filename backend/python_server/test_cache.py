@@ -0,0 +1,62 @@
+"""ResultCache: request coalescing and the two storage tiers."""
+import asyncio
+
+import pytest
+
+from cache import ResultCache, cache_key
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ResultCache(directory=tmp_path / "cache", memory_items=2)
+    yield cache
+    cache.close()
+
+
+def test_concurrent_misses_share_one_compute(cache):
+    calls = 0
+
+    async def compute():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return b"png"
+
+    async def scenario():
+        return await asyncio.gather(*(cache.get_or_compute("k", compute) for _ in range(5)))
+
+    results = asyncio.run(scenario())
+    assert calls == 1
+    assert [value for value, _ in results] == [b"png"] * 5
+    assert sorted(status for _, status in results) == ["coalesced"] * 4 + ["miss"]
+    assert asyncio.run(cache.get_or_compute("k", compute)) == (b"png", "hit")
+
+
+def test_failed_compute_reaches_every_waiter_and_is_not_cached(cache):
+    async def compute():
+        await asyncio.sleep(0.05)
+        raise RuntimeError("upstream down")
+
+    async def scenario():
+        return await asyncio.gather(*(cache.get_or_compute("k", compute) for _ in range(3)),
+                                    return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert not cache._inflight
+    assert asyncio.run(cache.get("k")) is None
+
+
+def test_disk_tier_outlives_the_memory_tier(cache):
+    async def scenario():
+        for key in "abc":
+            await cache.put(key, key.encode())
+        assert "a" not in cache._memory
+        return await cache.get("a")
+
+    assert asyncio.run(scenario()) == b"a"
+
+
+def test_key_ignores_case_and_whitespace():
+    assert cache_key("Lotus  Kolam", "pulli") == cache_key(" lotus kolam", "pulli")
+    assert cache_key("lotus", "pulli", b"ref") != cache_key("lotus", "pulli")
@@ -0,0 +1,16 @@
+"""DiffusionService settings that do not need torch: dtype resolution and service sharing."""
+from diffusion_service import DiffusionService, get_service, resolve_dtype
+
+
+def test_float16_only_on_cuda():
+    assert resolve_dtype("cuda", "float16") == "float16"
+    assert resolve_dtype("cuda:1", "float16") == "float16"
+    assert resolve_dtype("cpu", "float16") == "float32"
+    assert resolve_dtype("cpu", "bfloat16") == "bfloat16"
+    assert DiffusionService("m", device="cpu", dtype="float16").dtype == "float32"
+
+
+def test_cpu_float16_shares_the_float32_service():
+    a = get_service("test-model", device="cpu", dtype="float16")
+    b = get_service("test-model", device="cpu", dtype="float32")
+    assert a is b and a.dtype == "float32"
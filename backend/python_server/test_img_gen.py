@@ -1,40 +1,22 @@
-import torch
-from diffusers import DiffusionPipeline, DPMSolverMultistepScheduler
-from PIL import Image
+import logging
 
-def generate(prompt: str, model_id: str = "runwayml/stable-diffusion-v1-5", 
-             height: int = 768, width: int = 768, guidance_scale: float = 7.5, 
-             num_inference_steps: int = 50, seed: int = 42):
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-
-    # Load pipeline
-    pipe = DiffusionPipeline.from_pretrained(
-        model_id,
-        torch_dtype=torch.float16 if device.type == "cuda" else torch.float32,
-        revision="fp16" if device.type == "cuda" else None,
-        use_safetensors=True,
-        safety_checker=None  # optional: remove safety filtering if you want full control
-    )
-    pipe = pipe.to(device)
+from diffusion_service import default_device, get_service
 
-    # Optionally choose a scheduler (default may work fine)
-    pipe.scheduler = DPMSolverMultistepScheduler.from_config(pipe.scheduler.config)
+logger = logging.getLogger(__name__)
 
-    # Set seed
-    generator = torch.Generator(device).manual_seed(seed)
-
-    # Generate
-    out = pipe(
-        prompt=prompt,
-        height=height,
-        width=width,
-        guidance_scale=guidance_scale,
-        num_inference_steps=num_inference_steps,
-        generator=generator
-    )
+def generate(prompt: str, model_id: str = "runwayml/stable-diffusion-v1-5", 
+             height: int = 768, width: int = 768, guidance_scale: float = 7.5, 
+             num_inference_steps: int = 50, seed: int = 42, negative_prompt: str = None):
+    # cuda + float16 when available, else cpu + float32
+    device, dtype = default_device()
 
-    image = out.images[0]
-    return image
+    # The pipeline is loaded once per model and settings and stays resident,
+    # so repeated calls only pay for the denoising steps
+    service = get_service(model_id, device=device, dtype=dtype, height=height, width=width,
+                          guidance=guidance_scale, steps=num_inference_steps, negative_prompt=negative_prompt)
+    images, timing = service.generate_batch([prompt], [seed])
+    logger.info("Generated in %.1fs, %d steps", timing["seconds"], len(timing["step_seconds"]))
+    return images[0]
 
 if __name__ == "__main__":
     prompt = "Astronaut in a jungle, cold color palette, muted colors, detailed, 8k"
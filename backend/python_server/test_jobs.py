@@ -0,0 +1,52 @@
+"""check_callback_url: the host/scheme allow-list that keeps job callbacks off internal addresses."""
+import asyncio
+
+import pytest
+
+import jobs
+from jobs import JobQueue, check_callback_url
+
+HOSTS = ("hooks.example.com", ".example.org")
+
+
+@pytest.mark.parametrize("url", [
+    "https://hooks.example.com/done",
+    "https://HOOKS.example.com:8443/done?job=1",
+    "https://a.example.org/x",
+    "https://deep.a.example.org/x",
+])
+def test_allows_listed_hosts(url):
+    assert check_callback_url(url, hosts=HOSTS, schemes=("https",)) == url
+
+
+@pytest.mark.parametrize("url, message", [
+    ("http://hooks.example.com/done", "scheme"),
+    ("https://evil.com/done", "not allowed"),
+    ("https://hooks.example.com.evil.com/", "not allowed"),
+    ("https://example.org/", "not allowed"),
+    ("https://notexample.org/", "not allowed"),
+    ("https://127.0.0.1/", "not allowed"),
+    ("https://user:pw@hooks.example.com/", "credentials"),
+    ("https://hooks.example.com:99999/", "not a valid URL"),
+    ("file:///etc/passwd", "scheme"),
+])
+def test_rejects_other_urls(url, message):
+    with pytest.raises(ValueError, match=message):
+        check_callback_url(url, hosts=HOSTS, schemes=("https",))
+
+
+def test_empty_allow_list_disables_callbacks():
+    with pytest.raises(ValueError, match="disabled"):
+        check_callback_url("https://hooks.example.com/", hosts=(), schemes=("https",))
+
+
+def test_start_warns_when_callbacks_are_disabled(monkeypatch, capsys):
+    monkeypatch.setattr(jobs, "CALLBACK_HOSTS", ())
+    queue = JobQueue(workers=0, db_path="")
+
+    async def scenario():
+        await queue.start(None)
+        await queue.stop()
+
+    asyncio.run(scenario())
+    assert "KOLAM_JOB_CALLBACK_HOSTS" in capsys.readouterr().out
@@ -0,0 +1,75 @@
+"""KolamClassifier with a stand-in encoder: keyword path, margin-based "unknown", and load failures."""
+import asyncio
+
+import numpy as np
+
+from kolam_classifier import KOLAM_TYPES, UNKNOWN, KolamClassifier, keyword_match
+
+LABELS = list(KOLAM_TYPES)
+
+
+class FakeModel:
+    """Embeds each prototype description on its type's axis, and known prompts where told to."""
+
+    def __init__(self, prompts):
+        self.prompts = prompts
+        self.calls = 0
+
+    def encode(self, texts, **kwargs):
+        self.calls += 1
+        vectors = []
+        for text in texts:
+            vector = self.prompts.get(text)
+            if vector is None:
+                vector = np.zeros(len(LABELS))
+                for i, (_, descriptions) in enumerate(KOLAM_TYPES.values()):
+                    if text in descriptions:
+                        vector[i] = 1.0
+            vectors.append(vector / np.linalg.norm(vector))
+        return np.array(vectors, dtype=np.float32)
+
+
+def _scores(**weights):
+    # Every type gets a high baseline, like CLIP text similarities do
+    return np.array([0.8 + weights.get(label, 0.0) for label in LABELS])
+
+
+def test_keywords_are_whole_words():
+    assert keyword_match("a dotted pattern") == "pulli_kolam"
+    assert keyword_match("an outline of a lotus") is None
+    assert keyword_match("colourful festive design") == "rangoli_kolam"
+
+
+def test_clear_winner_is_classified_and_close_call_is_unknown():
+    model = FakeModel({
+        "a lotus for pongal": _scores(sikku_kolam=0.1),
+        "a pretty festival design": _scores(sikku_kolam=0.005),
+    })
+    classifier = KolamClassifier(model_loader=lambda: model, min_margin=0.02)
+    assert classifier.load() is model
+
+    assert asyncio.run(classifier.classify("a lotus for pongal")) == "sikku_kolam"
+    assert asyncio.run(classifier.classify("a pretty festival design")) == UNKNOWN
+    assert classifier.classify_sync("A lotus  for pongal") == "sikku_kolam"
+    assert classifier.stats["cached"] == 1
+
+
+def test_requests_do_not_load_the_model():
+    loads = []
+    classifier = KolamClassifier(model_loader=lambda: loads.append(1) or FakeModel({}))
+
+    assert asyncio.run(classifier.classify("a lotus for pongal")) == UNKNOWN
+    assert asyncio.run(classifier.classify("dots")) == "pulli_kolam"
+    assert not loads
+    assert classifier.stats["no_model"] == 1
+
+
+def test_any_load_failure_falls_back_to_keywords():
+    def broken():
+        raise RuntimeError("weights are corrupt")
+
+    classifier = KolamClassifier(model_loader=broken)
+    assert classifier.load() is None
+    assert isinstance(classifier.model_error, RuntimeError)
+    assert classifier.classify_sync("a lotus for pongal") == UNKNOWN
+    assert classifier.classify_sync("twisted lines") == "sikku_kolam"
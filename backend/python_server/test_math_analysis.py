@@ -0,0 +1,51 @@
+"""The "fft" symmetry engine against the "loop" reference, on the sample kolams."""
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from math_analysis import (
+    SYMMETRY_FFT_AXIS_TOLERANCE, SYMMETRY_FFT_TOLERANCE, SYMMETRY_SIZE, KolamImage, symmetry_analysis,
+)
+
+KOLAMS = sorted((Path(__file__).resolve().parent / "kolams").glob("*.png"))
+
+
+def axis_distance(a, b):
+    """Degrees between every axis in `a` and every axis in `b` (axes repeat every 180°)."""
+    d = np.abs(np.subtract.outer(a, b)) % 180
+    return np.minimum(d, 180 - d)
+
+
+def assert_axes_found(result, distance):
+    """Axes of `result` clear of its threshold by the score tolerance are within the axis tolerance of the other's."""
+    clear = result["axis_scores"] > result["threshold"] + SYMMETRY_FFT_TOLERANCE
+    if not clear.any():
+        return
+    assert distance.shape[1] > 0, f"no axes to match {result['axes'][clear]}"
+    nearest = distance[clear].min(axis=1)
+    assert (nearest <= SYMMETRY_FFT_AXIS_TOLERANCE).all(), (result["axes"][clear], nearest)
+
+
+def test_sample_kolams_present():
+    assert len(KOLAMS) >= 5
+
+
+@pytest.mark.parametrize("step", [1, 0.5])
+@pytest.mark.parametrize("path", KOLAMS, ids=lambda path: path.stem)
+def test_fft_matches_loop(path, step):
+    th_img = KolamImage.from_path(str(path)).binary(size=SYMMETRY_SIZE)
+    loop = symmetry_analysis(th_img, step=step, backend="loop")
+    fft = symmetry_analysis(th_img, step=step, backend="fft")
+
+    np.testing.assert_array_equal(loop["angles"], fft["angles"])
+    assert np.abs(loop["scores"] - fft["scores"]).max() <= SYMMETRY_FFT_TOLERANCE
+
+    distance = axis_distance(loop["axes"], fft["axes"])
+    assert_axes_found(loop, distance)
+    assert_axes_found(fft, distance.T)
+
+
+def test_fft_is_the_default():
+    th_img = KolamImage.from_path(str(KOLAMS[0])).binary(size=SYMMETRY_SIZE)
+    assert symmetry_analysis(th_img)["backend"] == "fft"
@@ -0,0 +1,52 @@
+"""KolamIndex: per-search nprobe and crash-safe delta persistence, on a small synthetic index."""
+import numpy as np
+import pytest
+
+faiss = pytest.importorskip("faiss")
+
+from similarity import KolamIndex
+
+
+def _index(tmp_path, nlist=8, d=16, n=400):
+    rng = np.random.default_rng(0)
+    data = rng.standard_normal((n, d)).astype(np.float32)
+    faiss.normalize_L2(data)
+    quantizer = faiss.IndexFlatIP(d)
+    base = faiss.IndexIVFFlat(quantizer, d, nlist, faiss.METRIC_INNER_PRODUCT)
+    base.train(data)
+    base.add(data)
+    index = KolamIndex(
+        index_path=tmp_path / "base.faiss", meta_path=tmp_path / "base.pkl",
+        delta_index_path=tmp_path / "delta.faiss", delta_meta_path=tmp_path / "delta.pkl",
+    )
+    index.base = base
+    index.meta = [{"i": i} for i in range(n)]
+    index.delta = faiss.IndexFlat(d, base.metric_type)
+    index.delta_meta = []
+    return index, data
+
+
+def test_nprobe_applies_to_one_search_only(tmp_path):
+    index, data = _index(tmp_path)
+    default = index.base.nprobe
+    _, ids_one = index.search(data[:20], 5)
+    _, ids_all = index.search(data[:20], 5, nprobe=index.base.nlist)
+
+    # With every list probed the search is exact, so each vector finds itself
+    assert (ids_all[:, 0] == np.arange(20)).all()
+    assert index.base.nprobe == default
+    _, ids_again = index.search(data[:20], 5)
+    assert (ids_again == ids_one).all()
+
+
+def test_add_persists_delta_without_temp_files(tmp_path):
+    index, data = _index(tmp_path)
+    index.embed = lambda images: data[:1]
+
+    new_id = index.add(None, {"caption": "new"})
+
+    assert new_id == index.base.ntotal
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["delta.faiss", "delta.pkl"]
+    assert faiss.read_index(str(tmp_path / "delta.faiss")).ntotal == 1
+    _, ids = index.search(data[:1], 2, nprobe=index.base.nlist)
+    assert set(ids[0]) == {0, new_id}
@@ -0,0 +1,69 @@
+"""AnalysisPool: the pending bound, and recovery from a worker that dies."""
+import asyncio
+import os
+import time
+
+import pytest
+
+from workers import AnalysisPool, PoolBusy, WorkerCrashed
+
+
+def _sleep(seconds):
+    time.sleep(seconds)
+    return seconds
+
+
+def _crash():
+    os._exit(1)
+
+
+def _pid():
+    return os.getpid()
+
+
+def test_rejects_work_beyond_max_pending():
+    pool = AnalysisPool(workers=0, max_pending=2)
+
+    async def scenario():
+        tasks = pool.submit_all([(_sleep, (0.2,), {}), (_sleep, (0.2,), {})])
+        assert pool.pending == 2
+        with pytest.raises(PoolBusy) as busy:
+            pool.submit_all([(_sleep, (0,), {})])
+        assert busy.value.retry_after >= 1
+        # A batch that does not fit starts nothing
+        assert pool.pending == 2
+        assert await asyncio.gather(*tasks) == [0.2, 0.2]
+        assert pool.pending == 0
+        assert await pool.run(_sleep, 0) == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_tasks_release_their_slots():
+    pool = AnalysisPool(workers=0, max_pending=1)
+
+    async def scenario():
+        (task,) = pool.submit_all([(_sleep, (0.1,), {})])
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        assert pool.pending == 0
+
+    asyncio.run(scenario())
+
+
+def test_replaces_the_pool_after_a_worker_dies():
+    pool = AnalysisPool(workers=1, max_pending=4, start_method="fork")
+    try:
+        async def scenario():
+            before = await pool.run(_pid)
+            # The crash is retried once on a fresh pool, then reported
+            with pytest.raises(WorkerCrashed):
+                await pool.run(_crash)
+            assert pool.restarts == 2
+            after = await pool.run(_pid)
+            assert after != before
+            assert pool.pending == 0
+
+        asyncio.run(scenario())
+    finally:
+        pool.shutdown()
@@ -0,0 +1,213 @@
+# workers.py
+"""
+Process pool for the CPU-bound Kolam analysis.
+
+The metrics run NumPy/OpenCV loops and matplotlib, which hold the GIL, so they
+run in worker processes instead of the event loop's threadpool. Workers are
+spawned and warmed (cv2, scipy, matplotlib already imported) at startup, and
+the number of pending tasks is bounded so overload turns into a 429 instead of
+an ever-growing queue. A worker that dies (say, killed for memory on a huge
+photo) breaks the whole executor; it is replaced on the spot, so only the
+tasks that were in flight see the crash.
+"""
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+from starlette.concurrency import run_in_threadpool
+
+from metrics import collect_stages, record_stage, stage
+
+# 0 disables the process pool and runs analyses in the threadpool instead
+ANALYSIS_WORKERS = int(os.getenv("KOLAM_ANALYSIS_WORKERS", str(os.cpu_count() or 1)))
+# Maximum queued + running analysis tasks before requests are rejected
+ANALYSIS_MAX_PENDING = int(os.getenv("KOLAM_ANALYSIS_MAX_PENDING", str(max(ANALYSIS_WORKERS, 1) * 4)))
+WORKER_START_METHOD = os.getenv("KOLAM_WORKER_START_METHOD", "spawn")
+
+
+def warm_worker():
+    """Process initializer: import the heavy modules once per worker."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot  # noqa: F401
+    import cv2  # noqa: F401
+    import scipy.signal  # noqa: F401
+    import scipy.special  # noqa: F401
+    import math_analysis  # noqa: F401
+    import encoding  # noqa: F401
+
+
+def _ping():
+    return os.getpid()
+
+
+def _traced(fn, *args, **kwargs):
+    """Run a task under a fresh stage trace; returns (value, stages, seconds) to the parent."""
+    start = time.perf_counter()
+    with collect_stages() as stages:
+        value = fn(*args, **kwargs)
+    return value, stages, time.perf_counter() - start
+
+
+# ---------- tasks (module-level so they pickle) ----------
+def run_metric(name, kolam, params=None, render=False, encode=None):
+    """
+    Compute one metric on a KolamImage; optionally render its figure.
+    `encode` holds encode_image() options (fmt, quality, compress_level).
+    Returns (result, encoded_figure_or_None).
+    """
+    from math_analysis import analyze
+    with stage(f"metric.{name}"):
+        result = analyze(kolam, [name], {name: params or {}})[name]
+    figure = render_figure(name, kolam, result, **(encode or {})) if render else None
+    return result, figure
+
+
+def analyze_image(data, names=None, params=None):
+    """Decode encoded image bytes and run the metrics in one worker hop (batch path)."""
+    from math_analysis import ANALYSIS_MAX_SIDE, MAX_IMAGE_PIXELS, DEFAULT_METRICS, KolamImage, analyze
+    with stage("decode"):
+        kolam = KolamImage.from_bytes(data, ANALYSIS_MAX_SIDE, MAX_IMAGE_PIXELS)
+    results = {}
+    for name in (DEFAULT_METRICS if names is None else names):
+        with stage(f"metric.{name}"):
+            results.update(analyze(kolam, [name], params))
+    return results
+
+
+def render_figure(name, kolam, result, fmt="png", quality=None, compress_level=None):
+    """Render a metric figure and return it encoded (PNG by default) as bytes."""
+    from math_analysis import render_metric
+    from encoding import encode_image
+    with stage(f"render.{name}"):
+        img = render_metric(name, kolam, result)
+    return bytes(encode_image(img, fmt, quality, compress_level))
+
+
+class PoolBusy(Exception):
+    """Raised when accepting more work would exceed the pending-task bound."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Analysis pool is busy; retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class WorkerCrashed(Exception):
+    """A worker process died running the task, twice; the pool has been replaced."""
+
+    def __init__(self):
+        super().__init__("An analysis worker crashed on this input (it may need too much memory)")
+
+
+class AnalysisPool:
+    """
+    A bounded ProcessPoolExecutor shared by all requests.
+    """
+
+    def __init__(self, workers=ANALYSIS_WORKERS, max_pending=ANALYSIS_MAX_PENDING,
+                 start_method=WORKER_START_METHOD):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.start_method = start_method
+        self.pending = 0
+        self._executor = None
+        self.restarts = 0
+        # start() may run from the warm-up and a first request at once
+        self._lock = threading.Lock()
+        # Moving average of task service time, used for Retry-After
+        self._avg_seconds = 1.0
+
+    def _spawn(self):
+        executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context(self.start_method),
+            initializer=warm_worker,
+        )
+        # One no-op per worker makes the executor spawn all of them now
+        for future in [executor.submit(_ping) for _ in range(self.workers)]:
+            future.result()
+        return executor
+
+    def start(self):
+        """Spawn and pre-warm the worker processes."""
+        with self._lock:
+            if self.workers <= 0 or self._executor is not None:
+                return
+            self._executor = self._spawn()
+
+    def _replace(self, broken):
+        """Swap a broken executor for a fresh one, once however many of its tasks report it."""
+        with self._lock:
+            if self._executor is not broken:
+                return
+            broken.shutdown(wait=False, cancel_futures=True)
+            self._executor = self._spawn()
+            self.restarts += 1
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+                self._executor = None
+
+    def retry_after(self) -> int:
+        """Rough seconds until the current backlog drains."""
+        per_worker = self.pending / max(self.workers, 1)
+        return max(1, int(round(per_worker * self._avg_seconds)))
+
+    async def _run(self, fn, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            if self.workers <= 0:
+                return await run_in_threadpool(fn, *args, **kwargs)
+            if self._executor is None:
+                await run_in_threadpool(self.start)
+            loop = asyncio.get_running_loop()
+            call = partial(_traced, fn, *args, **kwargs)
+            for attempt in range(2):
+                executor = self._executor
+                try:
+                    value, stages, seconds = await loop.run_in_executor(executor, call)
+                    break
+                except BrokenProcessPool as e:
+                    # The dead worker may have been running another task: retry once on a fresh pool
+                    await run_in_threadpool(self._replace, executor)
+                    if attempt:
+                        raise WorkerCrashed() from e
+            # Stages ran in the worker; replay them into this request's trace (pool.queue = waiting + IPC)
+            for name, stage_seconds in stages:
+                record_stage(name, stage_seconds)
+            record_stage("pool.queue", time.perf_counter() - start - seconds)
+            return value
+        finally:
+            self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * (time.perf_counter() - start)
+
+    def _task_done(self, task):
+        self.pending -= 1
+
+    def submit_all(self, calls):
+        """
+        Start [(fn, args, kwargs), ...] concurrently and return one task per call.
+        Raises PoolBusy, without starting anything, if the batch does not fit.
+        """
+        if self.pending + len(calls) > self.max_pending:
+            raise PoolBusy(self.retry_after())
+        self.pending += len(calls)
+        tasks = [asyncio.ensure_future(self._run(fn, *args, **kwargs)) for fn, args, kwargs in calls]
+        # A done callback also fires for tasks cancelled before they started, unlike _run's finally
+        for task in tasks:
+            task.add_done_callback(self._task_done)
+        return tasks
+
+    async def run_all(self, calls):
+        """Like submit_all(), but wait and return the results in order."""
+        return await asyncio.gather(*self.submit_all(calls))
+
+    async def run(self, fn, *args, **kwargs):
+        (result,) = await self.run_all([(fn, args, kwargs)])
+        return result
@@ -1,5 +1,7 @@
 import base64
+import hashlib
 import io
+import json
 import os
 import time
 import datetime
@@ -17,10 +19,10 @@ from fastapi.encoders import jsonable_encoder
 from secrets import compare_digest
 
 import modules.shared as shared
-from modules import sd_samplers, deepbooru, sd_hijack, images, scripts, ui, postprocessing, errors, restart, shared_items, script_callbacks, infotext_utils, sd_models, sd_schedulers
+from modules import sd_samplers, deepbooru, sd_hijack, images, scripts, ui, postprocessing, errors, restart, shared_items, script_callbacks, infotext_utils, sd_models, sd_schedulers, call_queue
 from modules.api import models
 from modules.shared import opts
-from modules.processing import StableDiffusionProcessingTxt2Img, StableDiffusionProcessingImg2Img, process_images
+from modules.processing import StableDiffusionProcessingTxt2Img, StableDiffusionProcessingImg2Img, process_images, get_fixed_seed
 from modules.textual_inversion.textual_inversion import create_embedding, train_embedding
 from modules.hypernetworks.hypernetwork import create_hypernetwork, train_hypernetwork
 from PIL import PngImagePlugin
@@ -31,7 +33,7 @@ from typing import Any
 import piexif
 import piexif.helper
 from contextlib import closing
-from modules.progress import create_task_id, add_task_to_queue, start_task, finish_task, current_task
+from modules.progress import create_task_id, add_task_to_queue, start_task, start_batch, finish_task, current_task
 
 def script_name_to_index(name, scripts):
     try:
@@ -48,6 +50,29 @@ def validate_sampler_name(name):
     return name
 
 
+# what a batch can vary per image, so requests differing only in these can run as one
+batch_per_image_args = ('prompt', 'negative_prompt', 'seed', 'subseed', 'force_task_id')
+
+
+def txt2img_batch_key(args, script_args):
+    """Requests with equal keys differ only in what a batch can vary per image, and can run as one."""
+
+    settings = {k: v for k, v in args.items() if k not in batch_per_image_args}
+    return json.dumps([settings, script_args], sort_keys=True, default=str)
+
+
+def img2img_batch_key(args, script_args, mask):
+    """
+    Like txt2img_batch_key. The request's one init image is left out: a batch takes one init image per image, each
+    resized to the same width and height. The mask applies to the whole batch, so it stays in the key, by the hash
+    of its base64 (the decoded image in args has no stable text form).
+    """
+
+    settings = {k: v for k, v in args.items() if k not in batch_per_image_args + ('init_images', 'mask')}
+    settings['mask'] = hashlib.sha256(mask.encode()).hexdigest() if mask else None
+    return json.dumps([settings, script_args], sort_keys=True, default=str)
+
+
 def setUpscalers(req: dict):
     reqDict = vars(req)
     reqDict['extras_upscaler_1'] = reqDict.pop('upscaler_1', None)
@@ -207,6 +232,8 @@ class Api:
         self.router = APIRouter()
         self.app = app
         self.queue_lock = queue_lock
+        self.txt2img_batcher = call_queue.RequestBatcher(queue_lock)
+        self.img2img_batcher = call_queue.RequestBatcher(queue_lock)
         api_middleware(self.app)
         self.add_api_route("/sdapi/v1/txt2img", self.text2imgapi, methods=["POST"], response_model=models.TextToImageResponse)
         self.add_api_route("/sdapi/v1/img2img", self.img2imgapi, methods=["POST"], response_model=models.ImageToImageResponse)
@@ -225,6 +252,7 @@ class Api:
         self.add_api_route("/sdapi/v1/upscalers", self.get_upscalers, methods=["GET"], response_model=list[models.UpscalerItem])
         self.add_api_route("/sdapi/v1/latent-upscale-modes", self.get_latent_upscale_modes, methods=["GET"], response_model=list[models.LatentUpscalerModeItem])
         self.add_api_route("/sdapi/v1/sd-models", self.get_sd_models, methods=["GET"], response_model=list[models.SDModelItem])
+        self.add_api_route("/sdapi/v1/sd-models/changes", self.get_sd_model_changes, methods=["GET"], response_model=models.ModelChangesResponse)
         self.add_api_route("/sdapi/v1/sd-vae", self.get_sd_vaes, methods=["GET"], response_model=list[models.SDVaeItem])
         self.add_api_route("/sdapi/v1/hypernetworks", self.get_hypernetworks, methods=["GET"], response_model=list[models.HypernetworkItem])
         self.add_api_route("/sdapi/v1/face-restorers", self.get_face_restorers, methods=["GET"], response_model=list[models.FaceRestorerItem])
@@ -239,6 +267,9 @@ class Api:
         self.add_api_route("/sdapi/v1/train/embedding", self.train_embedding, methods=["POST"], response_model=models.TrainResponse)
         self.add_api_route("/sdapi/v1/train/hypernetwork", self.train_hypernetwork, methods=["POST"], response_model=models.TrainResponse)
         self.add_api_route("/sdapi/v1/memory", self.get_memory, methods=["GET"], response_model=models.MemoryResponse)
+        self.add_api_route("/sdapi/v1/model-index", self.get_model_index, methods=["GET"], response_model=list[models.ModelIndexItem])
+        self.add_api_route("/sdapi/v1/hashes", self.get_hashing_status, methods=["GET"], response_model=models.HashingStatusResponse)
+        self.add_api_route("/sdapi/v1/batching", self.get_batching_status, methods=["GET"], response_model=models.BatchingStatusResponse)
         self.add_api_route("/sdapi/v1/unload-checkpoint", self.unloadapi, methods=["POST"])
         self.add_api_route("/sdapi/v1/reload-checkpoint", self.reloadapi, methods=["POST"])
         self.add_api_route("/sdapi/v1/scripts", self.get_scripts_list, methods=["GET"], response_model=models.ScriptsList)
@@ -464,6 +495,12 @@ class Api:
 
         add_task_to_queue(task_id)
 
+        if opts.api_batch_max_size > 1 and selectable_scripts is None and not txt2imgreq.alwayson_scripts and not txt2imgreq.infotext and args.get('batch_size', 1) == 1 and args.get('n_iter', 1) == 1:
+            images, info = self.txt2img_batcher.submit(txt2img_batch_key(args, script_args), (task_id, args, script_args), self.text2img_batch, max_batch=opts.api_batch_max_size, max_wait=opts.api_batch_max_wait)
+            b64images = list(map(encode_pil_to_base64, images)) if send_images else []
+
+            return models.TextToImageResponse(images=b64images, parameters=vars(txt2imgreq), info=info)
+
         with self.queue_lock:
             with closing(StableDiffusionProcessingTxt2Img(sd_model=shared.sd_model, **args)) as p:
                 p.is_api = True
@@ -489,6 +526,74 @@ class Api:
 
         return models.TextToImageResponse(images=b64images, parameters=vars(txt2imgreq), info=processed.js())
 
+    def text2img_batch(self, items):
+        """Runs single-image txt2img requests with matching settings as one batch; called by txt2img_batcher with queue_lock held."""
+
+        return self.process_batch(items, StableDiffusionProcessingTxt2Img, scripts.scripts_txt2img, "scripts_txt2img", opts.outdir_txt2img_grids, opts.outdir_txt2img_samples)
+
+    def img2img_batch(self, items):
+        """Runs single-image img2img requests with matching settings as one batch, each with its own init image; called by img2img_batcher with queue_lock held."""
+
+        init_images = [decode_base64_to_image(request_args['init_images'][0]) for _, request_args, _ in items]
+        return self.process_batch(items, StableDiffusionProcessingImg2Img, scripts.scripts_img2img, "scripts_img2img", opts.outdir_img2img_grids, opts.outdir_img2img_samples, init_images=init_images)
+
+    def process_batch(self, items, processing_class, script_runner, job, outpath_grids, outpath_samples, init_images=None):
+        """Runs [(task_id, args, script_args), ...] as one batch of processing_class; returns (images, info) for each request."""
+
+        task_ids = [task_id for task_id, _, _ in items]
+        args = dict(items[0][1])
+        args.update(
+            prompt=[request_args['prompt'] for _, request_args, _ in items],
+            negative_prompt=[request_args['negative_prompt'] for _, request_args, _ in items],
+            seed=[get_fixed_seed(request_args['seed']) for _, request_args, _ in items],
+            subseed=[get_fixed_seed(request_args['subseed']) for _, request_args, _ in items],
+            batch_size=len(items),
+            do_not_save_grid=True,
+        )
+
+        with closing(processing_class(sd_model=shared.sd_model, **args)) as p:
+            if init_images is not None:
+                p.init_images = init_images
+            p.is_api = True
+            p.scripts = script_runner
+            p.outpath_grids = outpath_grids
+            p.outpath_samples = outpath_samples
+            p.script_args = tuple(items[0][2])
+
+            try:
+                shared.state.begin(job=job)
+                start_batch(task_ids)
+                processed = process_images(p)
+            finally:
+                for task_id in task_ids:
+                    finish_task(task_id)
+                shared.state.end()
+                shared.total_tqdm.clear()
+
+        # hand each request its own image and the info it would have got running alone
+        images = processed.images[processed.index_of_first_image:]
+        info = json.loads(processed.js())
+
+        results = []
+        for i in range(len(items)):
+            own = dict(info)
+            own.update(
+                prompt=info['all_prompts'][i],
+                all_prompts=info['all_prompts'][i:i + 1],
+                negative_prompt=info['all_negative_prompts'][i],
+                all_negative_prompts=info['all_negative_prompts'][i:i + 1],
+                seed=info['all_seeds'][i],
+                all_seeds=info['all_seeds'][i:i + 1],
+                subseed=info['all_subseeds'][i],
+                all_subseeds=info['all_subseeds'][i:i + 1],
+                batch_size=1,
+                index_of_first_image=0,
+                infotexts=info['infotexts'][processed.index_of_first_image + i:processed.index_of_first_image + i + 1],
+            )
+            results.append((images[i:i + 1], json.dumps(own)))
+
+        return results
+
     def img2imgapi(self, img2imgreq: models.StableDiffusionImg2ImgProcessingAPI):
         task_id = img2imgreq.force_task_id or create_task_id("img2img")
 
@@ -534,6 +639,17 @@ class Api:
 
         add_task_to_queue(task_id)
 
+        # resize mode 3 keeps each init image at its own size, and a saved init image leaves one hash in the infotext
+        if opts.api_batch_max_size > 1 and selectable_scripts is None and not img2imgreq.alwayson_scripts and not img2imgreq.infotext and args.get('batch_size', 1) == 1 and args.get('n_iter', 1) == 1 and len(init_images) == 1 and args.get('resize_mode', 0) != 3 and not opts.save_init_img:
+            images, info = self.img2img_batcher.submit(img2img_batch_key(args, script_args, img2imgreq.mask), (task_id, args, script_args), self.img2img_batch, max_batch=opts.api_batch_max_size, max_wait=opts.api_batch_max_wait)
+            b64images = list(map(encode_pil_to_base64, images)) if send_images else []
+
+            if not img2imgreq.include_init_images:
+                img2imgreq.init_images = None
+                img2imgreq.mask = None
+
+            return models.ImageToImageResponse(images=b64images, parameters=vars(img2imgreq), info=info)
+
         with self.queue_lock:
             with closing(StableDiffusionProcessingImg2Img(sd_model=shared.sd_model, **args)) as p:
                 p.init_images = [decode_base64_to_image(x) for x in init_images]
@@ -727,6 +843,10 @@ class Api:
         import modules.sd_models as sd_models
         return [{"title": x.title, "model_name": x.model_name, "hash": x.shorthash, "sha256": x.sha256, "filename": x.filename, "config": find_checkpoint_config_near_filename(x)} for x in sd_models.checkpoints_list.values()]
 
+    def get_sd_model_changes(self, since: int = 0):
+        import modules.sd_models as sd_models
+        return sd_models.checkpoint_scanner.changes(since)
+
     def get_sd_vaes(self):
         import modules.sd_vae as sd_vae
         return [{"model_name": x, "filename": sd_vae.vae_dict[x]} for x in sd_vae.vae_dict.keys()]
@@ -848,6 +968,22 @@ class Api:
         finally:
             shared.state.end()
 
+    def get_model_index(self, model_type: str = None, metadata_key: str = None):
+        from modules import model_index
+        return model_index.query(model_type=model_type, metadata_key=metadata_key)
+
+    def get_hashing_status(self):
+        from modules import hashes
+        return hashes.hashing_service.status()
+
+    def get_batching_status(self):
+        return {
+            **self.txt2img_batcher.status(),
+            "img2img": self.img2img_batcher.status(),
+            "max_batch_size": opts.api_batch_max_size,
+            "max_wait": opts.api_batch_max_wait,
+        }
+
     def get_memory(self):
         try:
             import os
@@ -294,6 +294,53 @@ class EmbeddingsResponse(BaseModel):
     loaded: dict[str, EmbeddingItem] = Field(title="Loaded", description="Embeddings loaded for the current model")
     skipped: dict[str, EmbeddingItem] = Field(title="Skipped", description="Embeddings skipped for the current model (likely due to architecture incompatibility)")
 
+class ModelChangeItem(BaseModel):
+    seq: int = Field(title="Sequence number")
+    change: str = Field(title="Change", description="added, removed or changed")
+    filename: str = Field(title="Filename")
+
+class ModelChangesResponse(BaseModel):
+    seq: int = Field(title="Sequence number", description="Pass as since= on the next call")
+    reset: bool = Field(title="Reset", description="Some changes after since= are no longer kept; list the models again")
+    changes: list[ModelChangeItem] = Field(title="Changes")
+
+class ModelIndexItem(BaseModel):
+    filename: str = Field(title="Filename")
+    mtime: float = Field(title="Modification time", description="Of the file when its header was indexed")
+    size: int = Field(title="Size", description="Of the file when its header was indexed")
+    metadata: dict = Field(title="Metadata", description="The __metadata__ block of the header, without the thumbnail")
+    model_type: Optional[str] = Field(title="Model type", description="Detected from tensor names, e.g. sd1, sdxl, lora, vae")
+    tensor_count: int = Field(title="Tensors")
+    parameters: int = Field(title="Parameters")
+    dtypes: dict[str, int] = Field(title="Dtypes", description="Number of tensors of each dtype")
+
+class HashJobItem(BaseModel):
+    title: str = Field(title="Title")
+    filename: str = Field(title="Filename")
+    status: str = Field(title="Status", description="queued, hashing, done or failed")
+    priority: bool = Field(title="Priority", description="Requested by a model load rather than queued in the background")
+    progress: float = Field(title="Progress", description="The progress with a range of 0 to 1")
+    bytes_done: int = Field(title="Bytes hashed")
+    bytes_total: int = Field(title="Bytes to hash")
+    sha256: Optional[str] = Field(title="sha256 hash")
+    error: Optional[str] = Field(title="Error")
+
+class HashingStatusResponse(BaseModel):
+    workers: int = Field(title="Workers", description="Threads hashing model files")
+    queued: int = Field(title="Queued")
+    hashing: int = Field(title="Hashing")
+    jobs: list[HashJobItem] = Field(title="Jobs")
+
+class BatchingStatusResponse(BaseModel):
+    batches: int = Field(title="Batches", description="Batches run for txt2img API requests")
+    requests: int = Field(title="Requests", description="Requests served by those batches")
+    average_batch_size: Optional[float] = Field(title="Average batch size")
+    occupancy: Optional[float] = Field(title="Occupancy", description="Share of the batch slots allowed at the time that were filled")
+    batch_sizes: dict[int, int] = Field(title="Batch sizes", description="Number of batches run at each size")
+    img2img: dict = Field(title="img2img", description="The same counters for img2img API requests")
+    max_batch_size: int = Field(title="Maximum batch size")
+    max_wait: float = Field(title="Maximum wait", description="Seconds a batch waits for matching requests")
+
 class MemoryResponse(BaseModel):
     ram: dict = Field(title="RAM", description="System memory stats")
     cuda: dict = Field(title="CUDA", description="nVidia CUDA memory stats")
@@ -1,6 +1,7 @@
 import os.path
 from functools import wraps
 import html
+import threading
 import time
 
 from modules import shared, progress, errors, devices, fifo_lock, profiling
@@ -8,6 +9,84 @@ from modules import shared, progress, errors, devices, fifo_lock, profiling
 queue_lock = fifo_lock.FIFOLock()
 
 
+class RequestBatcher:
+    """
+    Runs compatible requests (equal keys) together behind `lock`, the queue every generation takes.
+
+    The first request of a group waits up to `max_wait` seconds for others (less if the group fills up), then
+    queues for the lock as usual; requests arriving until it gets the lock still join, so a busy queue raises the
+    batch size instead of the wait. run(items) gets the group's items and returns one result per item.
+    """
+
+    class Group:
+        def __init__(self):
+            self.items = []
+            self.full = threading.Event()
+            self.done = threading.Event()
+            self.results = None
+            self.error = None
+
+    def __init__(self, lock):
+        self.lock = lock
+        self.groups_lock = threading.Lock()
+        self.groups = {}
+        self.batches = 0
+        self.requests = 0
+        self.max_batch_total = 0
+        self.batch_sizes = {}
+
+    def submit(self, key, item, run, max_batch, max_wait):
+        with self.groups_lock:
+            group = self.groups.get(key)
+            leader = group is None
+            if leader:
+                group = self.groups[key] = RequestBatcher.Group()
+
+            index = len(group.items)
+            group.items.append(item)
+            if len(group.items) >= max_batch:
+                # later requests start a new group
+                group.full.set()
+                self.groups.pop(key, None)
+
+        if not leader:
+            group.done.wait()
+        else:
+            group.full.wait(max_wait)
+
+            with self.lock:
+                with self.groups_lock:
+                    if self.groups.get(key) is group:
+                        del self.groups[key]
+
+                self.batches += 1
+                self.requests += len(group.items)
+                self.max_batch_total += max_batch
+                self.batch_sizes[len(group.items)] = self.batch_sizes.get(len(group.items), 0) + 1
+
+                try:
+                    group.results = run(group.items)
+                except Exception as e:
+                    group.error = e
+                finally:
+                    group.done.set()
+
+        if group.error is not None:
+            raise group.error
+
+        return group.results[index]
+
+    def status(self):
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "average_batch_size": self.requests / self.batches if self.batches else None,
+            # filled share of the batch slots the runs could have used
+            "occupancy": self.requests / self.max_batch_total if self.max_batch_total else None,
+            "batch_sizes": dict(sorted(self.batch_sizes.items())),
+        }
+
+
 def wrap_queued_call(func):
     def f(*args, **kwargs):
         with queue_lock:
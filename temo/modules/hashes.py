@@ -1,12 +1,21 @@
+import ctypes
+import ctypes.util
 import hashlib
+import heapq
+import itertools
+import mmap
 import os.path
+import threading
 
-from modules import shared
+from modules import shared, errors
 import modules.cache
 
 dump_cache = modules.cache.dump_cache
 cache = modules.cache.cache
 
+chunk_size = 16 * 1024 * 1024
+checkpoint_every = 512 * 1024 * 1024  # bytes hashed between saves of the partial state
+
 
 def calculate_sha256(filename):
     hash_sha256 = hashlib.sha256()
@@ -39,8 +48,6 @@ def sha256_from_cache(filename, title, use_addnet_hash=False):
 
 
 def sha256(filename, title, use_addnet_hash=False):
-    hashes = cache("hashes-addnet") if use_addnet_hash else cache("hashes")
-
     sha256_value = sha256_from_cache(filename, title, use_addnet_hash)
     if sha256_value is not None:
         return sha256_value
@@ -48,22 +55,17 @@ def sha256(filename, title, use_addnet_hash=False):
     if shared.cmd_opts.no_hashing:
         return None
 
-    print(f"Calculating sha256 for {filename}: ", end='')
-    if use_addnet_hash:
-        with open(filename, "rb") as file:
-            sha256_value = addnet_hash_safetensors(file)
-    else:
-        sha256_value = calculate_sha256(filename)
-    print(f"{sha256_value}")
+    if hashing_service.in_worker():
+        # called from a job's callback: waiting for the queue could mean waiting for this very thread
+        return hashing_service.hash_inline(filename, title, use_addnet_hash)
 
-    hashes[title] = {
-        "mtime": os.path.getmtime(filename),
-        "sha256": sha256_value,
-    }
+    # goes ahead of background jobs, and joins the job if the file is already being hashed
+    job = hashing_service.submit(filename, title, use_addnet_hash, priority=True)
+    job.finished.wait()
+    if job.error is not None:
+        raise job.error
 
-    dump_cache()
-
-    return sha256_value
+    return job.sha256
 
 
 def addnet_hash_safetensors(b):
@@ -82,3 +84,311 @@ def addnet_hash_safetensors(b):
 
     return hash_sha256.hexdigest()
 
+
+
+class SHA256_CTX(ctypes.Structure):
+    _fields_ = [("h", ctypes.c_uint32 * 8), ("Nl", ctypes.c_uint32), ("Nh", ctypes.c_uint32), ("data", ctypes.c_uint32 * 16), ("num", ctypes.c_uint), ("md_len", ctypes.c_uint)]
+
+
+def load_libcrypto():
+    """OpenSSL's libcrypto for a sha256 whose state can be saved; None if it can't be found."""
+
+    for name in ("crypto", "libcrypto-3-x64", "libcrypto-3", "libcrypto-1_1-x64", "libcrypto-1_1"):
+        path = ctypes.util.find_library(name)
+        if path is None:
+            continue
+
+        try:
+            lib = ctypes.CDLL(path)
+            lib.SHA256_Init.argtypes = [ctypes.POINTER(SHA256_CTX)]
+            lib.SHA256_Update.argtypes = [ctypes.POINTER(SHA256_CTX), ctypes.c_void_p, ctypes.c_size_t]
+            lib.SHA256_Final.argtypes = [ctypes.c_char_p, ctypes.POINTER(SHA256_CTX)]
+            return lib
+        except (OSError, AttributeError):
+            continue
+
+    return None
+
+
+libcrypto = load_libcrypto()
+
+
+class ResumableSha256:
+    """
+    sha256 over a writable buffer (a copy-on-write mmap) whose state can be exported and restored later.
+    Without libcrypto this falls back to hashlib, and the state can only be kept in memory.
+    """
+
+    def __init__(self, state=None):
+        if libcrypto is None:
+            self.ctx = None
+            self.hashlib_sha256 = hashlib.sha256()
+        elif state is not None:
+            self.ctx = SHA256_CTX.from_buffer_copy(state)
+        else:
+            self.ctx = SHA256_CTX()
+            libcrypto.SHA256_Init(ctypes.byref(self.ctx))
+
+    def update(self, buffer, offset, length):
+        if self.ctx is None:
+            with memoryview(buffer) as view, view[offset:offset + length] as chunk:
+                self.hashlib_sha256.update(chunk)
+            return
+
+        # ctypes releases the GIL for the call, so several workers hash at once
+        chunk = (ctypes.c_char * length).from_buffer(buffer, offset)
+        libcrypto.SHA256_Update(ctypes.byref(self.ctx), chunk, length)
+        del chunk
+
+    def state(self):
+        return bytes(self.ctx) if self.ctx is not None else None
+
+    def hexdigest(self):
+        if self.ctx is None:
+            return self.hashlib_sha256.hexdigest()
+
+        ctx = SHA256_CTX.from_buffer_copy(bytes(self.ctx))
+        digest = ctypes.create_string_buffer(32)
+        libcrypto.SHA256_Final(digest, ctypes.byref(ctx))
+        return digest.raw.hex()
+
+
+class HashJob:
+    def __init__(self, filename, title, use_addnet_hash, priority):
+        self.filename = filename
+        self.title = title
+        self.use_addnet_hash = use_addnet_hash
+        self.priority = priority
+        self.status = "queued"  # queued, hashing, done, failed
+        self.total = os.path.getsize(filename)
+        self.done = 0
+        self.sha256 = None
+        self.error = None
+        self.finished = threading.Event()
+        self.callbacks = []
+        self.hasher = None  # kept while the job is paused for a prioritized one
+        self.offset = 0
+
+    @property
+    def key(self):
+        return self.title, self.use_addnet_hash
+
+    @property
+    def partial_key(self):
+        return f"{'addnet/' if self.use_addnet_hash else ''}{self.title}"
+
+    def info(self):
+        return {
+            "title": self.title,
+            "filename": self.filename,
+            "status": self.status,
+            "priority": self.priority == 0,
+            "progress": self.done / self.total if self.total else 1.0,
+            "bytes_done": self.done,
+            "bytes_total": self.total,
+            "sha256": self.sha256,
+            "error": None if self.error is None else str(self.error),
+        }
+
+
+class HashingService:
+    """
+    Background sha256 of model files by a pool of worker threads reading memory-mapped files.
+
+    Prioritized jobs (a model that was just requested) go ahead of queued ones, and a worker busy with a
+    background job pauses it for a prioritized one when no other worker is free. Partial state is saved
+    to the "hashes-partial" cache every few hundred MB, so a hash interrupted by a restart resumes where
+    it stopped instead of starting from zero.
+    """
+
+    def __init__(self):
+        self.jobs = {}
+        self.queue = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.workers = []
+        self.idle = 0
+        self.yielding = 0  # workers that paused a job for a prioritized one and have not taken it yet
+        self.local = threading.local()
+
+    def in_worker(self):
+        return getattr(self.local, "worker", False)
+
+    def submit(self, filename, title, use_addnet_hash=False, priority=False, callback=None):
+        """Queues a file for hashing, or returns the job already hashing it; callback(job) runs when it finishes."""
+
+        with self.condition:
+            job = self.jobs.get((title, use_addnet_hash))
+            if job is None or job.status in ("done", "failed"):
+                job = HashJob(filename, title, use_addnet_hash, 0 if priority else 1)
+                self.jobs[job.key] = job
+                heapq.heappush(self.queue, (job.priority, next(self.counter), job))
+            elif priority and job.priority != 0:
+                job.priority = 0
+                if job.status == "queued":
+                    heapq.heappush(self.queue, (job.priority, next(self.counter), job))
+
+            if callback is not None:
+                job.callbacks.append(callback)
+
+            self.start_workers()
+            self.condition.notify()
+
+        return job
+
+    def start_workers(self):
+        for _ in range(len(self.workers), max(shared.opts.hash_workers, 1)):
+            worker = threading.Thread(target=self.work, name="sha256 worker", daemon=True)
+            self.workers.append(worker)
+            worker.start()
+
+    def next_job(self, yielded=False):
+        with self.condition:
+            if yielded:
+                self.yielding -= 1
+
+            while True:
+                while self.queue:
+                    _, _, job = heapq.heappop(self.queue)
+                    if job.status == "queued":
+                        job.status = "hashing"
+                        return job
+
+                self.idle += 1
+                self.condition.wait()
+                self.idle -= 1
+
+    def should_pause(self, job):
+        """
+        A background job yields to a queued prioritized one when no worker is idle. Only as many workers
+        yield as there are prioritized jobs waiting; the others keep hashing.
+        """
+
+        if job.priority == 0:
+            return False
+
+        with self.condition:
+            waiting = sum(priority == 0 and queued.status == "queued" for priority, _, queued in self.queue)
+            if self.idle or waiting <= self.yielding:
+                return False
+
+            self.yielding += 1
+            return True
+
+    def pause(self, job):
+        with self.condition:
+            job.status = "queued"
+            heapq.heappush(self.queue, (job.priority, next(self.counter), job))
+            self.condition.notify()
+
+    def run(self, job):
+        """Hashes the file and stores the result; returns False if the job was paused before the end."""
+
+        try:
+            if not self.hash_file(job):
+                return False
+
+            print(f"Calculated sha256 for {job.filename}: {job.sha256}")
+            hashes = cache("hashes-addnet") if job.use_addnet_hash else cache("hashes")
+            hashes[job.title] = {
+                "mtime": os.path.getmtime(job.filename),
+                "sha256": job.sha256,
+            }
+            cache("hashes-partial").pop(job.partial_key, None)
+            dump_cache()
+            job.status = "done"
+        except Exception as e:
+            job.error = e
+            job.status = "failed"
+
+        job.hasher = None
+        job.finished.set()
+        return True
+
+    def hash_inline(self, filename, title, use_addnet_hash=False):
+        """Hashes a file on the calling thread, outside the queue; a prioritized job is never paused."""
+
+        job = HashJob(filename, title, use_addnet_hash, 0)
+        job.status = "hashing"
+        self.run(job)
+        if job.error is not None:
+            raise job.error
+
+        return job.sha256
+
+    def work(self):
+        self.local.worker = True
+        yielded = False
+        while True:
+            job = self.next_job(yielded)
+            yielded = not self.run(job)
+            if yielded:
+                self.pause(job)
+                continue
+
+            with self.condition:
+                # finished jobs are not kept; the hash is in the cache now
+                if self.jobs.get(job.key) is job:
+                    del self.jobs[job.key]
+
+            for callback in job.callbacks:
+                try:
+                    callback(job)
+                except Exception as e:
+                    errors.display(e, f"sha256 callback for {job.filename}")
+
+    def hash_file(self, job):
+        """Hashes the rest of the file; returns False if the job was paused before the end."""
+
+        st = os.stat(job.filename)
+        partial = cache("hashes-partial")
+
+        with open(job.filename, "rb") as file:
+            start = 0
+            if job.use_addnet_hash:
+                start = int.from_bytes(file.read(8), "little") + 8
+
+            if job.hasher is None:
+                job.hasher = ResumableSha256()
+                job.offset = start
+                saved = partial.get(job.partial_key)
+                if saved and saved["mtime"] == st.st_mtime and saved["size"] == st.st_size and libcrypto is not None:
+                    job.hasher = ResumableSha256(saved["state"])
+                    job.offset = saved["offset"]
+
+            job.total = st.st_size - start
+            job.done = job.offset - start
+
+            if st.st_size > job.offset:
+                # copy-on-write so ctypes can take the buffer's address; nothing is written to it
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY) as buffer:
+                    saved_at = job.offset
+                    while job.offset < st.st_size:
+                        length = min(chunk_size, st.st_size - job.offset)
+                        job.hasher.update(buffer, job.offset, length)
+                        job.offset += length
+                        job.done = job.offset - start
+
+                        if job.offset - saved_at >= checkpoint_every and job.hasher.state() is not None:
+                            partial[job.partial_key] = {"mtime": st.st_mtime, "size": st.st_size, "offset": job.offset, "state": job.hasher.state()}
+                            saved_at = job.offset
+
+                        if job.offset < st.st_size and self.should_pause(job):
+                            return False
+
+        job.sha256 = job.hasher.hexdigest()
+        return True
+
+    def status(self):
+        with self.condition:
+            jobs = list(self.jobs.values())
+
+        return {
+            "workers": len(self.workers),
+            "queued": sum(job.status == "queued" for job in jobs),
+            "hashing": sum(job.status == "hashing" for job in jobs),
+            "jobs": [job.info() for job in jobs],
+        }
+
+
+hashing_service = HashingService()
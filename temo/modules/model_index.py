@@ -0,0 +1,201 @@
+import json
+import math
+import os
+
+from modules import cache, errors
+
+# per-file summaries (metadata, thumbnail, model type, tensor counts) that listings read in bulk
+index_subsection = "safetensors-index"
+# tensor names, dtypes and shapes, read only when asked for
+details_subsection = "safetensors-details"
+
+
+def read_header(filename):
+    """Parses the JSON header of a .safetensors file without reading any tensor data; a corrupt header is reported and reads as {}."""
+
+    with open(filename, mode="rb") as file:
+        header_len = int.from_bytes(file.read(8), "little")
+        json_start = file.read(2)
+
+        assert header_len > 2 and json_start in (b'{"', b"{'"), f"{filename} is not a safetensors file"
+
+        try:
+            return json.loads(json_start + file.read(header_len - 2))
+        except Exception:
+            errors.report(f"Error reading metadata from file: {filename}", exc_info=True)
+            return {}
+
+
+def parse_metadata(header):
+    res = {}
+    for k, v in header.get("__metadata__", {}).items():
+        res[k] = v
+        if isinstance(v, str) and v[0:1] == '{':
+            try:
+                res[k] = json.loads(v)
+            except Exception:
+                pass
+
+    return res
+
+
+def detect_model_type(tensors):
+    """Guesses what a file holds from its tensor names and shapes, following sd_models_config.guess_model_config_from_state_dict."""
+
+    def shape(name):
+        return tensors[name][1] if name in tensors else None
+
+    diffusion_model_input = shape('model.diffusion_model.input_blocks.0.0.weight')
+    inpaint = diffusion_model_input is not None and len(diffusion_model_input) > 1 and diffusion_model_input[1] == 9
+
+    if 'model.diffusion_model.x_embedder.proj.weight' in tensors:
+        return "sd3"
+    if 'conditioner.embedders.1.model.ln_final.weight' in tensors:
+        if 'model.diffusion_model.middle_block.1.transformer_blocks.0.attn1.to_q.weight' not in tensors:
+            return "ssd"
+        return "sdxl-inpaint" if inpaint else "sdxl"
+    if 'conditioner.embedders.0.model.ln_final.weight' in tensors:
+        return "sdxl-refiner"
+
+    sd2_cond_proj_weight = shape('cond_stage_model.model.transformer.resblocks.0.attn.in_proj_weight')
+    if sd2_cond_proj_weight is not None and sd2_cond_proj_weight[1:2] == [1024]:
+        return "sd2-inpaint" if inpaint else "sd2"
+    if diffusion_model_input is not None:
+        return "sd1-inpaint" if inpaint else "sd1"
+
+    if any(name.startswith(("lora_unet_", "lora_te")) or ".lora_down." in name or ".lora_A." in name for name in tensors):
+        return "lora"
+    if 'decoder.conv_in.weight' in tensors or 'first_stage_model.decoder.conv_in.weight' in tensors:
+        return "vae"
+    if 'emb_params' in tensors or 'clip_l' in tensors:
+        return "embedding"
+
+    return None
+
+
+def build_entry(filename, st):
+    header = read_header(filename)
+
+    metadata = {}
+    try:
+        metadata = parse_metadata(header)
+    except Exception:
+        errors.report(f"Error reading metadata from file: {filename}", exc_info=True)
+
+    tensors = {name: (info["dtype"], info["shape"]) for name, info in header.items() if name != "__metadata__"}
+    dtypes = {}
+    for dtype, _ in tensors.values():
+        dtypes[dtype] = dtypes.get(dtype, 0) + 1
+
+    summary = {
+        "filename": filename,
+        "mtime": st.st_mtime,
+        "size": st.st_size,
+        "metadata": {k: v for k, v in metadata.items() if k != 'modelspec.thumbnail'},
+        "thumbnail": metadata.get('modelspec.thumbnail'),
+        "model_type": detect_model_type(tensors),
+        "tensor_count": len(tensors),
+        "parameters": sum(math.prod(tensor_shape) for _, tensor_shape in tensors.values()),
+        "dtypes": dtypes,
+    }
+    details = {
+        "mtime": st.st_mtime,
+        "size": st.st_size,
+        "tensors": tensors,
+    }
+
+    return summary, details
+
+
+def is_current(entry, st):
+    return entry is not None and entry["mtime"] == st.st_mtime and entry["size"] == st.st_size
+
+
+def entry(filename):
+    """Returns the index summary for a .safetensors file, reading its header only if the file changed since it was indexed."""
+
+    key = os.path.abspath(filename)
+    st = os.stat(key)
+
+    index = cache.cache(index_subsection)
+    summary = index.get(key)
+    # summaries indexed before thumbnails were kept with them are read again once
+    if is_current(summary, st) and "thumbnail" in summary:
+        return summary
+
+    summary, details = build_entry(key, st)
+    cache.cache(details_subsection)[key] = details
+    index[key] = summary
+
+    return summary
+
+
+def metadata(filename):
+    """The __metadata__ block of a .safetensors file including its thumbnail, as read_metadata_from_safetensors used to return it."""
+
+    summary = entry(filename)
+    res = dict(summary["metadata"])
+
+    thumbnail = summary["thumbnail"]
+    if thumbnail is not None:
+        res['modelspec.thumbnail'] = thumbnail
+
+    return res
+
+
+def details(filename):
+    """Tensor names -> (dtype, shape)."""
+
+    key = os.path.abspath(filename)
+    res = cache.cache(details_subsection).get(key)
+    if not is_current(res, os.stat(key)):
+        entry(key)
+        res = cache.cache(details_subsection)[key]
+
+    return res
+
+
+def refresh(filenames):
+    """Brings the index up to date for these files, rereading only headers of new or changed ones; returns {filename: summary}."""
+
+    res = {}
+    for filename in filenames:
+        try:
+            res[filename] = entry(filename)
+        except Exception as e:
+            errors.display(e, f"indexing {filename}")
+
+    return res
+
+
+def forget(filenames):
+    for filename in filenames:
+        key = os.path.abspath(filename)
+        cache.cache(index_subsection).pop(key, None)
+        cache.cache(details_subsection).pop(key, None)
+
+
+def query(model_type=None, filename_prefix=None, metadata_key=None):
+    """
+    All indexed summaries matching the filters, from the index alone: no model file is opened or even stat'ed,
+    so entries for files changed since the last refresh() are as they were then.
+    """
+
+    prefix = os.path.abspath(filename_prefix) if filename_prefix else None
+
+    index = cache.cache(index_subsection)
+    res = []
+    for key in index.iterkeys():
+        summary = index.get(key)
+        if summary is None:
+            continue
+        if model_type is not None and summary["model_type"] != model_type:
+            continue
+        if prefix is not None and not key.startswith(prefix):
+            continue
+        if metadata_key is not None and metadata_key not in summary["metadata"]:
+            continue
+
+        res.append(summary)
+
+    return res
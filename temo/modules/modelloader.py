@@ -1,9 +1,15 @@
 from __future__ import annotations
 
+import collections
+import ctypes
+import ctypes.util
 import importlib
 import logging
 import os
-from typing import TYPE_CHECKING
+import struct
+import sys
+import threading
+from typing import TYPE_CHECKING, Callable
 from urllib.parse import urlparse
 
 import torch
@@ -41,7 +47,7 @@ def load_file_from_url(
     return cached_file
 
 
-def load_models(model_path: str, model_url: str = None, command_path: str = None, ext_filter=None, download_name=None, ext_blacklist=None, hash_prefix=None) -> list:
+def load_models(model_path: str, model_url: str = None, command_path: str = None, ext_filter=None, download_name=None, ext_blacklist=None, hash_prefix=None, scanner: ModelScanner = None) -> list:
     """
     A one-and done loader to try finding the desired models in specified directories.
 
@@ -51,13 +57,14 @@ def load_models(model_path: str, model_url: str = None, command_path: str = None
     @param command_path: A command-line argument to search for models in first.
     @param ext_filter: An optional list of filename extensions to filter by
     @param hash_prefix: the expected sha256 of the model_url
+    @param scanner: records what changed since its previous scan, and skips the walk while its watcher saw no change
     @return: A list of paths containing the desired model(s)
     """
     output = []
+    places = []
+    walked = False
 
     try:
-        places = []
-
         if command_path is not None and command_path != model_path:
             pretrained_path = os.path.join(command_path, 'experiments/pretrained_models')
             if os.path.exists(pretrained_path):
@@ -68,6 +75,11 @@ def load_models(model_path: str, model_url: str = None, command_path: str = None
 
         places.append(model_path)
 
+        if scanner is not None:
+            if scanner.is_current(places):
+                return scanner.paths()
+            generation = scanner.generation
+
         for place in places:
             for full_path in shared.walk_files(place, allowed_extensions=ext_filter):
                 if os.path.islink(full_path) and not os.path.exists(full_path):
@@ -84,12 +96,203 @@ def load_models(model_path: str, model_url: str = None, command_path: str = None
             else:
                 output.append(model_url)
 
+        walked = True
     except Exception:
         pass
 
+    if scanner is not None:
+        if walked:
+            scanner.update(places, output, generation)
+        elif scanner.places is not None:
+            # a partial listing would show the files it missed as removed; keep the previous one
+            return scanner.paths()
+
     return output
 
 
+class ModelScanner:
+    """
+    Snapshot of the files load_models found, {path: (size, mtime, inode)}, diffed on every scan so that callers
+    rebuild only entries for files that were added, removed or changed. Changes also go to a numbered feed that
+    the API polls with changes(since) instead of relisting. With watch(), an inotify watcher (Linux) marks the
+    snapshot stale when something below the scanned directories changes; until then load_models reuses it
+    without walking the directories at all. Each change bumps `generation`, so a scan that overlapped one stays
+    stale and the next load_models walks again.
+    """
+
+    def __init__(self, feed_size: int = 1024):
+        self.snapshot = {}
+        self.places = None
+        self.added = []
+        self.removed = []
+        self.changed = []
+        self.feed = collections.deque(maxlen=feed_size)
+        self.seq = 0
+        self.lock = threading.Lock()
+        self.watcher = None
+        self.stale = True
+        self.generation = 0
+
+    def is_current(self, places) -> bool:
+        return self.watcher is not None and self.watcher.is_alive() and not self.stale and places == self.places
+
+    def paths(self) -> list:
+        with self.lock:
+            self.added, self.removed, self.changed = [], [], []
+            return list(self.snapshot)
+
+    def update(self, places, paths, generation: int):
+        """Records a finished walk; `generation` is the value it had before the walk started."""
+
+        snapshot = {}
+        for path in paths:
+            try:
+                st = os.stat(path)
+                snapshot[path] = (st.st_size, st.st_mtime_ns, st.st_ino)
+            except OSError:
+                snapshot[path] = None
+
+        with self.lock:
+            first_scan = self.places is None
+            previous = self.snapshot
+            self.added = [path for path in snapshot if path not in previous]
+            self.removed = [path for path in previous if path not in snapshot]
+            self.changed = [path for path in snapshot if path in previous and snapshot[path] != previous[path]]
+            self.snapshot = snapshot
+            self.places = list(places)
+            # a change seen while walking may have come after the walk passed its directory
+            self.stale = generation != self.generation
+
+            # the first scan is the initial listing rather than a change
+            if not first_scan:
+                for change, changed_paths in (("removed", self.removed), ("added", self.added), ("changed", self.changed)):
+                    for path in changed_paths:
+                        self.seq += 1
+                        self.feed.append({"seq": self.seq, "change": change, "filename": path})
+
+        if self.watcher is not None:
+            # directories created below watched ones get their watch from the create event
+            self.watcher.add_places([place for place in self.places if place not in self.watcher.directories])
+
+    def changes(self, since: int = 0) -> dict:
+        """Changes numbered after `since`; `reset` means some have already left the feed and the client should relist."""
+
+        with self.lock:
+            oldest = self.feed[0]["seq"] if self.feed else self.seq + 1
+            return {
+                "seq": self.seq,
+                "reset": since < oldest - 1,
+                "changes": [item for item in self.feed if item["seq"] > since],
+            }
+
+    def mark_stale(self):
+        with self.lock:
+            self.generation += 1
+            self.stale = True
+
+    def watch(self, on_change: Callable = None, delay: float = 1.0) -> bool:
+        """
+        Starts an inotify watcher over the scanned directories; on_change() is called once changes have been quiet
+        for `delay` seconds. Returns False where inotify is unavailable; scans then keep walking every time.
+        """
+
+        if self.watcher is not None and self.watcher.is_alive():
+            return True
+
+        try:
+            self.watcher = InotifyWatcher(self, on_change, delay)
+        except OSError as e:
+            logger.warning("Not watching model directories: %s", e)
+            self.watcher = None
+            return False
+
+        self.mark_stale()
+        if self.places is not None:
+            self.watcher.add_places(self.places)
+        self.watcher.start()
+        return True
+
+
+class InotifyWatcher(threading.Thread):
+    IN_MODIFY = 0x2
+    IN_ATTRIB = 0x4
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_DELETE_SELF = 0x400
+    IN_MOVE_SELF = 0x800
+    IN_IGNORED = 0x8000
+    IN_ISDIR = 0x40000000
+    mask = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+
+    def __init__(self, scanner: ModelScanner, on_change: Callable, delay: float):
+        super().__init__(name="model directory watcher", daemon=True)
+
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on Linux")
+
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init()
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init failed")
+
+        self.scanner = scanner
+        self.on_change = on_change
+        self.delay = delay
+        self.watched = {}
+        self.directories = set()
+
+    def add_places(self, places):
+        for place in places:
+            for root, _, _ in os.walk(place, followlinks=True):
+                self.add_watch(root)
+
+    def add_watch(self, directory):
+        if directory in self.directories:
+            return
+
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), self.mask)
+        if wd >= 0:
+            self.watched[wd] = directory
+            self.directories.add(directory)
+
+    def read_events(self):
+        data = os.read(self.fd, 64 * 1024)
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = struct.unpack_from("iIII", data, offset)
+            name = data[offset + 16:offset + 16 + length].rstrip(b"\0")
+            offset += 16 + length
+
+            # the kernel dropped the watch (directory removed); watch it again if it comes back
+            if mask & self.IN_IGNORED:
+                self.directories.discard(self.watched.pop(wd, None))
+                continue
+
+            # watch new subdirectories too; inotify is not recursive
+            if mask & self.IN_ISDIR and mask & (self.IN_CREATE | self.IN_MOVED_TO) and wd in self.watched:
+                self.add_places([os.path.join(self.watched[wd], os.fsdecode(name))])
+
+    def run(self):
+        import select
+
+        while True:
+            self.read_events()
+            self.scanner.mark_stale()
+
+            # let a copy in progress finish before reporting the change
+            while select.select([self.fd], [], [], self.delay)[0]:
+                self.read_events()
+
+            if self.on_change is not None:
+                try:
+                    self.on_change()
+                except Exception:
+                    logger.exception("Error refreshing models after a directory change")
+
+
 def friendly_name(file: str):
     if file.startswith("http"):
         file = urlparse(file).path
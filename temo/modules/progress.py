@@ -14,6 +14,7 @@ import random
 from typing import List
 
 current_task = None
+batched_tasks = set()  # tasks running in the same batch as current_task
 pending_tasks = OrderedDict()
 finished_tasks = []
 recorded_results = []
@@ -27,11 +28,20 @@ def start_task(id_task):
     pending_tasks.pop(id_task, None)
 
 
+def start_batch(id_tasks):
+    start_task(id_tasks[0])
+
+    for id_task in id_tasks[1:]:
+        pending_tasks.pop(id_task, None)
+        batched_tasks.add(id_task)
+
+
 def finish_task(id_task):
     global current_task
 
     if current_task == id_task:
         current_task = None
+    batched_tasks.discard(id_task)
 
     finished_tasks.append(id_task)
     if len(finished_tasks) > 16:
@@ -85,7 +95,7 @@ def get_pending_tasks():
 
 
 def progressapi(req: ProgressRequest):
-    active = req.id_task == current_task
+    active = req.id_task == current_task or req.id_task in batched_tasks
     queued = req.id_task in pending_tasks
     completed = req.id_task in finished_tasks
 
@@ -12,7 +12,7 @@ from omegaconf import OmegaConf, ListConfig
 from urllib import request
 import ldm.modules.midas as midas
 
-from modules import paths, shared, modelloader, devices, script_callbacks, sd_vae, sd_disable_initialization, errors, hashes, sd_models_config, sd_unet, sd_models_xl, cache, extra_networks, processing, lowvram, sd_hijack, patches
+from modules import paths, shared, modelloader, devices, script_callbacks, sd_vae, sd_disable_initialization, errors, hashes, sd_models_config, sd_unet, sd_models_xl, extra_networks, model_index, processing, lowvram, sd_hijack, patches
 from modules.timer import Timer
 from modules.shared import opts
 import tomesd
@@ -24,7 +24,11 @@ model_path = os.path.abspath(os.path.join(paths.models_path, model_dir))
 checkpoints_list = {}
 checkpoint_aliases = {}
 checkpoint_alisases = checkpoint_aliases  # for compatibility with old name
+# list_models replaces the two dicts above with new ones instead of clearing them, so readers never see a partial list;
+# writers hold this lock so an entry registered while the new list is built is not lost in the swap
+checkpoints_lock = threading.RLock()
 checkpoints_loaded = collections.OrderedDict()
+checkpoint_scanner = modelloader.ModelScanner()
 
 
 class ModelType(enum.Enum):
@@ -71,16 +75,14 @@ class CheckpointInfo:
         if name.startswith("\\") or name.startswith("/"):
             name = name[1:]
 
-        def read_metadata():
-            metadata = read_metadata_from_safetensors(filename)
-            self.modelspec_thumbnail = metadata.pop('modelspec.thumbnail', None)
-
-            return metadata
-
         self.metadata = {}
+        self.model_type = None
         if self.is_safetensors:
             try:
-                self.metadata = cache.cached_data_for_file('safetensors-metadata', "checkpoint/" + name, filename, read_metadata)
+                # header-only index: the file is read again only when its mtime or size changes
+                index_entry = model_index.entry(filename)
+                self.metadata = index_entry["metadata"]
+                self.model_type = index_entry["model_type"]
             except Exception as e:
                 errors.display(e, f"reading metadata for {filename}")
 
@@ -99,12 +101,20 @@ class CheckpointInfo:
         if self.shorthash:
             self.ids += [self.shorthash, self.sha256, f'{self.name} [{self.shorthash}]', f'{self.name_for_extra} [{self.shorthash}]']
 
-    def register(self):
-        checkpoints_list[self.title] = self
+    def register(self, checkpoints=None, aliases=None):
+        checkpoints = checkpoints_list if checkpoints is None else checkpoints
+        aliases = checkpoint_aliases if aliases is None else aliases
+
+        checkpoints[self.title] = self
         for id in self.ids:
-            checkpoint_aliases[id] = self
+            aliases[id] = self
 
     def calculate_shorthash(self):
+        if self.sha256 is None and shared.opts.sd_checkpoint_hash_in_background and not shared.cmd_opts.no_hashing:
+            if hashes.sha256_from_cache(self.filename, f"checkpoint/{self.name}") is None:
+                self.hash_in_background(priority=True)
+                return self.shorthash
+
         self.sha256 = hashes.sha256(self.filename, f"checkpoint/{self.name}")
         if self.sha256 is None:
             return
@@ -122,11 +132,27 @@ class CheckpointInfo:
         self.title = f'{self.name} [{self.shorthash}]'
         self.short_title = f'{self.name_for_extra} [{self.shorthash}]'
 
-        replace_key(checkpoints_list, old_title, self.title, self)
-        self.register()
+        with checkpoints_lock:
+            replace_key(checkpoints_list, old_title, self.title, self)
+            self.register()
 
         return self.shorthash
 
+    def hash_in_background(self, priority=False):
+        hashes.hashing_service.submit(self.filename, f"checkpoint/{self.name}", priority=priority, callback=self.hashed_in_background)
+
+    def hashed_in_background(self, job):
+        # list_models may have replaced this object while the file was hashed; the new one has its own callback
+        if job.sha256 is None or checkpoint_aliases.get(self.name) is not self:
+            return
+
+        self.calculate_shorthash()
+
+        sd_model = model_data.sd_model
+        if sd_model is not None and getattr(sd_model, "sd_checkpoint_info", None) is self:
+            sd_model.sd_model_hash = self.shorthash
+            shared.opts.data["sd_checkpoint_hash"] = self.sha256
+
 
 try:
     # this silences the annoying "Some weights of the model checkpoint were not used when initializing..." message at start.
@@ -151,30 +177,55 @@ def checkpoint_tiles(use_short=False):
 
 
 def list_models():
-    checkpoints_list.clear()
-    checkpoint_aliases.clear()
+    global checkpoints_list, checkpoint_aliases, checkpoint_alisases
 
-    cmd_ckpt = shared.cmd_opts.ckpt
-    if shared.cmd_opts.no_download_sd_model or cmd_ckpt != shared.sd_model_file or os.path.exists(cmd_ckpt):
-        model_url = None
-        expected_sha256 = None
-    else:
-        model_url = f"{shared.hf_endpoint}/runwayml/stable-diffusion-v1-5/resolve/main/v1-5-pruned-emaonly.safetensors"
-        expected_sha256 = '6ce0161689b3853acaa03779ec93eafe75a02f4ced659bee03f50797806fa2fa'
+    with checkpoints_lock:
+        new_list, new_aliases = {}, {}
+        previous = {info.filename: info for info in checkpoints_list.values()}
+
+        cmd_ckpt = shared.cmd_opts.ckpt
+        if shared.cmd_opts.no_download_sd_model or cmd_ckpt != shared.sd_model_file or os.path.exists(cmd_ckpt):
+            model_url = None
+            expected_sha256 = None
+        else:
+            model_url = f"{shared.hf_endpoint}/runwayml/stable-diffusion-v1-5/resolve/main/v1-5-pruned-emaonly.safetensors"
+            expected_sha256 = '6ce0161689b3853acaa03779ec93eafe75a02f4ced659bee03f50797806fa2fa'
+
+        model_list = modelloader.load_models(model_path=model_path, model_url=model_url, command_path=shared.cmd_opts.ckpt_dir, ext_filter=[".ckpt", ".safetensors"], download_name="v1-5-pruned-emaonly.safetensors", ext_blacklist=[".vae.ckpt", ".vae.safetensors"], hash_prefix=expected_sha256, scanner=checkpoint_scanner)
+
+        if os.path.exists(cmd_ckpt):
+            checkpoint_info = CheckpointInfo(cmd_ckpt)
+            checkpoint_info.register(new_list, new_aliases)
 
-    model_list = modelloader.load_models(model_path=model_path, model_url=model_url, command_path=shared.cmd_opts.ckpt_dir, ext_filter=[".ckpt", ".safetensors"], download_name="v1-5-pruned-emaonly.safetensors", ext_blacklist=[".vae.ckpt", ".vae.safetensors"], hash_prefix=expected_sha256)
+            shared.opts.data['sd_model_checkpoint'] = checkpoint_info.title
+        elif cmd_ckpt is not None and cmd_ckpt != shared.default_sd_model_file:
+            print(f"Checkpoint in --ckpt argument not found (Possible it was moved to {model_path}: {cmd_ckpt}", file=sys.stderr)
 
-    if os.path.exists(cmd_ckpt):
-        checkpoint_info = CheckpointInfo(cmd_ckpt)
-        checkpoint_info.register()
+        # files the scanner saw unchanged keep their CheckpointInfo; only new or modified ones are read again
+        changed = set(checkpoint_scanner.changed)
+        for filename in model_list:
+            checkpoint_info = previous.get(filename)
+            if checkpoint_info is None or filename in changed:
+                checkpoint_info = CheckpointInfo(filename)
+            checkpoint_info.register(new_list, new_aliases)
 
-        shared.opts.data['sd_model_checkpoint'] = checkpoint_info.title
-    elif cmd_ckpt is not None and cmd_ckpt != shared.default_sd_model_file:
-        print(f"Checkpoint in --ckpt argument not found (Possible it was moved to {model_path}: {cmd_ckpt}", file=sys.stderr)
+        # the watcher thread runs this while requests read the lists: swap the finished ones in at once
+        checkpoints_list, checkpoint_aliases = new_list, new_aliases
+        checkpoint_alisases = checkpoint_aliases
 
-    for filename in model_list:
-        checkpoint_info = CheckpointInfo(filename)
-        checkpoint_info.register()
+    if shared.opts.sd_checkpoint_dir_watch:
+        checkpoint_scanner.watch(on_change=list_models)
+
+    listed = {os.path.abspath(info.filename) for info in new_list.values()}
+    # index entries of checkpoints that are gone, from both places checkpoints are listed from
+    for directory in (model_path, shared.cmd_opts.ckpt_dir):
+        if directory:
+            model_index.forget([entry["filename"] for entry in model_index.query(filename_prefix=directory) if entry["filename"] not in listed])
+
+    if shared.opts.sd_checkpoint_hash_in_background and not shared.cmd_opts.no_hashing:
+        for checkpoint_info in list(new_list.values()):
+            if checkpoint_info.sha256 is None:
+                checkpoint_info.hash_in_background()
 
 
 re_strip_checksum = re.compile(r"\s*\[[^]]+]\s*$")
@@ -282,31 +333,7 @@ def get_state_dict_from_checkpoint(pl_sd):
 
 
 def read_metadata_from_safetensors(filename):
-    import json
-
-    with open(filename, mode="rb") as file:
-        metadata_len = file.read(8)
-        metadata_len = int.from_bytes(metadata_len, "little")
-        json_start = file.read(2)
-
-        assert metadata_len > 2 and json_start in (b'{"', b"{'"), f"{filename} is not a safetensors file"
-
-        res = {}
-
-        try:
-            json_data = json_start + file.read(metadata_len-2)
-            json_obj = json.loads(json_data)
-            for k, v in json_obj.get("__metadata__", {}).items():
-                res[k] = v
-                if isinstance(v, str) and v[0:1] == '{':
-                    try:
-                        res[k] = json.loads(v)
-                    except Exception:
-                        pass
-        except Exception:
-             errors.report(f"Error reading metadata from file: {filename}", exc_info=True)
-
-        return res
+    return model_index.metadata(filename)
 
 
 def read_state_dict(checkpoint_file, print_global_state=False, map_location=None):
@@ -329,19 +356,57 @@ def read_state_dict(checkpoint_file, print_global_state=False, map_location=None
     return sd
 
 
+def uses_mapped_cache(checkpoint_info: CheckpointInfo):
+    return checkpoint_info.is_safetensors and shared.opts.sd_checkpoint_cache_mmap and not shared.opts.disable_mmap_load_safetensors
+
+
+class MappedCheckpoint:
+    """
+    Checkpoint cache entry for a memory-mapped .safetensors file. Only the path and its mtime/size are kept;
+    the file is mapped again on use, so its tensors are file-backed pages in the OS page cache, shared
+    between cache hits, rather than a resident copy of the weights per cached checkpoint.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.signature = self.stat()
+
+    def stat(self):
+        st = os.stat(self.filename)
+        return st.st_mtime, st.st_size
+
+    def is_current(self):
+        try:
+            return self.stat() == self.signature
+        except OSError:
+            return False
+
+    def state_dict(self):
+        # mapped on the CPU: load_state_dict copies each tensor from the page cache into the parameter on the device
+        return read_state_dict(self.filename, map_location="cpu")
+
+
 def get_checkpoint_state_dict(checkpoint_info: CheckpointInfo, timer):
     sd_model_hash = checkpoint_info.calculate_shorthash()
     timer.record("calculate hash")
 
-    if checkpoint_info in checkpoints_loaded:
+    cached = checkpoints_loaded.get(checkpoint_info)
+    if isinstance(cached, MappedCheckpoint) and not cached.is_current():
+        checkpoints_loaded.pop(checkpoint_info)
+        cached = None
+
+    if cached is not None:
         # use checkpoint cache
         print(f"Loading weights [{sd_model_hash}] from cache")
         # move to end as latest
         checkpoints_loaded.move_to_end(checkpoint_info)
-        return checkpoints_loaded[checkpoint_info]
+        if isinstance(cached, MappedCheckpoint):
+            cached = cached.state_dict()
+            timer.record("map weights from cache")
+        return cached
 
     print(f"Loading weights [{sd_model_hash}] from {checkpoint_info.filename}")
-    res = read_state_dict(checkpoint_info.filename)
+    res = read_state_dict(checkpoint_info.filename, map_location="cpu" if uses_mapped_cache(checkpoint_info) else None)
     timer.record("load weights from disk")
 
     return res
@@ -431,8 +496,11 @@ def load_model_weights(model, checkpoint_info: CheckpointInfo, state_dict, timer
         sd_hijack.model_hijack.convert_sdxl_to_ssd(model)
 
     if shared.opts.sd_checkpoint_cache > 0:
-        # cache newly loaded model
-        checkpoints_loaded[checkpoint_info] = state_dict.copy()
+        # cache newly loaded model; a mapped entry holds no tensors, so it does not duplicate the weights
+        if uses_mapped_cache(checkpoint_info):
+            checkpoints_loaded[checkpoint_info] = MappedCheckpoint(checkpoint_info.filename)
+        else:
+            checkpoints_loaded[checkpoint_info] = state_dict.copy()
 
     if hasattr(model, "before_load_weights"):
         model.before_load_weights(state_dict)
@@ -125,6 +125,7 @@ options_templates.update(options_section(('system', "System", "system"), {
     "enable_upscale_progressbar": OptionInfo(True, "Show a progress bar in the console for tiled upscaling."),
     "print_hypernet_extra": OptionInfo(False, "Print extra hypernetwork information to console."),
     "list_hidden_files": OptionInfo(True, "Load models/files in hidden directories").info("directory is hidden if its name starts with \".\""),
+    "hash_workers": OptionInfo(2, "Threads calculating model hashes", gr.Slider, {"minimum": 1, "maximum": 16, "step": 1}).info("files are hashed in parallel; a model that was just requested goes first"),
     "disable_mmap_load_safetensors": OptionInfo(False, "Disable memmapping for loading .safetensors files.").info("fixes very slow loading speed in some cases"),
     "hide_ldm_prints": OptionInfo(True, "Prevent Stability-AI's ldm/sgm modules from printing noise to console."),
     "dump_stacks_on_signal": OptionInfo(False, "Print stack traces before exiting the program with ctrl+c."),
@@ -150,6 +151,8 @@ options_templates.update(options_section(('API', "API", "system"), {
     "api_enable_requests": OptionInfo(True, "Allow http:// and https:// URLs for input images in API", restrict_api=True),
     "api_forbid_local_requests": OptionInfo(True, "Forbid URLs to local resources", restrict_api=True),
     "api_useragent": OptionInfo("", "User agent for requests", restrict_api=True),
+    "api_batch_max_size": OptionInfo(1, "Maximum number of txt2img/img2img API requests to run as one batch", gr.Slider, {"minimum": 1, "maximum": 16, "step": 1}).info("1 = off; only single-image requests without scripts whose settings match apart from prompt, negative prompt, seed and img2img init image are batched"),
+    "api_batch_max_wait": OptionInfo(0.05, "Time to wait for matching txt2img/img2img API requests before running a batch (sec)", gr.Number).info("the wait ends early once the batch is full"),
 }))
 
 options_templates.update(options_section(('training', "Training", "training"), {
@@ -172,6 +175,9 @@ options_templates.update(options_section(('sd', "Stable Diffusion", "sd"), {
     "sd_checkpoints_limit": OptionInfo(1, "Maximum number of checkpoints loaded at the same time", gr.Slider, {"minimum": 1, "maximum": 10, "step": 1}),
     "sd_checkpoints_keep_in_cpu": OptionInfo(True, "Only keep one model on device").info("will keep models other than the currently used one in RAM rather than VRAM"),
     "sd_checkpoint_cache": OptionInfo(0, "Checkpoints to cache in RAM", gr.Slider, {"minimum": 0, "maximum": 10, "step": 1}).info("obsolete; set to 0 and use the two settings above instead"),
+    "sd_checkpoint_dir_watch": OptionInfo(False, "Watch checkpoint directories and refresh the list when files change").info("Linux only (inotify); refreshing then skips the directory walk while nothing changed"),
+    "sd_checkpoint_hash_in_background": OptionInfo(False, "Calculate checkpoint hashes in the background").info("checkpoints can be used before their sha256 is known; titles and infotext get the hash once it is ready"),
+    "sd_checkpoint_cache_mmap": OptionInfo(False, "Cache .safetensors checkpoints as memory-mapped files").info("weights are copied from the mapped file straight into the model; a cached checkpoint then costs page cache instead of a copy in RAM"),
     "sd_unet": OptionInfo("Automatic", "SD Unet", gr.Dropdown, lambda: {"choices": shared_items.sd_unet_items()}, refresh=shared_items.refresh_unet_list).info("choose Unet model: Automatic = use one with same filename as checkpoint; None = use Unet from checkpoint"),
     "enable_quantization": OptionInfo(False, "Enable quantization in K samplers for sharper and cleaner results. This may change existing seeds").needs_reload_ui(),
     "emphasis": OptionInfo("Original", "Emphasis mode", gr.Radio, lambda: {"choices": [x.name for x in sd_emphasis.options]}, infotext="Emphasis").info("makes it possible to make model to pay (more:1.1) or (less:0.9) attention to text when you use the syntax in prompt; " + sd_emphasis.get_options_descriptions()),
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the tests import the webui's `modules` package, as launch.py makes it importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,30 @@
+from modules.api.api import img2img_batch_key, txt2img_batch_key
+
+
+def txt2img_args(**kwargs):
+    args = {"prompt": "a kolam", "negative_prompt": "", "seed": -1, "subseed": -1, "force_task_id": None, "steps": 20, "width": 512, "height": 512, "sampler_name": "Euler a", "cfg_scale": 7.0}
+    args.update(kwargs)
+    return args
+
+
+def test_txt2img_key_ignores_what_a_batch_varies_per_image():
+    key = txt2img_batch_key(txt2img_args(), [])
+    assert txt2img_batch_key(txt2img_args(prompt="a lotus", negative_prompt="blurry", seed=1, subseed=2, force_task_id="task(x)"), []) == key
+
+
+def test_txt2img_key_separates_other_settings():
+    key = txt2img_batch_key(txt2img_args(), [])
+    assert txt2img_batch_key(txt2img_args(steps=30), []) != key
+    assert txt2img_batch_key(txt2img_args(width=768), []) != key
+    assert txt2img_batch_key(txt2img_args(), [0.5]) != key
+
+
+def test_img2img_key_ignores_init_image_but_not_mask():
+    key = img2img_batch_key(txt2img_args(init_images=["AAAA"], mask=None, denoising_strength=0.75), [], None)
+    assert img2img_batch_key(txt2img_args(init_images=["BBBB"], mask=None, denoising_strength=0.75, seed=3), [], None) == key
+    assert img2img_batch_key(txt2img_args(init_images=["AAAA"], mask=None, denoising_strength=0.5), [], None) != key
+
+    masked = img2img_batch_key(txt2img_args(init_images=["AAAA"], mask=object(), denoising_strength=0.75), [], "MASK")
+    assert masked != key
+    assert img2img_batch_key(txt2img_args(init_images=["BBBB"], mask=object(), denoising_strength=0.75), [], "MASK") == masked
+    assert img2img_batch_key(txt2img_args(init_images=["AAAA"], mask=object(), denoising_strength=0.75), [], "OTHER") != masked
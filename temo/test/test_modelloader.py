@@ -0,0 +1,65 @@
+import os
+
+import pytest
+
+from modules import modelloader
+from modules.modelloader import ModelScanner
+
+
+def walk(place, allowed_extensions=None):
+    for root, _, files in os.walk(place):
+        for filename in sorted(files):
+            yield os.path.join(root, filename)
+
+
+@pytest.fixture
+def models(tmp_path, monkeypatch):
+    monkeypatch.setattr(modelloader.shared, "walk_files", walk, raising=False)
+    for name in ("a.safetensors", "b.safetensors"):
+        (tmp_path / name).write_bytes(b"x" * 10)
+    return tmp_path
+
+
+def scan(scanner, directory):
+    return modelloader.load_models(model_path=str(directory), ext_filter=[".safetensors"], scanner=scanner)
+
+
+def test_detects_added_removed_and_changed(models):
+    scanner = ModelScanner()
+    assert sorted(os.path.basename(path) for path in scan(scanner, models)) == ["a.safetensors", "b.safetensors"]
+    assert scanner.changes()["changes"] == []
+
+    (models / "a.safetensors").write_bytes(b"y" * 20)
+    (models / "b.safetensors").unlink()
+    (models / "c.safetensors").write_bytes(b"z")
+    scan(scanner, models)
+
+    assert [os.path.basename(path) for path in scanner.added] == ["c.safetensors"]
+    assert [os.path.basename(path) for path in scanner.removed] == ["b.safetensors"]
+    assert [os.path.basename(path) for path in scanner.changed] == ["a.safetensors"]
+    assert [item["change"] for item in scanner.changes()["changes"]] == ["removed", "added", "changed"]
+
+
+def test_change_during_walk_keeps_snapshot_stale(models):
+    scanner = ModelScanner()
+    generation = scanner.generation
+    scanner.mark_stale()  # an event that arrived while the directories were walked
+    scanner.update([str(models)], [str(models / "a.safetensors")], generation)
+    assert scanner.stale
+
+    scanner.update([str(models)], [str(models / "a.safetensors")], scanner.generation)
+    assert not scanner.stale
+
+
+def test_failed_walk_keeps_previous_snapshot(models, monkeypatch):
+    scanner = ModelScanner()
+    listed = scan(scanner, models)
+
+    def broken_walk(place, allowed_extensions=None):
+        yield os.path.join(place, "a.safetensors")
+        raise PermissionError(place)
+
+    monkeypatch.setattr(modelloader.shared, "walk_files", broken_walk, raising=False)
+    assert sorted(scan(scanner, models)) == sorted(listed)
+    assert scanner.removed == []
+    assert sorted(scanner.snapshot) == sorted(listed)